@@ -1,24 +1,104 @@
-import sounddevice as sd
 import numpy as np
-from threading import Lock
+import argparse
 import sys
 
+from audio_backend import BACKENDS, load_backend
+from device_cache import DeviceCache
+from dsp_engine import (AmpParams, ChannelLayout, MicLayout, MultiMicEngine, NoiseGate,
+                        SoftClipEngine, noise_gate)
+from events import EventPrinter, EventRing
+from instrumentation import CallbackStats, StatsDumper
+from latency_tuner import TuningStore, device_tuner, format_soak
+from control import DEFAULT_PORT, DEFAULT_SOCKET_PATH, ControlServer, parse_device
+from recorder import Recorder
+from resampler import DEFAULT_QUALITY, QUALITY, open_stream
+
+def device_entry(device, kind):
+    """Описание устройства для выбора: номер, имя, каналы (не больше двух), частота, драйвер"""
+    max_channels = device.max_input_channels if kind == 'input' else device.max_output_channels
+    return {
+        'id': device.index,
+        'name': device.name,
+        'channels': min(max_channels, 2),
+        'default_samplerate': device.default_samplerate,
+        'hostapi': device.hostapi,
+        'key': device.key,
+    }
+
 class MicrophoneAmplifier:
-    def __init__(self):
+    def __init__(self, stats_path=None, stats_format='jsonl', stats_interval=10.0,
+                 calibrate=False, resample_quality=DEFAULT_QUALITY, input_channel=None,
+                 output_channels=None, gate_db=None, record_path=None, record_dry=False,
+                 record_max_bytes=None, record_max_seconds=None, mics=None, backend=None,
+                 denoise=False, agc=None, rumble=False):
+        # Устройства: модуль sounddevice или audio_backend.SimulatedBackend
+        self.backend = backend if backend is not None else load_backend()
+        # Вход и выход работают на родных частотах, цепочка считает на частоте входа
         self.sample_rate = 48000
+        self.output_rate = 48000
+        self.resample_quality = resample_quality
+        # Каналы входа и выхода потока; моно-микрофон открывается одним каналом
+        self.input_channels = 2
         self.channels = 2
         self.dtype = np.float32
         self.block_size = 4096  # Увеличиваем размер буфера
-        self.gain = 5.0
-        self.gain_lock = Lock()
+        self.latency = 0.2  # Увеличиваем латентность для стабильности
+        # Размер блока и задержка из калибровки для пары устройств
+        self.calibrate = calibrate
+        self.tuning = TuningStore()
+        # Параметры обработки публикуются снимком, без блокировок
+        self.params = AmpParams(gain=5.0)
         self.input_device = None
         self.output_device = None
-        self.buffer = np.zeros((self.block_size, self.channels), dtype=self.dtype)
+        # Список устройств и проверенные настройки потока между запусками
+        self.device_cache = DeviceCache()
+        if mics:
+            # Несколько микрофонов (каналы входа mics, с нуля) одним проходом цепочки,
+            # у каждого своё усиление и свой канал выхода из output_channels
+            self.engine = MultiMicEngine(MicLayout(mics, output_channels), 'softclip', self.dtype,
+                                         sample_rate=self.sample_rate, agc=agc, rumble=rumble)
+            self.params = self.params._replace(
+                gains=np.full(len(mics), self.params.gain, dtype=self.dtype))
+        else:
+            self.engine = SoftClipEngine(self.dtype, sample_rate=self.sample_rate, denoise=denoise,
+                                         agc=agc, rumble=rumble)
+            # Какой канал входа обрабатывать и в какие каналы выхода слать (с нуля);
+            # без них цепочка сама считает один канал, пока каналы входа совпадают
+            self.engine.layout = ChannelLayout(input_channel, output_channels)
+        # Автоусиление: громкость держится около agc дБ, введённое усиление - предел
+        self.agc = agc
+        # Шумовой порог: ниже gate_db дБ вход не усиливается, цепочка не считается
+        if gate_db is not None:
+            self.engine.gate = noise_gate(gate_db)
+        elif denoise:
+            # Профиль шума набирается, пока порог закрыт: без порога учиться не на чем,
+            # поэтому --denoise без --noise-gate включает порог по умолчанию (-55 дБ)
+            self.engine.gate = NoiseGate()
+        # События из колбэка печатает отдельный поток, а не сам колбэк
+        self.events = EventRing()
+        # Необязательная диагностика колбэка с выгрузкой в файл
+        self.stats_path = stats_path
+        self.stats_format = stats_format
+        self.stats_interval = stats_interval
+        self.stats = None
+        # Запись выхода (и входа при record_dry) в файлы с ротацией
+        self.record_path = record_path
+        self.record_dry = record_dry
+        self.record_max_bytes = record_max_bytes
+        self.record_max_seconds = record_max_seconds
+        self.recorder = None
+        # Поток и то, что работает вместе с ним (start_audio / stop_audio)
+        self.stream = None
+        self.printer = None
+        self.dumper = None
+        # Замер колбэка и без файла диагностики: его спрашивают через сокет управления
+        self.collect_stats = False
         
     def list_devices(self):
         """Показать все доступные аудио устройства"""
         print("\n=== Доступные аудио устройства ===")
-        devices = sd.query_devices()
+        # Список из кэша сразу, устройства перечисляются заново в фоне (DeviceCache.lookup)
+        devices = self.device_cache.lookup(self.backend)
         input_devices = []
         output_devices = []
         
@@ -26,25 +106,17 @@ class MicrophoneAmplifier:
         print("Формат: [номер] название (каналы, частота дискретизации)")
         print("-" * 60)
         
-        for i, device in enumerate(devices):
-            if device['max_input_channels'] > 0:
-                channels = min(device['max_input_channels'], 2)
-                sample_rate = int(device['default_samplerate'])
-                hostapi = sd.query_hostapis(device['hostapi'])['name']
+        for device in devices:
+            if device.max_input_channels > 0:
+                channels = min(device.max_input_channels, 2)
                 
-                print(f"[{i}] {device['name']}")
+                print(f"[{device.index}] {device.name}")
                 print(f"    Каналов: {channels}")
-                print(f"    Частота: {sample_rate} Гц")
-                print(f"    Драйвер: {hostapi}")
+                print(f"    Частота: {device.default_samplerate} Гц")
+                print(f"    Драйвер: {device.hostapi}")
                 print("-" * 60)
                 
-                input_devices.append({
-                    'id': i,
-                    'name': device['name'],
-                    'channels': channels,
-                    'default_samplerate': sample_rate,
-                    'hostapi': hostapi
-                })
+                input_devices.append(device_entry(device, 'input'))
         
         if not input_devices:
             print("Микрофоны не найдены!")
@@ -54,33 +126,25 @@ class MicrophoneAmplifier:
         print("Формат: [номер] название (каналы, частота дискретизации)")
         print("-" * 60)
         
-        for i, device in enumerate(devices):
-            if device['max_output_channels'] > 0:
-                channels = min(device['max_output_channels'], 2)
-                sample_rate = int(device['default_samplerate'])
-                hostapi = sd.query_hostapis(device['hostapi'])['name']
+        for device in devices:
+            if device.max_output_channels > 0:
+                channels = min(device.max_output_channels, 2)
                 
-                print(f"[{i}] {device['name']}")
+                print(f"[{device.index}] {device.name}")
                 print(f"    Каналов: {channels}")
-                print(f"    Частота: {sample_rate} Гц")
-                print(f"    Драйвер: {hostapi}")
+                print(f"    Частота: {device.default_samplerate} Гц")
+                print(f"    Драйвер: {device.hostapi}")
                 print("-" * 60)
                 
-                output_devices.append({
-                    'id': i,
-                    'name': device['name'],
-                    'channels': channels,
-                    'default_samplerate': sample_rate,
-                    'hostapi': hostapi
-                })
+                output_devices.append(device_entry(device, 'output'))
         
         if not output_devices:
             print("Устройства вывода не найдены!")
             print("-" * 60)
         
         # Показываем текущие устройства по умолчанию
-        default_input = sd.query_devices(kind='input')
-        default_output = sd.query_devices(kind='output')
+        default_input = self.backend.query_devices(kind='input')
+        default_output = self.backend.query_devices(kind='output')
         
         print("\n--- Устройства по умолчанию ---")
         print(f"Микрофон: [{default_input['index']}] {default_input['name']}")
@@ -95,11 +159,8 @@ class MicrophoneAmplifier:
                 print("\nВыберите устройство ВВОДА (ваш микрофон):")
                 input_id = int(input("Номер устройства > "))
                 
-                for device in input_devices:
-                    if device['id'] == input_id:
-                        self.input_device = device
-                        break
-                if not self.input_device:
+                input_device = next((device for device in input_devices if device['id'] == input_id), None)
+                if not input_device:
                     print("Ошибка: Неверный номер устройства ввода")
                     continue
                 
@@ -107,85 +168,19 @@ class MicrophoneAmplifier:
                 print("Рекомендуется выбрать CABLE Input или похожее виртуальное устройство")
                 output_id = int(input("Номер устройства > "))
                 
-                for device in output_devices:
-                    if device['id'] == output_id:
-                        self.output_device = device
-                        break
-                if not self.output_device:
+                output_device = next((device for device in output_devices if device['id'] == output_id), None)
+                if not output_device:
                     print("Ошибка: Неверный номер устройства вывода")
                     continue
                 
-                # Устанавливаем фиксированные параметры для всех устройств
-                self.sample_rate = 48000  # Стандартная частота дискретизации
-                self.channels = 2  # Стерео
-                self.block_size = 1024  # Уменьшенный размер буфера
-                
-                # Пробуем создать тестовый поток с WASAPI
-                try:
-                    # Получаем индексы WASAPI-устройств
-                    devices = sd.query_devices()
-                    wasapi_devices = []
-                    
-                    for i, device in enumerate(devices):
-                        if device['hostapi'] == sd.query_hostapis().index('Windows WASAPI'):
-                            wasapi_devices.append(i)
-                    
-                    # Находим WASAPI-эквиваленты выбранных устройств
-                    wasapi_input = self.input_device['id']
-                    wasapi_output = self.output_device['id']
-                    
-                    for dev_id in wasapi_devices:
-                        device = devices[dev_id]
-                        if device['name'] == self.input_device['name']:
-                            wasapi_input = dev_id
-                        if device['name'] == self.output_device['name']:
-                            wasapi_output = dev_id
-                    
-                    # Создаем тестовый поток с WASAPI
-                    test_stream = sd.Stream(
-                        device=(wasapi_input, wasapi_output),
-                        channels=self.channels,
-                        samplerate=self.sample_rate,
-                        dtype=self.dtype,
-                        blocksize=self.block_size,
-                        latency='low'
-                    )
-                    
-                    # Если поток создался успешно, закрываем его
-                    test_stream.close()
-                    
-                    # Сохраняем WASAPI-индексы
-                    self.input_device['id'] = wasapi_input
-                    self.output_device['id'] = wasapi_output
-                    
-                    print("\nУстройства успешно настроены через WASAPI")
+                ok, error = self.configure_devices(input_device, output_device)
+                if ok:
                     return True
-                    
-                except Exception as e:
-                    print(f"\nОшибка при использовании WASAPI: {str(e)}")
-                    print("Пробуем стандартный режим...")
-                    
-                    try:
-                        # Пробуем создать поток в стандартном режиме
-                        test_stream = sd.Stream(
-                            device=(self.input_device['id'], self.output_device['id']),
-                            channels=self.channels,
-                            samplerate=self.sample_rate,
-                            dtype=self.dtype,
-                            blocksize=self.block_size,
-                            latency='high'  # Увеличиваем латентность для стабильности
-                        )
-                        test_stream.close()
-                        print("\nУстройства настроены в стандартном режиме")
-                        return True
-                        
-                    except Exception as e2:
-                        print(f"\nОшибка: Устройства несовместимы")
-                        print("Попробуйте другую комбинацию устройств")
-                        print(f"Техническая информация: {str(e2)}")
-                        self.input_device = None
-                        self.output_device = None
-                        continue
+                
+                print(f"\nОшибка: Устройства несовместимы")
+                print("Попробуйте другую комбинацию устройств")
+                print(f"Техническая информация: {error}")
+                continue
                 
             except ValueError:
                 print("Ошибка: Введите число")
@@ -193,34 +188,303 @@ class MicrophoneAmplifier:
                 print(f"Ошибка: {str(e)}")
                 continue
     
+    def configure_devices(self, input_device, output_device):
+        """Проверить пару устройств (сначала через WASAPI) и запомнить её, вернуть (ok, ошибка)"""
+        # Частоты не навязываем: каждое устройство работает на своей,
+        # каналы - по раскладке и возможностям устройств (probe_pair)
+        self.block_size = 1024  # Уменьшенный размер буфера
+        
+        # Список мог быть из кэша: номера сверяются с новым перечислением устройств
+        self.device_cache.wait()
+        input_info = self.device_cache.by_key(input_device['key'])
+        output_info = self.device_cache.by_key(output_device['key'])
+        if input_info is None or output_info is None:
+            missing = input_device if input_info is None else output_device
+            return False, f"устройство {missing['name']} отключено"
+        input_device = dict(input_device, id=input_info.index)
+        output_device = dict(output_device, id=output_info.index)
+        
+        # Находим WASAPI-эквиваленты выбранных устройств
+        wasapi_input = self.device_cache.find(input_info.name, 'Windows WASAPI')
+        wasapi_output = self.device_cache.find(output_info.name, 'Windows WASAPI')
+        if wasapi_input and wasapi_output:
+            ok, error = self.probe_pair(wasapi_input, wasapi_output, 'low')
+            if ok:
+                # Сохраняем WASAPI-индексы
+                self.input_device = dict(input_device, id=wasapi_input.index)
+                self.output_device = dict(output_device, id=wasapi_output.index)
+                print("\nУстройства успешно настроены через WASAPI")
+                return True, None
+            print(f"\nОшибка при использовании WASAPI: {error}")
+            print("Пробуем стандартный режим...")
+        
+        # Стандартный режим
+        ok, error = self.probe_pair(input_info, output_info, 'high')
+        if ok:
+            self.input_device = input_device
+            self.output_device = output_device
+            print("\nУстройства настроены в стандартном режиме")
+        return ok, error
+    
+    def find_device(self, value, kind):
+        """Устройство по номеру или части имени (для режима службы)"""
+        channels_key = 'max_input_channels' if kind == 'input' else 'max_output_channels'
+        devices = [device for device in self.device_cache.refresh(self.backend) if getattr(device, channels_key)]
+        if isinstance(value, int):
+            found = [device for device in devices if device.index == value]
+        else:
+            # Точное имя важнее частичного совпадения
+            found = ([device for device in devices if device.name == value]
+                     or [device for device in devices if value.lower() in device.name.lower()])
+        if not found:
+            raise ValueError(f"Не найдено устройство {'ввода' if kind == 'input' else 'вывода'}: {value}")
+        return device_entry(found[0], kind)
+    
+    def choose_channels(self, input_info, output_info):
+        """Каналы потока: не больше двух, а при явной раскладке - сколько она требует.
+
+        Возвращает текст ошибки, если у устройств столько каналов нет.
+        """
+        layout = self.engine.layout
+        if isinstance(layout, MicLayout):
+            self.input_channels = max(layout.inputs) + 1
+        elif layout.source is not None:
+            self.input_channels = layout.source + 1
+        else:
+            self.input_channels = min(input_info.max_input_channels, 2)
+        if layout.targets:
+            self.channels = max(layout.targets) + 1
+        else:
+            self.channels = min(output_info.max_output_channels, 2)
+        if (self.input_channels > input_info.max_input_channels
+                or self.channels > output_info.max_output_channels):
+            return (f"у устройств {input_info.max_input_channels} вх. и "
+                    f"{output_info.max_output_channels} вых. каналов, "
+                    f"раскладке нужно {self.input_channels} и {self.channels}")
+        return None
+    
+    def probe_pair(self, input_info, output_info, latency):
+        """Открываются ли устройства на родных частотах: из кэша или пробным потоком"""
+        error = self.choose_channels(input_info, output_info)
+        if error:
+            return False, error
+        self.sample_rate = input_info.default_samplerate
+        self.output_rate = output_info.default_samplerate
+        return self.device_cache.probe(self.backend, input_info, output_info,
+                                       channels=(self.input_channels, self.channels),
+                                       samplerate=self.sample_rate,
+                                       output_samplerate=self.output_rate, dtype=self.dtype,
+                                       blocksize=self.block_size, latency=latency)
+    
+    def apply_tuning(self):
+        """Размер блока и задержка для выбранной пары устройств: калибровка или сохранённые"""
+        names = (self.input_device['name'], self.output_device['name'], self.sample_rate)
+        if self.calibrate:
+            print("\nКалибровка: подбираем самый короткий буфер без сбоев...")
+            tuner = device_tuner(self.backend, (self.input_device['id'], self.output_device['id']),
+                                 (self.input_channels, self.channels), self.sample_rate, self.dtype,
+                                 self.prepare_callback,
+                                 progress=lambda result: print(format_soak(result)),
+                                 output_rate=self.output_rate, quality=self.resample_quality)
+            candidate, results = tuner.tune()
+            # События прогонов к работе не относятся
+            self.events.drain()
+            if candidate is None:
+                print("Калибровка: ни одна настройка не прошла без сбоев, оставляем стандартную")
+                return
+            self.tuning.put(*names, candidate, results)
+        else:
+            candidate = self.tuning.get(*names)
+            if candidate is None:
+                return
+        self.block_size, self.latency = candidate
+        print(f"Буфер: {self.block_size} кадров, задержка {self.latency}")
+
+    def prepare_callback(self, block_size):
+        """Цепочка под размер блока для прогона калибровки"""
+        self.engine.prepare(block_size, self.channels)
+        return self.audio_callback
+
     def audio_callback(self, indata, outdata, frames, time, status):
         if status:
-            # Игнорируем ошибки буферизации при запуске
-            if not 'priming output' in str(status):
-                print(f"Ошибка: {status}")
+            # Флаги уходят в кольцо событий, 'priming output' там отбрасывается
+            self.events.push_status(status)
         
         try:
-            with self.gain_lock:
-                # Копируем входные данные в промежуточный буфер
-                self.buffer[:frames] = indata
-                
-                # Применяем усиление с мягким клиппингом
-                amplified = self.buffer[:frames] * self.gain
-                
-                # Применяем мягкое ограничение для уменьшения искажений
-                processed = np.tanh(amplified)
-                
-                # Нормализация для предотвращения перегрузки
-                max_val = np.max(np.abs(processed))
-                if max_val > 0.95:
-                    processed *= 0.95 / max_val
-                
-                # Записываем в выходной буфер с плавным переходом
-                outdata[:] = processed
+            # Снимок параметров читаем один раз за блок
+            params = self.params
+            
+            # Усиление, tanh и нормализация в заранее выделенных буферах;
+            # с несколькими микрофонами усиление - вектор по микрофонам
+            gains = params.gains
+            self.engine.process(indata, outdata, params.gain if gains is None else gains)
                 
         except Exception as e:
-            print(f"Ошибка в обработке звука: {e}")
-            outdata[:] = indata
+            self.events.push_error(e)
+            # Тишина, а не вход как есть: каналов входа и выхода может быть разное
+            # число (--input-channel, --mics), и копия сама бросила бы исключение
+            outdata.fill(0)
+        
+        # Запись получает то же, что ушло на выход, копией в кольцо
+        recorder = self.recorder
+        if recorder is not None:
+            recorder.push(outdata, indata)
+    
+    def start_audio(self):
+        """Настроить цепочку под выбранные устройства и запустить поток"""
+        # Цепочка считает на частоте входа (окно ограничителя в кадрах)
+        self.engine.sample_rate = self.sample_rate
+        self.apply_tuning()
+        
+        # Буферы обработки выделяем до запуска потока
+        self.engine.prepare(self.block_size, self.channels)
+        
+        # Колбэк с замером времени, если нужна статистика
+        callback = self.audio_callback
+        self.stats = None
+        if self.stats_path or self.collect_stats:
+            self.stats = CallbackStats(self.sample_rate, self.engine.gate)
+            callback = self.stats.instrument(callback)
+        
+        # Создаем поток аудио с оптимизированными настройками; при разных
+        # частотах вход и выход открываются отдельно, между ними - ресемплер
+        stream = open_stream(
+            self.backend,
+            (self.input_device['id'], self.output_device['id']),
+            self.sample_rate,
+            self.output_rate,
+            quality=self.resample_quality,
+            channels=(self.input_channels, self.channels),
+            dtype=self.dtype,
+            blocksize=self.block_size,
+            callback=callback,
+            latency=self.latency,
+            prime_output_buffers_using_stream_callback=False  # Отключаем предварительную буферизацию
+        )
+        
+        if self.engine.gate is not None:
+            print(f"Шумовой порог: {self.engine.gate.open_db:g} дБ")
+        if self.engine.latency:
+            print(f"Задержка обработки: {self.engine.latency / self.sample_rate * 1000:.1f} мс")
+        if self.agc is not None:
+            print(f"Автоусиление: громкость {self.agc:g} дБ, усиление не больше {self.format_gain()}")
+        if self.record_path:
+            # Запись на частоте входа, как считает цепочка
+            self.recorder = Recorder(self.record_path, self.sample_rate, self.channels,
+                                     self.input_channels if self.record_dry else 0,
+                                     self.record_max_bytes, self.record_max_seconds, self.dtype)
+            self.recorder.start()
+            print(f"Запись: {self.record_path} (новый файл при ротации)")
+        
+        # Запускаем печать событий из колбэка и поток
+        self.printer = EventPrinter(self.events)
+        self.printer.start()
+        if self.stats_path:
+            self.dumper = StatsDumper(self.stats, self.stats_path, self.stats_interval,
+                                      self.stats_format, lambda: self.stream)
+            self.dumper.start()
+        self.stream = stream
+        stream.start()
+    
+    def stop_audio(self):
+        """Остановить поток и всё, что работало вместе с ним"""
+        if self.stream is not None:
+            self.stream.stop()
+            self.stream.close()
+            self.stream = None
+        if self.printer is not None:
+            self.printer.stop()
+            self.printer = None
+        if self.dumper is not None:
+            self.dumper.stop()
+            self.dumper = None
+        self.stop_recording()
+    
+    def set_gain(self, new_gain, mic=None):
+        """Опубликовать новое усиление (из консоли или сокета управления).
+
+        mic - номер микрофона с 1 (только с --mics), иначе усиление всех.
+        """
+        if not new_gain > 0:
+            raise ValueError("коэффициент должен быть больше 0")
+        params = self.params
+        if params.gains is None:
+            if mic is not None:
+                raise ValueError("номер микрофона задаётся только вместе с --mics")
+            self.params = params._replace(gain=new_gain)
+        elif mic is None:
+            self.params = params._replace(gain=new_gain, gains=np.full_like(params.gains, new_gain))
+        else:
+            if not 1 <= mic <= len(params.gains):
+                raise ValueError(f"нет микрофона {mic}, их {len(params.gains)}")
+            # Новый массив: колбэк может ещё читать прежний снимок
+            gains = params.gains.copy()
+            gains[mic - 1] = new_gain
+            self.params = params._replace(gains=gains)
+    
+    def gain_report(self):
+        """Усиление для ответов сокета управления"""
+        report = {'gain': self.params.gain}
+        if self.params.gains is not None:
+            report['gains'] = [float(gain) for gain in self.params.gains]
+        return report
+    
+    def format_gain(self):
+        gains = self.params.gains
+        if gains is None:
+            return f"{self.params.gain}x"
+        return ', '.join(f"{mic}: {gain:g}x" for mic, gain in enumerate(gains, 1))
+    
+    def print_setup(self):
+        print(f"\nНастройка завершена:")
+        print(f"Вход: {self.input_device['name']}")
+        print(f"Выход: {self.output_device['name']}")
+        print(f"Каналов: вход {self.input_channels}, выход {self.channels}")
+        layout = self.engine.layout
+        if isinstance(layout, MicLayout):
+            print("Микрофоны: " + ', '.join(
+                f"{mic}: вход {source + 1} -> выход {target + 1}"
+                for mic, (source, target) in enumerate(zip(layout.inputs, layout.outputs), 1)))
+        elif layout.source is not None or layout.targets:
+            source = layout.source + 1 if layout.source is not None else 1
+            targets = layout.targets or range(self.channels)
+            print(f"Раскладка: канал входа {source} -> каналы выхода "
+                  f"{', '.join(str(channel + 1) for channel in targets)}")
+        if self.output_rate == self.sample_rate:
+            print(f"Частота дискретизации: {self.sample_rate} Гц")
+        else:
+            print(f"Частота дискретизации: вход {self.sample_rate} Гц, выход {self.output_rate} Гц "
+                  f"(преобразование частоты, качество {self.resample_quality})")
+    
+    def command_loop(self):
+        """Команды из консоли, пока не 'q' или 'r'; возвращает эту команду"""
+        while True:
+            user_input = input("Введите команду > ").lower()
+            
+            if user_input in ('q', 'r'):
+                return user_input
+            
+            # 'N число' - усиление одного микрофона (с --mics)
+            parts = user_input.split()
+            try:
+                if not 1 <= len(parts) <= 2:
+                    raise ValueError
+                new_gain = float(parts[-1])
+                mic = int(parts[0]) if len(parts) == 2 else None
+            except ValueError:
+                print("Ошибка: введите число, 'q' для выхода или 'r' для смены устройств")
+                continue
+            try:
+                self.set_gain(new_gain, mic)
+            except ValueError as e:
+                print(f"Ошибка: {e}")
+                continue
+            if self.agc is not None:
+                print(f"Предел автоусиления установлен на: {self.format_gain()}")
+            else:
+                print(f"Усиление установлено на: {self.format_gain()}")
+            if new_gain > 10:
+                print("Внимание: Большое усиление может вызвать искажения!")
     
     def run(self):
         try:
@@ -228,68 +492,42 @@ class MicrophoneAmplifier:
             print("ВАЖНО: Для работы требуется установить VB-CABLE Virtual Audio Device")
             print("Скачать можно здесь: https://vb-audio.com/Cable/")
             
-            # Показываем доступные устройства
-            input_devices, output_devices = self.list_devices()
-            if not input_devices or not output_devices:
-                print("Ошибка: Не найдены необходимые аудио устройства")
-                return
-            
-            # Выбираем устройства
-            if not self.select_devices(input_devices, output_devices):
-                return
-            
-            print(f"\nНастройка завершена:")
-            print(f"Вход: {self.input_device['name']}")
-            print(f"Выход: {self.output_device['name']}")
-            print(f"Каналов: {self.channels}")
-            print(f"Частота дискретизации: {self.sample_rate} Гц")
-            
-            # Создаем поток аудио с оптимизированными настройками
-            stream = sd.Stream(
-                device=(self.input_device['id'], self.output_device['id']),
-                channels=self.channels,
-                samplerate=self.sample_rate,
-                dtype=self.dtype,
-                blocksize=self.block_size,
-                callback=self.audio_callback,
-                latency=0.2,  # Увеличиваем латентность для стабильности
-                prime_output_buffers_using_stream_callback=False  # Отключаем предварительную буферизацию
-            )
-            
-            print("\nУправление:")
-            print("- Введите число больше 1 для изменения усиления")
-            print("- Введите 'q' для выхода")
-            print("- Введите 'r' для выбора других устройств")
-            print(f"Текущее усиление: {self.gain}x\n")
-            
-            print("ВАЖНО: В настройках приложений выберите устройство вывода")
-            print(f"'{self.output_device['name']}' как микрофон\n")
-            
-            # Запускаем поток
-            with stream:
-                while True:
-                    user_input = input("Введите команду > ").lower()
+            # Смена устройств ('r') - новый круг цикла, а не рекурсивный вызов run()
+            while True:
+                # Показываем доступные устройства
+                input_devices, output_devices = self.list_devices()
+                if not input_devices or not output_devices:
+                    print("Ошибка: Не найдены необходимые аудио устройства")
+                    return
+                
+                # Выбираем устройства
+                if not self.select_devices(input_devices, output_devices):
+                    return
+                
+                self.print_setup()
+                try:
+                    self.start_audio()
+                    
+                    print("\nУправление:")
+                    if self.agc is not None:
+                        print("- Введите число для изменения предела автоусиления")
+                    else:
+                        print("- Введите число больше 1 для изменения усиления")
+                    if self.params.gains is not None:
+                        print("- Введите 'N число' для усиления микрофона N")
+                    print("- Введите 'q' для выхода")
+                    print("- Введите 'r' для выбора других устройств")
+                    print(f"Текущее усиление: {self.format_gain()}\n")
                     
-                    if user_input == 'q':
-                        break
-                    elif user_input == 'r':
-                        print("\nПереключение устройств...")
-                        stream.stop()
-                        return self.run()
+                    print("ВАЖНО: В настройках приложений выберите устройство вывода")
+                    print(f"'{self.output_device['name']}' как микрофон\n")
                     
-                    try:
-                        new_gain = float(user_input)
-                        if new_gain > 0:
-                            with self.gain_lock:
-                                self.gain = new_gain
-                            print(f"Усиление установлено на: {self.gain}x")
-                            if new_gain > 10:
-                                print("Внимание: Большое усиление может вызвать искажения!")
-                        else:
-                            print("Ошибка: коэффициент должен быть больше 0")
-                    except ValueError:
-                        if user_input not in ['q', 'r']:
-                            print("Ошибка: введите число, 'q' для выхода или 'r' для смены устройств")
+                    command = self.command_loop()
+                finally:
+                    self.stop_audio()
+                if command == 'q':
+                    break
+                print("\nПереключение устройств...")
 
         except KeyboardInterrupt:
             print("\nПрограмма остановлена")
@@ -297,11 +535,194 @@ class MicrophoneAmplifier:
             print(f"\nОшибка: {str(e)}")
         finally:
             print("\nУсилитель микрофона выключен")
+    
+    def run_daemon(self, input_value, output_value, socket_path=DEFAULT_SOCKET_PATH,
+                   port=DEFAULT_PORT):
+        """Работа службой: устройства из аргументов, управление через локальный сокет"""
+        self.collect_stats = True
+        try:
+            ok, error = self.configure_devices(self.find_device(input_value, 'input'),
+                                               self.find_device(output_value, 'output'))
+            if not ok:
+                print(f"Ошибка: Устройства несовместимы ({error})")
+                return False
+            self.print_setup()
+            server = ControlServer({
+                'get_gain': lambda message: self.gain_report(),
+                'set_gain': self.handle_set_gain,
+                'switch_devices': self.handle_switch_devices,
+                'stats': self.handle_stats,
+            }, socket_path, port)
+            # Второй экземпляр не должен открывать устройства и отбирать сокет у первого
+            server.claim()
+            try:
+                self.start_audio()
+                print(f"Управление: {server.address} (python control.py --help)")
+                server.run()
+            finally:
+                self.stop_audio()
+            return True
+        except KeyboardInterrupt:
+            print("\nПрограмма остановлена")
+            return True
+        except Exception as e:
+            print(f"\nОшибка: {str(e)}")
+            return False
+        finally:
+            print("\nУсилитель микрофона выключен")
+    
+    def handle_set_gain(self, message):
+        try:
+            new_gain = float(message['gain'])
+            mic = message.get('mic')
+            mic = None if mic is None else int(mic)
+        except (KeyError, TypeError, ValueError):
+            raise ValueError("нужно числовое поле gain (и целое mic, если задано)")
+        self.set_gain(new_gain, mic)
+        return self.gain_report()
+    
+    def handle_switch_devices(self, message):
+        """Переключить устройства на ходу: поток закрывается и открывается заново"""
+        input_device = self.find_device(message.get('input'), 'input')
+        output_device = self.find_device(message.get('output'), 'output')
+        previous = (self.input_device, self.output_device)
+        self.stop_audio()
+        ok, error = self.configure_devices(input_device, output_device)
+        if not ok:
+            # Пара не открывается: возвращаемся на прежние устройства
+            self.configure_devices(*previous)
+            self.start_audio()
+            raise ValueError(f"Устройства несовместимы: {error}")
+        self.print_setup()
+        self.start_audio()
+        return {'input': self.input_device['name'], 'output': self.output_device['name']}
+    
+    def handle_stats(self, message):
+        stream = self.stream
+        data = dict(
+            self.gain_report(),
+            input=self.input_device['name'],
+            output=self.output_device['name'],
+            sample_rate=self.sample_rate,
+            output_rate=self.output_rate,
+            block_size=self.block_size,
+            active=bool(stream is not None and stream.active),
+            callback=self.stats.snapshot(stream) if self.stats else None,
+        )
+        if self.recorder is not None:
+            data['recording'] = self.recorder.format()
+        return {'stats': data}
+
+    def stop_recording(self):
+        """Дописать запись после остановки потока"""
+        recorder = self.recorder
+        if recorder is None:
+            return
+        self.recorder = None
+        recorder.stop()
+        print(f"Запись: {recorder.format()}")
 
 def main():
+    parser = argparse.ArgumentParser(description="Усилитель микрофона")
+    parser.add_argument('--stats', metavar='PATH', help="записывать диагностику колбэка в файл")
+    parser.add_argument('--stats-format', choices=['jsonl', 'prometheus'], default='jsonl',
+                        help="формат файла диагностики")
+    parser.add_argument('--stats-interval', type=float, default=10.0,
+                        help="период записи диагностики, с")
+    parser.add_argument('--calibrate', action='store_true',
+                        help="подобрать размер буфера и задержку для выбранных устройств")
+    parser.add_argument('--resample-quality', choices=list(QUALITY), default=DEFAULT_QUALITY,
+                        help="качество преобразования частоты, если у входа и выхода она разная")
+    parser.add_argument('--input-channel', type=int, metavar='N',
+                        help="обрабатывать только канал N входа (с 1), для многоканальных устройств")
+    parser.add_argument('--output-channels', metavar='N,M',
+                        help="каналы выхода (с 1) для обработанного звука, остальные молчат; "
+                             "с --mics - по каналу на микрофон")
+    parser.add_argument('--mics', metavar='N,M,...',
+                        help="несколько микрофонов из каналов N, M, ... входа (с 1), по одному "
+                             "на ведущего: все считаются одним проходом цепочки")
+    parser.add_argument('--noise-gate', type=float, metavar='DB',
+                        help="шумовой порог, дБ от полной шкалы (например -55): "
+                             "тише порога выход молчит")
+    parser.add_argument('--denoise', action='store_true',
+                        help="спектральное шумоподавление (учится на шуме, пока порог закрыт; "
+                             "задержка около 10 мс). Включает и шумовой порог: -55 дБ, если "
+                             "не задан --noise-gate")
+    parser.add_argument('--agc', type=float, metavar='DB',
+                        help="автоусиление: держать громкость около DB дБ от полной шкалы "
+                             "(например -20); введённое усиление - его предел")
+    parser.add_argument('--rumble-filter', action='store_true',
+                        help="срезать гул и постоянную составляющую (80 Гц) до усиления")
+    parser.add_argument('--record', metavar='PATH',
+                        help="записывать выход в файлы PATH-<время>-<номер>.wav (.flac - FLAC)")
+    parser.add_argument('--record-dry', action='store_true',
+                        help="записывать и исходный звук микрофона (файлы -dry)")
+    parser.add_argument('--record-rotate-mb', type=float, metavar='MB',
+                        help="начинать новый файл записи после MB мегабайт")
+    parser.add_argument('--record-rotate-minutes', type=float, metavar='MIN',
+                        help="начинать новый файл записи каждые MIN минут")
+    parser.add_argument('--daemon', action='store_true',
+                        help="работать службой без консоли, управление через локальный сокет")
+    parser.add_argument('--input', metavar='DEVICE',
+                        help="микрофон для --daemon: номер или часть имени")
+    parser.add_argument('--output', metavar='DEVICE',
+                        help="выход для --daemon: номер или часть имени")
+    parser.add_argument('--socket', default=DEFAULT_SOCKET_PATH,
+                        help="путь к сокету управления для --daemon")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT,
+                        help="порт управления на 127.0.0.1, где нет Unix-сокетов")
+    parser.add_argument('--backend', choices=BACKENDS,
+                        help="звуковые устройства: portaudio или simulated (без звуковой карты); "
+                             "по умолчанию из MICSTRENGHT_BACKEND или portaudio")
+    args = parser.parse_args()
+    
+    input_channel = args.input_channel - 1 if args.input_channel else None
+    output_channels = None
+    if args.output_channels:
+        try:
+            output_channels = tuple(int(channel) - 1 for channel in args.output_channels.split(','))
+        except ValueError:
+            parser.error("--output-channels: номера каналов через запятую, например 1,2")
+        if min(output_channels) < 0:
+            parser.error("--output-channels: каналы нумеруются с 1")
+    if input_channel is not None and input_channel < 0:
+        parser.error("--input-channel: каналы нумеруются с 1")
+    mics = None
+    if args.mics:
+        try:
+            mics = tuple(int(channel) - 1 for channel in args.mics.split(','))
+        except ValueError:
+            parser.error("--mics: номера каналов через запятую, например 1,2,3")
+        if min(mics) < 0:
+            parser.error("--mics: каналы нумеруются с 1")
+        if input_channel is not None:
+            parser.error("--mics и --input-channel не сочетаются")
+        if output_channels is not None and len(output_channels) != len(mics):
+            parser.error("--output-channels с --mics: по одному каналу выхода на микрофон")
+        if args.denoise:
+            parser.error("--denoise и --mics не сочетаются")
+    if args.daemon and (args.input is None or args.output is None):
+        parser.error("--daemon: укажите устройства --input и --output")
+    
+    backend = load_backend(args.backend)
+    if backend is None:
+        print("Критическая ошибка: не найдена библиотека PortAudio (sounddevice)")
+        sys.exit(1)
     try:
-        amplifier = MicrophoneAmplifier()
-        amplifier.run()
+        amplifier = MicrophoneAmplifier(args.stats, args.stats_format, args.stats_interval,
+                                        args.calibrate, args.resample_quality, input_channel,
+                                        output_channels, args.noise_gate, args.record,
+                                        args.record_dry,
+                                        int(args.record_rotate_mb * 2 ** 20) if args.record_rotate_mb else None,
+                                        args.record_rotate_minutes * 60 if args.record_rotate_minutes else None,
+                                        mics=mics, backend=backend, denoise=args.denoise,
+                                        agc=args.agc, rumble=args.rumble_filter)
+        if args.daemon:
+            if not amplifier.run_daemon(parse_device(args.input), parse_device(args.output),
+                                        args.socket, args.port):
+                sys.exit(1)
+        else:
+            amplifier.run()
     except Exception as e:
         print(f"Критическая ошибка: {e}")
         sys.exit(1)
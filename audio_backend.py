@@ -0,0 +1,593 @@
+"""
+Звуковые устройства для потоков: PortAudio (sounddevice) или симуляция.
+
+Программа работает с устройствами через объект с частью интерфейса модуля
+sounddevice: query_devices, query_hostapis, Stream, InputStream,
+OutputStream. Настоящий бэкенд - сам модуль sounddevice, SimulatedBackend -
+устройства без звуковой карты:
+  - колбэки вызываются по виртуальным часам: в реальном времени из своего
+    потока (speed=1) или как можно быстрее, пока вызывающий крутит
+    run(seconds) (speed=None) - тогда час работы проходит за секунды;
+  - к пробуждению колбэка добавляется случайная задержка (экспоненциальная
+    со средним wakeup_ms и редкими выбросами до spike_ms). Если колбэк с
+    задержкой не уложился в длину блока плюс буфер устройства, следующий
+    блок получает флаг недогрузки выхода (у потока только входа -
+    переполнения входа), как от PortAudio; xrun_rate добавляет такие флаги
+    просто случайно;
+  - disconnect(name, at) убирает устройство: его потоки перестают
+    вызываться и становятся неактивны, открыть его снова нельзя до
+    reconnect();
+  - loopback - доля выхода, которая с задержкой loopback_delay
+    возвращается на вход поверх синтетического сигнала source;
+  - open_delay - сколько настоящих секунд занимает открытие потока, как у
+    медленного драйвера.
+Каждый поток считает вызовы, флаги по типам и опоздания колбэка
+(report()), бэкенд - виртуальное и настоящее время прогона.
+
+Выбор бэкенда: load_backend('portaudio' | 'simulated', **параметры
+симуляции) или переменная окружения MICSTRENGHT_BACKEND. Прогоны часами за секунды: soak.py.
+"""
+
+import os
+import threading
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from events import INPUT_OVERFLOW, INPUT_UNDERFLOW, OUTPUT_OVERFLOW, OUTPUT_UNDERFLOW
+from instrumentation import FLAG_KEYS
+
+BACKENDS = ('portaudio', 'simulated')
+BACKEND_ENV = 'MICSTRENGHT_BACKEND'
+
+SOURCES = ('speech', 'sine', 'noise', 'silence')
+# Сколько последних блоков поток помнит для оценки опозданий
+LATENESS_BLOCKS = 1 << 16
+# Длина петли выход -> вход
+LOOPBACK_SECONDS = 2.0
+# Размер блока, если поток открыт с blocksize=0 (PortAudio выбирает сам)
+DEFAULT_BLOCKSIZE = 512
+
+
+def load_backend(name=None, **simulation):
+    """Бэкенд по имени или из MICSTRENGHT_BACKEND; None, если нет PortAudio.
+
+    simulation - параметры SimulatedBackend, для PortAudio не нужны.
+    """
+    name = name or os.environ.get(BACKEND_ENV) or 'portaudio'
+    if name == 'simulated':
+        # В интерактивной программе симуляция идёт в реальном времени
+        return SimulatedBackend(**dict({'speed': 1.0}, **simulation))
+    if name != 'portaudio':
+        raise ValueError(f"Неизвестный бэкенд звука: {name} (нужен {' или '.join(BACKENDS)})")
+    try:
+        # Импорт sounddevice инициализирует PortAudio
+        import sounddevice
+    except (ImportError, OSError):
+        return None
+    return sounddevice
+
+
+def backend_name(backend):
+    """Имя для load_backend: процесс обработки открывает такой же бэкенд"""
+    return 'simulated' if isinstance(backend, SimulatedBackend) else 'portaudio'
+
+
+class PortAudioError(Exception):
+    """Ошибка симулированного устройства, как sd.PortAudioError"""
+
+
+class CallbackFlags:
+    """Флаги состояния как у sd.CallbackFlags: ложь, если флагов нет"""
+
+    __slots__ = ('flags',)
+
+    def __init__(self, flags=0):
+        self.flags = flags
+
+    def __bool__(self):
+        return bool(self.flags)
+
+    input_underflow = property(lambda self: bool(self.flags & INPUT_UNDERFLOW))
+    input_overflow = property(lambda self: bool(self.flags & INPUT_OVERFLOW))
+    output_underflow = property(lambda self: bool(self.flags & OUTPUT_UNDERFLOW))
+    output_overflow = property(lambda self: bool(self.flags & OUTPUT_OVERFLOW))
+    priming_output = property(lambda self: False)
+
+
+NO_FLAGS = CallbackFlags()
+
+
+class SimulatedTime(namedtuple('SimulatedTime', ['inputBufferAdcTime', 'outputBufferDacTime',
+                                                 'currentTime'])):
+    """Отметки времени колбэка, как time у sd.Stream, по виртуальным часам"""
+    __slots__ = ()
+
+
+def simulated_device(name, inputs, outputs, sample_rate, low_latency=0.005, high_latency=0.04):
+    """Описание устройства в формате sd.query_devices"""
+    return {
+        'name': name,
+        'hostapi': 0,
+        'max_input_channels': inputs,
+        'max_output_channels': outputs,
+        'default_samplerate': float(sample_rate),
+        'default_low_input_latency': low_latency,
+        'default_low_output_latency': low_latency,
+        'default_high_input_latency': high_latency,
+        'default_high_output_latency': high_latency,
+    }
+
+
+def default_devices(channels=2, sample_rate=48000, low_latency=0.005, high_latency=0.04):
+    """Микрофон, виртуальный кабель на той же частоте и динамики на 44100 Гц"""
+    return [
+        simulated_device('Simulated Microphone', channels, 0, sample_rate, low_latency, high_latency),
+        simulated_device('CABLE Input (Simulated)', 0, channels, sample_rate, low_latency,
+                         high_latency),
+        simulated_device('Simulated Speakers', 0, channels, 44100, low_latency, high_latency),
+    ]
+
+
+class SimulatedBackend:
+    """Устройства без звуковой карты с интерфейсом модуля sounddevice (см. описание модуля).
+
+    devices - описания как у simulated_device (по умолчанию default_devices()).
+    source - сигнал входа из SOURCES или массив (кадры, каналы), который
+    повторяется по кругу; source_level - его масштаб.
+    """
+
+    PortAudioError = PortAudioError
+    CallbackFlags = CallbackFlags
+
+    def __init__(self, devices=None, speed=None, source='speech', source_level=0.3, loopback=0.0,
+                 loopback_delay=0.01, wakeup_ms=0.0, spike_ms=0.0, spike_rate=0.0, xrun_rate=0.0,
+                 open_delay=0.0, seed=0):
+        self.devices = [dict(device) for device in (devices or default_devices())]
+        self.connected = [True] * len(self.devices)
+        self.speed = speed
+        if isinstance(source, str) and source not in SOURCES:
+            raise ValueError(f"Неизвестный сигнал: {source} (нужен один из {', '.join(SOURCES)})")
+        self.source = source
+        self.source_level = source_level
+        self.loopback = loopback
+        self.loopback_delay = loopback_delay
+        self.wakeup_ms = wakeup_ms
+        self.spike_ms = spike_ms
+        self.spike_rate = spike_rate
+        self.xrun_rate = xrun_rate
+        self.open_delay = open_delay
+        self.rng = np.random.default_rng(seed)
+        # Виртуальное время, с, и сколько настоящего времени заняли прогоны run()
+        self.time = 0.0
+        self.wall_time = 0.0
+        # Все потоки, включая закрытые: их счётчики нужны для отчёта
+        self.streams = []
+        self._active = []
+        # Отложенные отключения и подключения: (время, часть имени, подключено)
+        self._events = []
+        self._condition = threading.Condition(threading.RLock())
+        self._thread = None
+        self._loop = None
+        self._loop_rate = None
+        self._loop_end = 0
+
+    # --- интерфейс sounddevice ---
+
+    def query_devices(self, device=None, kind=None):
+        present = self._present()
+        if device is None and kind is None:
+            return [dict(info, index=index) for index, info in enumerate(present)]
+        info = self._find(device, kind)
+        return dict(info, index=present.index(info))
+
+    def query_hostapis(self, index=None):
+        present = self._present()
+        hostapi = {
+            'name': 'Simulated',
+            'devices': list(range(len(present))),
+            'default_input_device': next((index for index, info in enumerate(present)
+                                          if info['max_input_channels']), -1),
+            'default_output_device': next((index for index, info in enumerate(present)
+                                           if info['max_output_channels']), -1),
+        }
+        return [hostapi] if index is None else hostapi
+
+    def Stream(self, **settings):
+        return SimulatedStream(self, 'duplex', **settings)
+
+    def InputStream(self, **settings):
+        return SimulatedStream(self, 'input', **settings)
+
+    def OutputStream(self, **settings):
+        return SimulatedStream(self, 'output', **settings)
+
+    # --- управление симуляцией ---
+
+    def run(self, seconds):
+        """Прогнать seconds виртуального времени; в реальном времени - просто подождать"""
+        if self.speed:
+            time.sleep(seconds / self.speed)
+            return
+        start = time.perf_counter()
+        with self._condition:
+            until = self.time + seconds
+            while True:
+                stream = self._next_stream()
+                if stream is None or stream.next_due > until:
+                    break
+                self._advance(stream.next_due)
+                # Отложенное отключение могло остановить и этот поток
+                if stream.active:
+                    stream._tick(self._wakeup_delay())
+            self._advance(until)
+        self.wall_time += time.perf_counter() - start
+
+    def disconnect(self, name, at=None):
+        """Убрать устройство (часть имени) сейчас или в виртуальный момент at"""
+        self._schedule(name, False, at)
+
+    def reconnect(self, name, at=None):
+        self._schedule(name, True, at)
+
+    def report(self):
+        """Итог прогона: время и показания каждого потока"""
+        return {
+            'virtual_seconds': self.time,
+            'wall_seconds': self.wall_time,
+            'speedup': self.time / self.wall_time if self.wall_time else None,
+            'streams': [stream.report() for stream in self.streams],
+        }
+
+    # --- внутреннее ---
+
+    def _present(self):
+        return [info for info, connected in zip(self.devices, self.connected) if connected]
+
+    def _find(self, device, kind):
+        """Описание подключённого устройства по номеру, части имени или по умолчанию"""
+        present = self._present()
+        channels_key = f'max_{kind}_channels' if kind else None
+        if device is None:
+            found = [info for info in present if info[channels_key]]
+        elif isinstance(device, str):
+            found = [info for info in present if device.lower() in info['name'].lower()
+                     and (channels_key is None or info[channels_key])]
+        else:
+            found = [present[device]] if 0 <= device < len(present) else []
+            if found and channels_key and not found[0][channels_key]:
+                found = []
+        if not found:
+            raise PortAudioError(f"Нет устройства {'ввода' if kind == 'input' else 'вывода'}: "
+                                 f"{device}")
+        return found[0]
+
+    def _schedule(self, name, connected, at):
+        with self._condition:
+            if at is not None and at > self._now():
+                self._events.append((at, name, connected))
+                self._events.sort(key=lambda event: event[0])
+                self._condition.notify()
+            else:
+                self._set_connected(name, connected)
+
+    def _set_connected(self, name, connected):
+        for index, info in enumerate(self.devices):
+            if name.lower() not in info['name'].lower():
+                continue
+            self.connected[index] = connected
+            if not connected:
+                for stream in list(self._active):
+                    if any(device is info for device in stream.devices):
+                        stream._lose()
+
+    def _now(self):
+        if self.speed and self._thread is not None:
+            return self._virtual_start + (time.perf_counter() - self._wall_start) * self.speed
+        return self.time
+
+    def _advance(self, moment):
+        """Сдвинуть виртуальное время, выполнив отложенные отключения до moment"""
+        while self._events and self._events[0][0] <= moment:
+            at, name, connected = self._events.pop(0)
+            self.time = max(self.time, at)
+            self._set_connected(name, connected)
+        self.time = max(self.time, moment)
+
+    def _next_stream(self):
+        return min(self._active, key=lambda stream: stream.next_due, default=None)
+
+    def _wakeup_delay(self):
+        delay = self.rng.exponential(self.wakeup_ms) / 1000 if self.wakeup_ms else 0.0
+        if self.spike_rate and self.rng.random() < self.spike_rate:
+            delay += self.rng.uniform(0, self.spike_ms) / 1000
+        return delay
+
+    def _random_flags(self, stream):
+        if not self.xrun_rate or self.rng.random() >= self.xrun_rate:
+            return 0
+        choices = []
+        if stream.input_device is not None:
+            choices += [INPUT_UNDERFLOW, INPUT_OVERFLOW]
+        if stream.output_device is not None:
+            choices += [OUTPUT_UNDERFLOW, OUTPUT_OVERFLOW]
+        return choices[self.rng.integers(len(choices))]
+
+    def _start(self, stream):
+        with self._condition:
+            stream.next_due = self._now()
+            self._active.append(stream)
+            if self.speed and self._thread is None:
+                self._virtual_start = self.time
+                self._wall_start = time.perf_counter()
+                self._thread = threading.Thread(target=self._drive, daemon=True)
+                self._thread.start()
+            self._condition.notify()
+
+    def _stop(self, stream):
+        # Под блокировкой: если колбэк сейчас идёт, остановка ждёт его конца, как в PortAudio
+        with self._condition:
+            if stream in self._active:
+                self._active.remove(stream)
+            self._condition.notify()
+
+    def _drive(self):
+        """Поток реального времени: вызывает колбэки по часам speed"""
+        perf_counter = time.perf_counter
+        with self._condition:
+            while True:
+                stream = self._next_stream()
+                if stream is None and not self._events:
+                    self._condition.wait()
+                    # Простой не считается: часы продолжают с того же виртуального момента
+                    self._virtual_start = self.time
+                    self._wall_start = perf_counter()
+                    continue
+                moment = stream.next_due if stream is not None else self._events[0][0]
+                if self._events and self._events[0][0] < moment:
+                    moment = self._events[0][0]
+                    stream = None
+                wall_due = self._wall_start + (moment - self._virtual_start) / self.speed
+                wake = wall_due + (stream.wakeup / self.speed if stream is not None else 0.0)
+                delay = wake - perf_counter()
+                if delay > 0:
+                    self._condition.wait(delay)
+                    continue
+                self._advance(moment)
+                if stream is not None and stream.active:
+                    stream._tick((perf_counter() - wall_due) * self.speed)
+                    stream.wakeup = self._wakeup_delay()
+
+    def _fill_source(self, indata, frame, rate):
+        """Синтетический сигнал входа для кадров frame.. на частоте rate"""
+        source = self.source
+        level = self.source_level
+        if not isinstance(source, str):
+            positions = (frame + np.arange(len(indata))) % len(source)
+            indata[:] = source[positions, :indata.shape[1]] * level
+            return
+        if source == 'silence':
+            indata.fill(0)
+            return
+        if source == 'noise':
+            self.rng.standard_normal(out=indata, dtype=indata.dtype)
+            indata *= level
+            return
+        t = (frame + np.arange(len(indata))) / rate
+        if source == 'sine':
+            indata[:] = (level * np.sin(2 * np.pi * 440.0 * t))[:, np.newaxis]
+            return
+        # Речь: фразы по 1.25 с с паузами, внутри - слоги около 4 Гц
+        self.rng.standard_normal(out=indata, dtype=indata.dtype)
+        envelope = (np.sin(2 * np.pi * 0.4 * t) > 0) * (0.55 + 0.45 * np.sin(2 * np.pi * 4.0 * t))
+        indata *= (level * envelope)[:, np.newaxis].astype(indata.dtype)
+
+    def _loop_write(self, outdata, moment, rate):
+        """Запомнить выход в петле (первый канал), moment - время первого кадра"""
+        if self._loop is None:
+            self._loop_rate = rate
+            self._loop = np.zeros(int(LOOPBACK_SECONDS * rate), dtype=outdata.dtype)
+        if rate != self._loop_rate:
+            # Петля одна: пишет выход с той частотой, с которой начали
+            return
+        start = int(round(moment * rate))
+        positions = (start + np.arange(len(outdata))) % len(self._loop)
+        self._loop[positions] = outdata[:, 0]
+        self._loop_end = start + len(outdata)
+
+    def _loop_read(self, indata, moment, rate):
+        """Добавить ко входу выход loopback_delay секунд назад"""
+        if self._loop is None:
+            return
+        times = moment - self.loopback_delay + np.arange(len(indata)) / rate
+        positions = np.round(times * self._loop_rate).astype(np.int64)
+        valid = (positions >= 0) & (positions < self._loop_end) & (
+            positions >= self._loop_end - len(self._loop))
+        echo = np.where(valid, self._loop[positions % len(self._loop)], 0) * self.loopback
+        indata += echo[:, np.newaxis].astype(indata.dtype)
+
+
+class SimulatedStream:
+    """Поток SimulatedBackend с интерфейсом sd.Stream, sd.InputStream или sd.OutputStream"""
+
+    def __init__(self, backend, kind, samplerate=None, blocksize=None, device=None, channels=None,
+                 dtype=None, latency=None, callback=None, finished_callback=None, **settings):
+        if backend.open_delay:
+            # Медленный драйвер: вызывающий ждёт по-настоящему и в виртуальном режиме
+            time.sleep(backend.open_delay)
+        self.backend = backend
+        self.kind = kind
+        if kind == 'duplex':
+            input_device, output_device = (device if isinstance(device, (tuple, list))
+                                           else (device, device))
+            input_channels, output_channels = (channels if isinstance(channels, (tuple, list))
+                                               else (channels, channels))
+        else:
+            input_device = output_device = device
+            input_channels = output_channels = channels
+        self.input_device = backend._find(input_device, 'input') if kind != 'output' else None
+        self.output_device = backend._find(output_device, 'output') if kind != 'input' else None
+
+        info = self.input_device or self.output_device
+        self.samplerate = float(samplerate or info['default_samplerate'])
+        self.blocksize = blocksize or DEFAULT_BLOCKSIZE
+        self.dtype = np.dtype(dtype or 'float32')
+        if self.dtype != np.float32:
+            raise PortAudioError(f"Симуляция поддерживает только float32, а не {self.dtype}")
+        self.latency = self._latency_seconds(latency)
+        self.indata = self._buffer(self.input_device, 'input', input_channels)
+        self.outdata = self._buffer(self.output_device, 'output', output_channels)
+        self.channels = tuple(buffer.shape[1] for buffer in (self.indata, self.outdata)
+                              if buffer is not None)
+        self.callback = callback
+        self.finished_callback = finished_callback
+
+        self.active = False
+        self.closed = False
+        self.lost = False
+        self.cpu_load = 0.0
+        self.next_due = 0.0
+        self.wakeup = 0.0
+        self.frame = 0
+        self._pending = 0
+        # Счётчики для report()
+        self.callbacks = 0
+        self.cpu_time = 0.0
+        self.flag_counts = np.zeros(len(FLAG_KEYS), dtype=np.int64)
+        self.lateness = np.zeros(LATENESS_BLOCKS)
+        with backend._condition:
+            backend.streams.append(self)
+
+    @property
+    def devices(self):
+        return tuple(info for info in (self.input_device, self.output_device) if info is not None)
+
+    @property
+    def stopped(self):
+        return not self.active
+
+    @property
+    def time(self):
+        return self.backend._now()
+
+    def _latency_seconds(self, latency):
+        if latency is None:
+            latency = 'high'
+        if not isinstance(latency, str):
+            return float(latency)
+        values = [info[f'default_{latency}_{kind}_latency']
+                  for info, kind in ((self.input_device, 'input'), (self.output_device, 'output'))
+                  if info is not None]
+        return max(values)
+
+    def _buffer(self, info, kind, channels):
+        if info is None:
+            return None
+        available = info[f'max_{kind}_channels']
+        channels = channels or available
+        if channels > available:
+            raise PortAudioError(f"Invalid number of channels: {info['name']} ({kind}) - "
+                                 f"{available}, запрошено {channels}")
+        return np.zeros((self.blocksize, channels), dtype=self.dtype)
+
+    def start(self):
+        if self.closed:
+            raise PortAudioError("Поток уже закрыт")
+        backend = self.backend
+        if not all(backend.connected[backend.devices.index(info)] for info in self.devices):
+            raise PortAudioError("Устройство недоступно")
+        if not self.active:
+            self.active = True
+            backend._start(self)
+
+    def stop(self):
+        if self.active:
+            self.backend._stop(self)
+            self.active = False
+            if self.finished_callback is not None:
+                self.finished_callback()
+
+    abort = stop
+
+    def close(self):
+        self.stop()
+        self.closed = True
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+        self.close()
+
+    def _lose(self):
+        """Устройство пропало: колбэк больше не вызывается"""
+        self.lost = True
+        self.stop()
+
+    def _tick(self, wakeup):
+        """Один вызов колбэка; wakeup - опоздание пробуждения, с"""
+        backend = self.backend
+        period = self.blocksize / self.samplerate
+        due = self.next_due
+        flags = self._pending | backend._random_flags(self)
+        self._pending = 0
+        indata = self.indata
+        outdata = self.outdata
+        if indata is not None:
+            backend._fill_source(indata, self.frame, self.samplerate)
+            if backend.loopback:
+                backend._loop_read(indata, due - period, self.samplerate)
+        # Как у PortAudio: у потока только входа или только выхода время другой стороны 0
+        time_info = SimulatedTime(due - period if self.kind != 'output' else 0.0,
+                                  due + self.latency if self.kind != 'input' else 0.0, due)
+        status = CallbackFlags(flags) if flags else NO_FLAGS
+
+        begin = time.perf_counter()
+        if self.kind == 'duplex':
+            self.callback(indata, outdata, self.blocksize, time_info, status)
+        elif self.kind == 'input':
+            self.callback(indata, self.blocksize, time_info, status)
+        else:
+            self.callback(outdata, self.blocksize, time_info, status)
+        elapsed = time.perf_counter() - begin
+
+        if outdata is not None and backend.loopback:
+            backend._loop_write(outdata, due + self.latency, self.samplerate)
+        for index, (bit, _) in enumerate(FLAG_KEYS):
+            if flags & bit:
+                self.flag_counts[index] += 1
+        self.lateness[self.callbacks % LATENESS_BLOCKS] = wakeup
+        self.callbacks += 1
+        self.cpu_time += elapsed
+        self.cpu_load = self.cpu_time / (self.callbacks * period)
+        self.frame += self.blocksize
+        self.next_due = due + period
+        # Не уложился в блок и буфер устройства: у следующего блока сбой
+        if wakeup + elapsed > period + self.latency:
+            self._pending = OUTPUT_UNDERFLOW if outdata is not None else INPUT_OVERFLOW
+
+    def report(self):
+        """Вызовы, флаги по типам и опоздания колбэка (мс)"""
+        period = self.blocksize / self.samplerate
+        lateness = self.lateness[:min(self.callbacks, LATENESS_BLOCKS)] * 1000
+        data = {
+            'kind': self.kind,
+            'devices': [info['name'] for info in self.devices],
+            'samplerate': self.samplerate,
+            'blocksize': self.blocksize,
+            'latency': self.latency,
+            'callbacks': self.callbacks,
+            'seconds': self.callbacks * period,
+            'cpu_load': self.cpu_load,
+            'lost': self.lost,
+            'lateness_p50_ms': float(np.percentile(lateness, 50)) if len(lateness) else 0.0,
+            'lateness_p99_ms': float(np.percentile(lateness, 99)) if len(lateness) else 0.0,
+            'lateness_max_ms': float(lateness.max()) if len(lateness) else 0.0,
+            'late_blocks': int(np.sum(lateness > period * 1000)),
+        }
+        for index, (_, key) in enumerate(FLAG_KEYS):
+            data[key] = int(self.flag_counts[index])
+        return data
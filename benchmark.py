@@ -0,0 +1,822 @@
+"""
+Замеры производительности обработки звука без звуковых устройств.
+
+Колбэки всех трёх интерфейсов вызываются напрямую на синтетическом звуке,
+поэтому не нужны ни sounddevice, ни звуковая карта.
+
+Пример:
+    python benchmark.py callbacks --json bench.json
+    python benchmark.py callbacks --quick --compare bench.json
+    python benchmark.py waveshaper
+    python benchmark.py params
+    python benchmark.py limiter
+    python benchmark.py tuner
+    python benchmark.py resampler
+    python benchmark.py channels
+    python benchmark.py gate
+    python benchmark.py worker
+    python benchmark.py mics
+    python benchmark.py biquad
+    python benchmark.py denoise
+    python benchmark.py agc
+"""
+
+import argparse
+import datetime
+import functools
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import threading
+import time
+import types
+
+import numpy as np
+
+from dsp_engine import (ENGINES, RUMBLE_FILTER, AmpParams, AutoGain, BiquadCascade, BiquadSection, Chain,
+                        DistortionEngine, LevelMeter, LookaheadLimiter, MicLayout, MultiMicEngine,
+                        NoiseGate, SoftClipEngine, SpectralDenoiser, biquad_coefficients)
+from events import EventRing
+from latency_tuner import LatencyTuner, SimulatedDevice, format_soak
+from resampler import QUALITY, PolyphaseResampler
+
+
+def time_block(func, repeats=200):
+    """Среднее время одного вызова func в микросекундах"""
+    func()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        func()
+    return (time.perf_counter() - start) / repeats * 1e6
+
+
+def bench_waveshaper(block_sizes=(256, 1024, 4096), gains=(1.0, 10.0, 100.0), channels=2):
+    """Табличная кривая против точного расчёта: время на блок и ошибка"""
+    rng = np.random.default_rng(0)
+    print("Цепочка     Блок  Усиление  Точно,мкс  Таблица,мкс  Узлов   Оценка ош.  Факт. ош.")
+    for name, engine_class in (('distortion', DistortionEngine), ('softclip', SoftClipEngine)):
+        for gain in gains:
+            exact = engine_class()
+            shaped = engine_class()
+            shaped.build_table_now(gain)
+            table = shaped.table
+            for frames in block_sizes:
+                exact.prepare(frames, channels)
+                shaped.prepare(frames, channels)
+                indata = rng.uniform(-1, 1, (frames, channels)).astype(np.float32)
+                indata *= rng.uniform(0, 1, (frames, 1)).astype(np.float32) ** 3
+                expected = np.zeros_like(indata)
+                actual = np.zeros_like(indata)
+
+                exact_us = time_block(lambda: exact.process(indata, expected, gain))
+                if table is None:
+                    print(f"{name:<10} {frames:>5} {gain:>9g} {exact_us:>10.1f}  "
+                          "таблица не укладывается в допуск, используется точный расчёт")
+                    continue
+                table_us = time_block(lambda: shaped.process(indata, actual, gain))
+                error = float(np.max(np.abs(expected - actual)))
+                print(f"{name:<10} {frames:>5} {gain:>9g} {exact_us:>10.1f} {table_us:>12.1f} "
+                      f"{table.size:>6} {table.max_error:>11.2e} {error:>10.2e}")
+
+
+class LockedGain:
+    """Прежняя схема: усиление под Lock, который колбэк держит всю обработку"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.gain = 1.0
+        self.gain_lock = threading.Lock()
+
+    def set_gain(self, gain):
+        with self.gain_lock:
+            self.gain = gain
+
+    def callback(self, indata, outdata):
+        with self.gain_lock:
+            self.engine.process(indata, outdata, self.gain)
+
+
+class SnapshotGain:
+    """Новая схема: неизменяемый снимок параметров, публикуемый заменой ссылки"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.params = AmpParams(gain=1.0)
+
+    def set_gain(self, gain):
+        self.params = self.params._replace(gain=gain)
+
+    def callback(self, indata, outdata):
+        params = self.params
+        self.engine.process(indata, outdata, params.gain)
+
+
+def run_gain_stress(amp, frames=256, channels=2, sample_rate=48000, seconds=3.0):
+    """Колбэк по расписанию реального времени, пока другой поток без остановки меняет усиление.
+
+    Возвращает длительности колбэка в миллисекундах: от входа в колбэк до
+    выхода, включая ожидание блокировки, если она есть.
+    """
+    amp.engine.prepare(frames, channels)
+    indata = (np.random.default_rng(0).standard_normal((frames, channels)) * 0.05).astype(np.float32)
+    outdata = np.zeros_like(indata)
+    running = True
+
+    def hammer():
+        gain = 1.0
+        while running:
+            gain = 1.0 if gain > 50 else gain + 0.5
+            amp.set_gain(gain)
+            # Отдаём GIL, как поток интерфейса между событиями
+            time.sleep(0)
+
+    thread = threading.Thread(target=hammer, daemon=True)
+    thread.start()
+
+    period = frames / sample_rate
+    durations = []
+    start = time.perf_counter()
+    for block in range(int(seconds / period)):
+        due = start + block * period
+        while time.perf_counter() < due:
+            time.sleep(0)
+        begin = time.perf_counter()
+        amp.callback(indata, outdata)
+        durations.append((time.perf_counter() - begin) * 1000)
+
+    running = False
+    thread.join()
+    return np.array(durations), period * 1000
+
+
+def bench_params(frames=256, seconds=3.0):
+    """Lock против снимка параметров под постоянной сменой усиления"""
+    print(f"Блок {frames} кадров, {seconds:g} с под нагрузкой сменой усиления из другого потока")
+    print("Длительность колбэка:")
+    print("Схема       p50,мс  p99,мс  макс,мс  Дольше 1 мс  Дольше бюджета блока")
+    for name, amp_class in (('Lock', LockedGain), ('Снимок', SnapshotGain)):
+        durations, budget = run_gain_stress(amp_class(DistortionEngine()), frames, seconds=seconds)
+        slow = int(np.sum(durations > 1.0))
+        late = int(np.sum(durations > budget))
+        print(f"{name:<10} {np.percentile(durations, 50):>7.3f} {np.percentile(durations, 99):>7.3f} "
+              f"{durations.max():>8.3f}  {slow:>11}  {late} из {len(durations)}")
+
+
+BLOCK_SIZES = (64, 128, 256, 512, 1024, 2048, 4096)
+CHANNEL_COUNTS = (1, 2)
+SAMPLE_RATES = (44100, 48000)
+SIGNALS = ('sine', 'noise', 'silence', 'bursts')
+
+
+def make_signal(kind, frames, channels, sample_rate, rng):
+    """Синтетический сигнал длиной frames кадров (float32)"""
+    t = np.arange(frames) / sample_rate
+    if kind == 'sine':
+        mono = 0.3 * np.sin(2 * np.pi * 440 * t)
+    elif kind == 'noise':
+        mono = 0.1 * rng.standard_normal(frames)
+    elif kind == 'silence':
+        mono = np.zeros(frames)
+    elif kind == 'bursts':
+        # Похоже на речь: слоги по ~150 мс с паузами, громкие и с перегрузом
+        envelope = (np.sin(2 * np.pi * 3.3 * t) > 0.2) * (0.5 + 0.5 * np.sin(2 * np.pi * 0.7 * t))
+        carrier = np.sin(2 * np.pi * 180 * t) + 0.5 * rng.standard_normal(frames)
+        mono = np.clip(1.5 * envelope * carrier, -1, 1)
+    else:
+        raise ValueError(f"Неизвестный сигнал: {kind}")
+    return np.repeat(mono[:, np.newaxis], channels, axis=1).astype(np.float32)
+
+
+def gui_callback(frames, channels):
+    """Колбэк MicAmplifierGUI без окна: метод вызывается на минимальном состоянии"""
+    from mic_amplifier_gui import MicAmplifierGUI
+    from routing import ROUTE_CABLE, ProcessingGraph
+
+    state = types.SimpleNamespace(
+        graph=ProcessingGraph(DistortionEngine()),
+        params=AmpParams(gain=1.0, route=ROUTE_CABLE),
+        events=EventRing(),
+        recorder=None,
+    )
+    state.graph.prepare(frames, channels)
+    return functools.partial(MicAmplifierGUI.audio_callback, state)
+
+
+def app_callback(frames, channels):
+    """Колбэк app.MicrophoneAmplifier"""
+    import app
+
+    amplifier = app.MicrophoneAmplifier()
+    amplifier.channels = channels
+    amplifier.block_size = frames
+    amplifier.engine.prepare(frames, channels)
+    return amplifier.audio_callback
+
+
+def cli_callback(frames, channels):
+    """Колбэк mic_amplifier.MicrophoneAmplifier"""
+    import mic_amplifier
+
+    amplifier = mic_amplifier.MicrophoneAmplifier()
+    amplifier.channels = channels
+    amplifier.block_size = frames
+    amplifier.engine.prepare(frames, channels)
+    return amplifier.audio_callback
+
+
+FRONT_ENDS = (
+    ('gui', gui_callback),
+    ('app', app_callback),
+    ('mic_amplifier', cli_callback),
+)
+
+
+def measure_callback(callback, signal, frames, warmup=5):
+    """Время каждого блока в секундах, колбэк вызывается как из PortAudio"""
+    blocks = len(signal) // frames
+    outdata = np.zeros((frames, signal.shape[1]), dtype=np.float32)
+    times = np.zeros(blocks)
+    for block in range(warmup):
+        callback(signal[block * frames:(block + 1) * frames], outdata, frames, None, None)
+    for block in range(blocks):
+        indata = signal[block * frames:(block + 1) * frames]
+        start = time.perf_counter()
+        callback(indata, outdata, frames, None, None)
+        times[block] = time.perf_counter() - start
+    return times
+
+
+def bench_limiter(block_sizes=BLOCK_SIZES, channels=2, sample_rate=48000):
+    """Ограничитель пиков против нормализации по максимуму блока: время на блок"""
+    # Прежняя нормализация осталась только в тестах, для сравнения с исходной цепочкой
+    from tests.old_chain import PeakNormalizer
+
+    rng = np.random.default_rng(0)
+    print("Блок  Нормализация,мкс  Ограничитель,мкс  Задержка,кадров")
+    for frames in block_sizes:
+        signal = make_signal('bursts', frames, channels, sample_rate, rng) * 2
+        outdata = np.zeros_like(signal)
+        timings = []
+        for stage in (PeakNormalizer(0.95), LookaheadLimiter(0.95)):
+            chain = Chain([stage], sample_rate=sample_rate)
+            chain.prepare(frames, channels)
+            timings.append(time_block(lambda: chain.process(signal, outdata, 1.0), repeats=1000))
+        print(f"{frames:>5} {timings[0]:>17.1f} {timings[1]:>17.1f} {chain.latency:>16}")
+
+
+def bench_channels(block_sizes=(64, 256, 1024, 4096), channels=2, sample_rate=48000):
+    """Моно-микрофон в стереопотоке: один канал с копией в выход против обработки всех"""
+    rng = np.random.default_rng(0)
+    # Ограничитель считает общее усиление по кадрам, его цена от числа каналов почти
+    # не зависит; поэлементная часть distortion отдельно показывает выигрыш в чистом виде
+    chains = dict(ENGINES, shaper=lambda sample_rate: Chain(DistortionEngine().stages[:-1],
+                                                            sample_rate=sample_rate))
+    print("Цепочка     Блок  Стерео,мкс  Моно в стерео,мкс  Доля")
+    for name, engine_class in chains.items():
+        for frames in block_sizes:
+            mono = make_signal('noise', frames, 1, sample_rate, rng)
+            duplicated = np.repeat(mono, channels, axis=1)
+            stereo = make_signal('noise', frames, channels, sample_rate, rng)
+            outdata = np.zeros((frames, channels), dtype=np.float32)
+            timings = []
+            for signal in (stereo, duplicated):
+                engine = engine_class(sample_rate=sample_rate)
+                engine.prepare(frames, channels)
+                timings.append(time_block(lambda: engine.process(signal, outdata, 2.0), repeats=500))
+            print(f"{name:<10} {frames:>5} {timings[0]:>11.1f} {timings[1]:>18.1f} "
+                  f"{timings[1] / timings[0]:>5.2f}")
+
+
+def bench_gate(block_sizes=(64, 256, 1024, 4096), channels=2, sample_rate=48000, seconds=5.0):
+    """Шумовой порог: время на блок в тишине (шум микрофона) и в речи, с порогом и без"""
+    rng = np.random.default_rng(0)
+    length = int(seconds * sample_rate)
+    # Шум микрофона около -70 дБ и речь фразами по 1.25 с, в паузах тот же шум
+    t = np.arange(length)[:, np.newaxis] / sample_rate
+    phrases = (np.sin(2 * np.pi * 0.4 * t) > 0).astype(np.float32)
+    floor = (3e-4 * rng.standard_normal((length, 1))).astype(np.float32)
+    signals = {
+        'тишина': np.repeat(floor, channels, axis=1),
+        'речь': make_signal('bursts', length, channels, sample_rate, rng) * 0.3 * phrases + floor,
+    }
+    print("Сигнал  Блок  Без порога,мкс  С порогом,мкс  Быстрый путь  Переключений")
+    for name, signal in signals.items():
+        for frames in block_sizes:
+            timings = []
+            for gate in (None, NoiseGate()):
+                engine = DistortionEngine(sample_rate=sample_rate)
+                engine.gate = gate
+                engine.prepare(frames, channels)
+                outdata = np.zeros((frames, channels), dtype=np.float32)
+                blocks = length // frames
+                start = time.perf_counter()
+                for block in range(blocks):
+                    engine.process(signal[block * frames:(block + 1) * frames], outdata, 1000.0)
+                timings.append((time.perf_counter() - start) / blocks * 1e6)
+            print(f"{name:<6} {frames:>5} {timings[0]:>15.1f} {timings[1]:>14.1f} "
+                  f"{gate.closed_blocks / blocks:>13.0%} {gate.transitions:>13}")
+
+
+def synthetic_gui_load(seconds):
+    """Поток интерфейса под нагрузкой: обработчики на Python и длинные вызовы C, держащие GIL.
+
+    Цикл по элементам - перерисовка и пересчёт разметки в слотах на Python,
+    сортировка большого списка - заполнение выпадающего списка одним
+    вызовом, который не отдаёт GIL, пока не закончит.
+    """
+    rng = np.random.default_rng(0)
+    names = [f"Устройство {index:06d}" for index in rng.permutation(20000)]
+    until = time.perf_counter() + seconds
+    while time.perf_counter() < until:
+        total = 0
+        for index, name in enumerate(names):
+            total += len(name) ^ index
+        sorted(names)
+        time.sleep(0.01)
+
+
+def worker_config(frames, channels, sample_rate):
+    return dict(backend='simulated', device=None, sample_rate=sample_rate, output_rate=sample_rate,
+                channels=(channels, channels), block_size=frames, latency='low')
+
+
+def bench_worker(frames=256, channels=2, sample_rate=48000, seconds=5.0):
+    """Опоздания колбэка под нагрузкой окна: поток в процессе окна против dsp_worker"""
+    from audio_backend import SimulatedBackend
+    from dsp_worker import DspWorker
+    from routing import ROUTE_CABLE
+
+    budget_ms = frames / sample_rate * 1000
+    print(f"Блок {frames} кадров (бюджет {budget_ms:.2f} мс), {seconds:g} с, колбэк по часам "
+          "реального времени без звуковой карты")
+    print("Опоздание вызова колбэка от расписания:")
+    print("Режим                        p50,мс  p99,мс  макс,мс  Опоздали больше чем на блок")
+
+    def report(name, simulation):
+        print(f"{name:<28} {simulation['lateness_p50_ms']:>7.3f} "
+              f"{simulation['lateness_p99_ms']:>7.3f} {simulation['lateness_max_ms']:>8.2f}  "
+              f"{simulation['late_blocks']} из {simulation['callbacks']}")
+
+    for load in (False, True):
+        # Колбэк окна с той же цепочкой, что в процессе обработки
+        callback = gui_callback(frames, channels)
+        engine = callback.args[0].graph.engine
+        engine.meter = LevelMeter()
+        engine.prepare(frames, channels)
+        stream = SimulatedBackend(speed=1.0).Stream(samplerate=sample_rate, callback=callback,
+                                                   channels=channels, blocksize=frames,
+                                                   latency='low')
+        stream.start()
+        if load:
+            synthetic_gui_load(seconds)
+        else:
+            time.sleep(seconds)
+        stream.stop()
+        report("в процессе окна" + (", нагрузка" if load else ""), stream.report())
+
+    worker = DspWorker()
+    try:
+        worker.set_params(AmpParams(gain=1.0, route=ROUTE_CABLE))
+        worker.start(worker_config(frames, channels, sample_rate))
+        synthetic_gui_load(seconds)
+        worker.request_stats()
+        while worker.last_stats is None:
+            worker.conn.poll(1.0)
+            worker.poll()
+        report("dsp_worker, нагрузка", worker.last_stats['simulation'])
+    finally:
+        worker.close()
+
+
+MIC_COUNTS = (1, 2, 4, 8, 16, 32)
+
+
+def bench_mics(mic_counts=MIC_COUNTS, block_sizes=(256, 1024), sample_rate=48000):
+    """Несколько микрофонов: одна цепочка на все (MultiMicEngine) против цепочки на каждый.
+
+    Цепочка на микрофон - то, что считает каждый отдельный процесс app.py, но
+    в одном процессе. Отдельные процессы с колбэком целиком - bench_mic_processes.
+    """
+    rng = np.random.default_rng(0)
+    print("Цепочка     Блок  Микрофонов  Вместе,мкс  На микрофон,мкс  Отдельно на микрофон,мкс  "
+          "Выигрыш")
+    for kind in ('softclip', 'distortion'):
+        for frames in block_sizes:
+            single = ENGINES[kind](sample_rate=sample_rate)
+            single.prepare(frames, 1)
+            mono = make_signal('noise', frames, 1, sample_rate, rng)
+            mono_out = np.zeros_like(mono)
+            separate_us = time_block(lambda: single.process(mono, mono_out, 1.0))
+            for mics in mic_counts:
+                signal = (0.1 * rng.standard_normal((frames, mics))).astype(np.float32)
+                outdata = np.zeros_like(signal)
+                engine = MultiMicEngine(MicLayout(range(mics)), kind, sample_rate=sample_rate)
+                engine.prepare(frames, mics)
+                gains = np.linspace(1.0, 4.0, mics, dtype=np.float32)
+                us = time_block(lambda: engine.process(signal, outdata, gains))
+                print(f"{kind:<10} {frames:>5} {mics:>11} {us:>11.1f} {us / mics:>16.1f} "
+                      f"{separate_us:>25.1f} {separate_us * mics / us:>8.1f}x")
+
+
+def app_mics_callback(frames, mics):
+    """Колбэк app.MicrophoneAmplifier с --mics 1,...,mics"""
+    import app
+
+    amplifier = app.MicrophoneAmplifier(mics=tuple(range(mics)))
+    amplifier.channels = mics
+    amplifier.block_size = frames
+    amplifier.engine.prepare(frames, mics)
+    return amplifier.audio_callback
+
+
+def callback_cpu(frames, mics, blocks):
+    """Время CPU процесса на блок колбэка app.py в секундах.
+
+    mics=None - обычный app.py на один канал (процесс на микрофон), иначе --mics на mics каналов.
+    """
+    if mics is None:
+        callback, channels = app_callback(frames, 1), 1
+    else:
+        callback, channels = app_mics_callback(frames, mics), mics
+    rng = np.random.default_rng(channels)
+    signal = (0.1 * rng.standard_normal((frames * blocks, channels))).astype(np.float32)
+    outdata = np.zeros((frames, channels), dtype=np.float32)
+    for _ in range(5):
+        callback(signal[:frames], outdata, frames, None, None)
+    start = time.process_time()
+    for block in range(blocks):
+        callback(signal[block * frames:(block + 1) * frames], outdata, frames, None, None)
+    return (time.process_time() - start) / blocks
+
+
+def bench_mic_processes(mic_counts=MIC_COUNTS[:-1], frames=256, blocks=400):
+    """Процесс app.py на микрофон против одного app.py --mics: время CPU на блок.
+
+    Отдельные процессы работают одновременно (по одному на микрофон), каждый
+    считает время CPU только своего колбэка; их сумма - цена микрофонов
+    отдельными процессами. Не учтены память каждого процесса (интерпретатор
+    и numpy) и пробуждения потоков PortAudio, так что выигрыш --mics - оценка снизу.
+    """
+    context = multiprocessing.get_context('spawn')
+    print(f"app.py, блок {frames} кадров, {blocks} блоков, ядер {os.cpu_count()}; "
+          "время CPU на блок")
+    print("Микрофонов  Процессы,мкс  На микрофон,мкс  --mics,мкс  На микрофон,мкс  Выигрыш")
+    for mics in mic_counts:
+        with context.Pool(mics) as pool:
+            per_process = pool.starmap(callback_cpu, [(frames, None, blocks)] * mics)
+        separate_us = sum(per_process) * 1e6
+        batched_us = callback_cpu(frames, mics, blocks) * 1e6
+        print(f"{mics:>10} {separate_us:>13.1f} {separate_us / mics:>16.1f} {batched_us:>11.1f} "
+              f"{batched_us / mics:>16.1f} {separate_us / batched_us:>8.1f}x")
+
+
+# Каскады для замера фильтра: срез гула и он же с полкой и колоколом
+BIQUAD_CASCADES = (
+    ('срез', RUMBLE_FILTER),
+    ('срез+EQ', RUMBLE_FILTER + (BiquadSection('lowshelf', 200.0, 0.7, 4.0),
+                                 BiquadSection('peaking', 3000.0, 1.5, -3.0))),
+)
+
+
+def direct_biquads(signal, sections, sample_rate):
+    """Тот же каскад по отсчётам на Python (транспонированная форма II, float64)"""
+    output = signal.astype(np.float64)
+    for section in sections:
+        b0, b1, b2, a1, a2 = biquad_coefficients(section, sample_rate)
+        z1 = np.zeros(output.shape[1])
+        z2 = np.zeros(output.shape[1])
+        for n, x in enumerate(output):
+            y = b0 * x + z1
+            z1 = b1 * x - a1 * y + z2
+            z2 = b2 * x - a2 * y
+            output[n] = y
+    return output
+
+
+def bench_biquad(block_sizes=BLOCK_SIZES, channel_counts=CHANNEL_COUNTS, sample_rate=48000,
+                 seconds=1.0):
+    """Каскад биквадов: время на блок против бюджета и стыки блоков.
+
+    Стыки: секунда шума с постоянной составляющей идёт блоками по frames и
+    блоками случайной длины до frames, ошибка - против расчёта по отсчётам
+    на всём сигнале сразу.
+    """
+    rng = np.random.default_rng(0)
+    length = int(seconds * sample_rate)
+    print("Каскад    Звеньев  Каналов  Блок  Время,мкс  Бюджет,%  По отсчётам,мкс  "
+          "Ошибка стыков")
+    for name, sections in BIQUAD_CASCADES:
+        for channels in channel_counts:
+            signal = make_signal('noise', length, channels, sample_rate, rng) + np.float32(0.2)
+            reference = direct_biquads(signal, sections, sample_rate)
+            for frames in block_sizes:
+                stage = BiquadCascade(sections)
+                stage.prepare(frames, channels, np.float32, sample_rate)
+                block = make_signal('noise', frames, channels, sample_rate, rng)
+                out = np.zeros_like(block)
+                us = time_block(lambda: stage.process(block, out, 0, frames), repeats=500)
+                direct_us = time_block(lambda: direct_biquads(block, sections, sample_rate),
+                                       repeats=3)
+
+                error = 0.0
+                for sizes in ('ровные', 'случайные'):
+                    stage.reset()
+                    result = np.zeros_like(signal)
+                    pos = 0
+                    while pos < length:
+                        size = frames if sizes == 'ровные' else int(rng.integers(1, frames + 1))
+                        size = min(size, length - pos)
+                        stage.process(signal[pos:pos + size], result[pos:pos + size], 0, size)
+                        pos += size
+                    error = max(error, float(np.abs(result - reference).max()))
+                budget_us = frames / sample_rate * 1e6
+                print(f"{name:<9} {len(sections):>7} {channels:>8} {frames:>5} {us:>10.1f} "
+                      f"{us / budget_us * 100:>9.2f} {direct_us:>16.0f} {error:>14.1e}")
+
+
+def bench_denoise(block_sizes=BLOCK_SIZES, channels=2, sample_rate=48000, seconds=2.0):
+    """Шумоподавление: задержка, время на блок отдельно и в цепочке окна, подавление шума.
+
+    Профиль шума набирается на первой секунде (порог закрыт), на второй
+    идёт речь поверх того же шума. Время - среднее на блок по всему прогону
+    речи: кадры STFT считаются не в каждом блоке, а когда накопится шаг.
+    """
+    rng = np.random.default_rng(0)
+    length = int(seconds * sample_rate)
+    floor = (3e-3 * rng.standard_normal((length, 1))).astype(np.float32)
+    speech = make_signal('bursts', length, 1, sample_rate, rng) * 0.3
+    print("Блок  Задержка,мс  Этап,мкс  Бюджет,%  Цепочка,мкс  С подавлением,мкс  "
+          "Шум в паузах,дБ")
+    for frames in block_sizes:
+        budget_us = frames / sample_rate * 1e6
+        half = length // 2 // frames * frames
+        blocks = (length - half) // frames
+        stage = SpectralDenoiser()
+        stage.prepare(frames, 1, np.float32, sample_rate)
+        for pos in range(0, half, frames):
+            stage.learn(floor[pos:pos + frames, 0], frames)
+        mix = speech + floor
+        out = np.zeros_like(mix)
+        start = time.perf_counter()
+        for block in range(blocks):
+            lo = half + block * frames
+            stage.process(mix[lo:lo + frames], out[lo:lo + frames], 0, frames)
+        stage_us = (time.perf_counter() - start) / blocks * 1e6
+        # Паузы речи: где исходная речь молчит целый кадр
+        latency = stage.latency
+        pauses = np.abs(speech[half:length - latency, 0]) == 0
+        before = np.mean(mix[half:length - latency, 0][pauses] ** 2)
+        after = np.mean(out[half + latency:length, 0][pauses] ** 2)
+
+        timings = []
+        for denoise in (False, True):
+            engine = DistortionEngine(sample_rate=sample_rate, denoise=denoise)
+            engine.prepare(frames, channels)
+            stereo = np.repeat(mix, channels, axis=1)
+            outdata = np.zeros((frames, channels), dtype=np.float32)
+            start = time.perf_counter()
+            for block in range(blocks):
+                lo = half + block * frames
+                engine.process(stereo[lo:lo + frames], outdata, 100.0)
+            timings.append((time.perf_counter() - start) / blocks * 1e6)
+        print(f"{frames:>5} {latency / sample_rate * 1000:>12.1f} {stage_us:>9.1f} "
+              f"{stage_us / budget_us * 100:>9.2f} {timings[0]:>12.1f} {timings[1]:>18.1f} "
+              f"{10 * np.log10(after / before):>16.1f}")
+
+
+# Громкость речи на входе для замера автоусиления, дБ от полной шкалы
+AGC_INPUT_LEVELS = (-65.0, -50.0, -35.0, -20.0, -8.0)
+
+
+def bench_agc(block_sizes=BLOCK_SIZES, channels=2, sample_rate=48000, seconds=4.0,
+              target_db=-20.0, limit=100.0):
+    """Автоусиление: время на блок, громкость после АРУ и независимость от размера блока.
+
+    Время - цепочка окна без АРУ и с ним (поле усиления - предел limit).
+    Громкость - на выходе этапа AutoGain, до искажения: среднеквадратичное
+    по слогам второй половины прогона, когда огибающая уже установилась.
+    Тихий вход, которому нужно усиление больше предела, остаётся тише цели.
+    Последний столбец - наибольшая разница выхода этапа с тем же сигналом,
+    обработанным одним блоком.
+    """
+    rng = np.random.default_rng(0)
+    length = int(seconds * sample_rate)
+    speech = make_signal('bursts', length, 1, sample_rate, rng)
+    settled = np.abs(speech[:, 0]) > 0
+    speech_db = 10 * np.log10(np.mean(speech[settled, 0] ** 2))
+    settled[:length // 2] = False
+    inputs = [speech * np.float32(10 ** ((level - speech_db) / 20)) for level in AGC_INPUT_LEVELS]
+
+    def run_stage(signal, frames):
+        stage = AutoGain(target_db)
+        stage.prepare(frames, 1, np.float32, sample_rate)
+        out = np.zeros_like(signal)
+        for pos in range(0, len(signal) // frames * frames, frames):
+            stage.begin(frames, limit)
+            stage.process(signal[pos:pos + frames], out[pos:pos + frames], 0, frames)
+        return out
+
+    reference = run_stage(inputs[0], length)
+    print(f"Цель {target_db:g} дБ, предел усиления {limit:g}")
+    print("Вход,дБ  " + "  ".join(f"{level:>6g}" for level in AGC_INPUT_LEVELS))
+    print("Выход,дБ " + "  ".join(
+        f"{10 * np.log10(np.mean(run_stage(signal, 256)[settled, 0] ** 2)):>6.1f}"
+        for signal in inputs))
+    print("\nБлок  Бюджет,мкс  Цепочка,мкс  С АРУ,мкс  Бюджет,%  Разница блоков")
+    stereo = np.repeat(inputs[1], channels, axis=1)
+    for frames in block_sizes:
+        budget_us = frames / sample_rate * 1e6
+        blocks = length // frames
+        split_error = np.max(np.abs(run_stage(inputs[0], frames)[:blocks * frames]
+                                    - reference[:blocks * frames]))
+        timings = []
+        for agc in (None, target_db):
+            engine = DistortionEngine(sample_rate=sample_rate, agc=agc)
+            engine.prepare(frames, channels)
+            outdata = np.zeros((frames, channels), dtype=np.float32)
+            start = time.perf_counter()
+            for pos in range(0, blocks * frames, frames):
+                engine.process(stereo[pos:pos + frames], outdata, limit)
+            timings.append((time.perf_counter() - start) / blocks * 1e6)
+        print(f"{frames:>5} {budget_us:>11.0f} {timings[0]:>12.1f} {timings[1]:>10.1f} "
+              f"{timings[1] / budget_us * 100:>9.2f} {split_error:>15.1e}")
+
+
+# Пары частот (вход, выход) для преобразователя частоты
+RATE_PAIRS = ((44100, 48000), (48000, 44100), (16000, 48000), (48000, 16000))
+
+
+def bench_resampler(block_sizes=(64, 256, 1024, 4096), channels=2):
+    """Преобразователь частоты: время на блок и скорость относительно реального времени"""
+    rng = np.random.default_rng(0)
+    print("Вход->выход   Качество  Отводов  Блок  Время,мкс  Бюджет,%  Скорость,x")
+    for in_rate, out_rate in RATE_PAIRS:
+        for quality in QUALITY:
+            for frames in block_sizes:
+                resampler = PolyphaseResampler(in_rate, out_rate, channels, quality)
+                resampler.prepare(frames)
+                signal = make_signal('noise', frames, channels, in_rate, rng)
+                us = time_block(lambda: resampler.process(signal), repeats=500)
+                budget_us = frames / in_rate * 1e6
+                print(f"{in_rate:>5}->{out_rate:<5}  {quality:<8} {resampler.taps:>7} {frames:>5} "
+                      f"{us:>10.1f} {us / budget_us * 100:>9.2f} {budget_us / us:>11.0f}")
+
+
+# Профили SimulatedDevice: (название, среднее пробуждение мс, выбросы до мс, доля выбросов)
+DEVICE_PROFILES = (
+    ('тихая система', 0.2, 2.0, 0.001),
+    ('обычная', 0.5, 20.0, 0.02),
+    ('перегруженная', 2.0, 200.0, 0.02),
+)
+
+
+def bench_tuner(seconds=2.0):
+    """Калибровка на симулированных устройствах с колбэком окна программы"""
+    for name, wakeup_ms, spike_ms, spike_rate in DEVICE_PROFILES:
+        print(f"--- {name}: пробуждение {wakeup_ms:g} мс, выбросы до {spike_ms:g} мс ({spike_rate:.1%})")
+        device = SimulatedDevice(wakeup_ms=wakeup_ms, spike_ms=spike_ms, spike_rate=spike_rate)
+        tuner = LatencyTuner(device.open_stream, lambda frames: gui_callback(frames, device.channels),
+                             device.sample_rate, seconds, sleep=device.sleep,
+                             progress=lambda result: print(format_soak(result)),
+                             latency_values=device.latency_values)
+        choice, _ = tuner.tune()
+        if choice is None:
+            print("Чистой настройки нет")
+        else:
+            print(f"Выбрано: блок {choice.block_size}, задержка {choice.latency}")
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def bench_callbacks(block_sizes=BLOCK_SIZES, channel_counts=CHANNEL_COUNTS,
+                    sample_rates=SAMPLE_RATES, signals=SIGNALS, seconds=0.5):
+    """Матрица замеров колбэков: время блока в процентах от бюджета реального времени"""
+    rng = np.random.default_rng(0)
+    results = []
+    print("Интерфейс      Сигнал   Блок  Кан  Частота  p50,%   p99,%   макс,%")
+    for front_end, make_callback in FRONT_ENDS:
+        try:
+            make_callback(block_sizes[0], channel_counts[0])
+        except ImportError as e:
+            print(f"{front_end}: пропущен ({e})")
+            continue
+        for sample_rate in sample_rates:
+            for channels in channel_counts:
+                for kind in signals:
+                    for frames in block_sizes:
+                        budget = frames / sample_rate
+                        blocks = max(50, int(seconds / budget))
+                        signal = make_signal(kind, blocks * frames, channels, sample_rate, rng)
+                        callback = make_callback(frames, channels)
+                        load = measure_callback(callback, signal, frames) / budget * 100
+                        result = {
+                            'front_end': front_end,
+                            'signal': kind,
+                            'frames': frames,
+                            'channels': channels,
+                            'sample_rate': sample_rate,
+                            'blocks': blocks,
+                            'budget_ms': budget * 1000,
+                            'p50_pct': float(np.percentile(load, 50)),
+                            'p99_pct': float(np.percentile(load, 99)),
+                            'max_pct': float(load.max()),
+                        }
+                        results.append(result)
+                        print(f"{front_end:<14} {kind:<8} {frames:>5} {channels:>4} {sample_rate:>8} "
+                              f"{result['p50_pct']:>6.2f} {result['p99_pct']:>7.2f} {result['max_pct']:>8.2f}")
+    return {
+        'revision': git_revision(),
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.platform(),
+        'results': results,
+    }
+
+
+def compare_results(report, baseline, threshold=1.2, min_delta=0.5):
+    """Сравнить p99 с прошлым запуском.
+
+    Регрессией считается замедление больше threshold раз, если при этом p99
+    выросло хотя бы на min_delta процентов бюджета (мелкие блоки шумят).
+    """
+    def key(result):
+        return (result['front_end'], result['signal'], result['frames'],
+                result['channels'], result['sample_rate'])
+
+    old = {key(result): result for result in baseline['results']}
+    print(f"\nСравнение с {baseline.get('revision')} ({baseline.get('date')}), p99:")
+    regressions = 0
+    for result in report['results']:
+        before = old.get(key(result))
+        if before is None or before['p99_pct'] <= 0:
+            continue
+        ratio = result['p99_pct'] / before['p99_pct']
+        if ratio > threshold and result['p99_pct'] - before['p99_pct'] >= min_delta:
+            regressions += 1
+            name = ' '.join(str(part) for part in key(result))
+            print(f"  регрессия: {name}: {before['p99_pct']:.2f}% -> {result['p99_pct']:.2f}% (x{ratio:.2f})")
+    print(f"Регрессий: {regressions}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Замеры производительности обработки звука")
+    parser.add_argument('suite', choices=['callbacks', 'waveshaper', 'params', 'limiter', 'tuner',
+                                          'resampler', 'channels', 'gate', 'worker', 'mics',
+                                          'biquad', 'denoise', 'agc'],
+                        help="какой замер запустить")
+    parser.add_argument('--json', help="сохранить результаты callbacks в JSON-файл")
+    parser.add_argument('--compare', help="сравнить результаты callbacks с прошлым JSON-файлом")
+    parser.add_argument('--quick', action='store_true', help="сокращённая матрица callbacks")
+    args = parser.parse_args()
+
+    if args.suite == 'callbacks':
+        if args.quick:
+            report = bench_callbacks(block_sizes=(64, 1024, 4096), channel_counts=(2,),
+                                     sample_rates=(48000,), seconds=0.25)
+        else:
+            report = bench_callbacks()
+        if args.json:
+            with open(args.json, 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+        if args.compare:
+            with open(args.compare, encoding='utf-8') as f:
+                compare_results(report, json.load(f))
+    elif args.suite == 'waveshaper':
+        bench_waveshaper()
+    elif args.suite == 'params':
+        bench_params()
+    elif args.suite == 'limiter':
+        bench_limiter()
+    elif args.suite == 'tuner':
+        bench_tuner()
+    elif args.suite == 'resampler':
+        bench_resampler()
+    elif args.suite == 'channels':
+        bench_channels()
+    elif args.suite == 'gate':
+        bench_gate()
+    elif args.suite == 'worker':
+        bench_worker()
+    elif args.suite == 'mics':
+        bench_mics()
+        bench_mic_processes()
+    elif args.suite == 'biquad':
+        bench_biquad()
+    elif args.suite == 'denoise':
+        bench_denoise()
+    elif args.suite == 'agc':
+        bench_agc()
+
+
+if __name__ == "__main__":
+    main()
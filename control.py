@@ -0,0 +1,192 @@
+"""
+Управление усилителем без консоли: локальный сокет с сообщениями JSON.
+
+Запрос и ответ - по одной строке JSON:
+    {"cmd": "get_gain"}                           -> {"ok": true, "gain": 5.0}
+    {"cmd": "set_gain", "gain": 10}               -> {"ok": true, "gain": 10.0}
+    {"cmd": "set_gain", "gain": 3, "mic": 2}      -> {"ok": true, "gain": ..., "gains": [...]}
+    {"cmd": "switch_devices", "input": 3, "output": "CABLE Input"}
+                                                  -> {"ok": true, "input": ..., "output": ...}
+    {"cmd": "stats"}                              -> {"ok": true, "stats": {...}}
+    {"cmd": "stop"}                               -> {"ok": true}
+При ошибке ответ {"ok": false, "error": "текст"}.
+
+Сервер - asyncio в главном потоке, с аудиопотоком он не связан ничем, что
+можно ждать: команды выполняются по одной в отдельном потоке
+(run_in_executor), так что открытие устройств при переключении не
+задерживает ни цикл сокета, ни колбэк, а колбэк видит только новый снимок
+параметров. Где нет Unix-сокетов (Windows), сервер слушает TCP на 127.0.0.1.
+
+Клиент из консоли:
+    python control.py set_gain 10
+    python control.py set_gain 3 --mic 2
+    python control.py switch_devices 3 "CABLE Input"
+    python control.py stats
+"""
+
+import argparse
+import asyncio
+import concurrent.futures
+import json
+import os
+import socket
+import sys
+
+DEFAULT_SOCKET_PATH = os.path.join(os.path.expanduser('~'), '.micstrenght', 'control.sock')
+DEFAULT_PORT = 47800
+# Unix-сокеты есть не везде: на Windows сервер и клиент идут через localhost
+UNIX_SOCKETS = hasattr(socket, 'AF_UNIX')
+
+
+class ControlServer:
+    """Сервер команд: handlers - словарь имя команды -> функция(сообщение) -> dict.
+
+    Функции выполняются в отдельном потоке по одной, их исключения
+    превращаются в ответ с ошибкой. Команду stop сервер обрабатывает сам:
+    отвечает и завершает serve(). Сокет, на котором уже кто-то слушает,
+    сервер не занимает (claim).
+    """
+
+    def __init__(self, handlers, path=DEFAULT_SOCKET_PATH, port=DEFAULT_PORT):
+        self.handlers = handlers
+        self.path = path
+        self.port = port
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self._stopping = None
+
+    @property
+    def address(self):
+        return self.path if UNIX_SOCKETS else f"127.0.0.1:{self.port}"
+
+    def claim(self):
+        """Проверить, что адрес свободен, и убрать сокет от прошлого запуска.
+
+        Если на сокете отвечает другой запущенный экземпляр, его сокет не
+        трогаем, а бросаем RuntimeError. Удаляется только сокет, к которому
+        не подключиться (ConnectionRefusedError): его процесс не успел убрать
+        за собой. TCP-порт занятым проверит сама привязка.
+        """
+        if not UNIX_SOCKETS or not os.path.exists(self.path):
+            return
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+            try:
+                probe.connect(self.path)
+            except ConnectionRefusedError:
+                os.unlink(self.path)
+                return
+            except FileNotFoundError:
+                return
+        raise RuntimeError(f"сокет управления {self.path} уже занят: усилитель запущен")
+
+    def run(self):
+        asyncio.run(self.serve())
+
+    async def serve(self):
+        self._stopping = asyncio.Event()
+        if UNIX_SOCKETS:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self.claim()
+            server = await asyncio.start_unix_server(self._client, self.path)
+        else:
+            server = await asyncio.start_server(self._client, '127.0.0.1', self.port)
+        try:
+            async with server:
+                await self._stopping.wait()
+        finally:
+            self._executor.shutdown(wait=True)
+            if UNIX_SOCKETS and os.path.exists(self.path):
+                os.unlink(self.path)
+
+    async def _client(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                response = await self._dispatch(line)
+                writer.write(json.dumps(response, ensure_ascii=False).encode('utf-8') + b'\n')
+                await writer.drain()
+                if self._stopping.is_set():
+                    break
+        except (ConnectionError, asyncio.CancelledError):
+            # Клиент отключился или сервер останавливается с открытыми соединениями
+            pass
+        finally:
+            writer.close()
+
+    async def _dispatch(self, line):
+        try:
+            message = json.loads(line)
+        except ValueError:
+            return {'ok': False, 'error': "Сообщение не в формате JSON"}
+        if not isinstance(message, dict):
+            return {'ok': False, 'error': "Ожидается объект JSON с полем cmd"}
+        command = message.get('cmd')
+        if command == 'stop':
+            self._stopping.set()
+            return {'ok': True}
+        handler = self.handlers.get(command)
+        if handler is None:
+            return {'ok': False, 'error': f"Неизвестная команда: {command}"}
+        loop = asyncio.get_running_loop()
+        try:
+            result = await loop.run_in_executor(self._executor, handler, message)
+        except Exception as e:
+            return {'ok': False, 'error': str(e)}
+        return dict(result or {}, ok=True)
+
+
+def send(message, path=DEFAULT_SOCKET_PATH, port=DEFAULT_PORT, timeout=30.0):
+    """Отправить одну команду серверу и вернуть ответ (словарь)"""
+    if UNIX_SOCKETS:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        address = path
+    else:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        address = ('127.0.0.1', port)
+    with sock:
+        sock.settimeout(timeout)
+        sock.connect(address)
+        sock.sendall(json.dumps(message, ensure_ascii=False).encode('utf-8') + b'\n')
+        with sock.makefile('rb') as f:
+            return json.loads(f.readline())
+
+
+def parse_device(value):
+    """Номер устройства или часть его имени"""
+    try:
+        return int(value)
+    except ValueError:
+        return value
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Команды усилителю, запущенному с --daemon")
+    parser.add_argument('--socket', default=DEFAULT_SOCKET_PATH, help="путь к сокету управления")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT,
+                        help="порт на 127.0.0.1, где нет Unix-сокетов")
+    commands = parser.add_subparsers(dest='cmd', required=True)
+    commands.add_parser('get_gain', help="текущее усиление")
+    set_gain = commands.add_parser('set_gain', help="установить усиление")
+    set_gain.add_argument('gain', type=float)
+    set_gain.add_argument('--mic', type=int, help="только для микрофона N (с 1), если их несколько")
+    switch = commands.add_parser('switch_devices', help="переключить устройства без перезапуска")
+    switch.add_argument('input', type=parse_device, help="номер или часть имени микрофона")
+    switch.add_argument('output', type=parse_device, help="номер или часть имени выхода")
+    commands.add_parser('stats', help="диагностика колбэка")
+    commands.add_parser('stop', help="остановить усилитель")
+    args = parser.parse_args()
+
+    message = {key: value for key, value in vars(args).items() if key not in ('socket', 'port')}
+    try:
+        response = send(message, args.socket, args.port)
+    except OSError as e:
+        print(f"Ошибка: нет связи с усилителем ({e})")
+        sys.exit(1)
+    print(json.dumps(response, ensure_ascii=False, indent=2))
+    if not response.get('ok'):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
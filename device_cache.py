@@ -0,0 +1,266 @@
+"""
+Кэш возможностей звуковых устройств на диске.
+
+Список устройств и результаты пробных открытий потока (частота, размер
+блока, задержка) хранятся в JSON-файле, ключ устройства - имя, драйвер
+(host API) и число каналов. При запуске список берётся из кэша без обращения
+к PortAudio, а пробный поток открывается только для настроек, которых ещё
+нет в кэше или которые устарели. Окно программы перечисляет устройства
+заново в фоновом потоке (refresh): исчезнувшие и изменившиеся устройства
+выбрасываются из кэша вместе с результатами проверок. Там же проверки
+старше REVALIDATE_AGE открываются заново (revalidate), пока поток ещё не
+запущен.
+
+Запоминаются только удачные открытия: неудача часто временная (устройство
+занято другой программой, монопольный режим), и в следующий раз поток
+пробуется снова.
+"""
+
+import json
+import os
+import threading
+import time
+from collections import namedtuple
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.micstrenght', 'devices.json')
+# Через сколько секунд результат пробного открытия потока проверяется заново
+MAX_AGE = 7 * 24 * 3600
+# Проверки старше этого фоновая перепроверка открывает заново, с
+REVALIDATE_AGE = 24 * 3600
+
+
+class DeviceInfo(namedtuple('DeviceInfo', ['index', 'name', 'hostapi', 'max_input_channels',
+                                           'max_output_channels', 'default_samplerate'])):
+    """Описание устройства из sd.query_devices с именем драйвера вместо номера"""
+    __slots__ = ()
+
+    @property
+    def key(self):
+        return f"{self.hostapi}|{self.name}|{self.max_input_channels}|{self.max_output_channels}"
+
+
+def enumerate_devices(sd):
+    """Все устройства за один вызов query_devices и один query_hostapis"""
+    hostapis = [hostapi['name'] for hostapi in sd.query_hostapis()]
+    return [
+        DeviceInfo(index, device['name'], hostapis[device['hostapi']],
+                   device['max_input_channels'], device['max_output_channels'],
+                   int(device['default_samplerate']))
+        for index, device in enumerate(sd.query_devices())
+    ]
+
+
+def settings_key(channels, samplerate, dtype, blocksize, latency, output_samplerate=None):
+    # dtype - класс numpy (np.float32) или строка; numpy здесь не нужен, модуль
+    # читается окном до загрузки тяжёлых библиотек
+    dtype = getattr(dtype, '__name__', dtype)
+    if output_samplerate not in (None, samplerate):
+        samplerate = f"{samplerate}->{output_samplerate}"
+    return f"{channels}/{samplerate}/{dtype}/{blocksize}/{latency}"
+
+
+class DeviceCache:
+    """Список устройств и проверенные настройки потока для пар устройств.
+
+    refresh() из фонового потока только заменяет ссылку на список устройств
+    и меняет словарь проверок под блокировкой, так что читать devices можно
+    из любого потока. generation растёт при каждом обновлении списка.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_age=MAX_AGE, revalidate_age=REVALIDATE_AGE):
+        self.path = path
+        self.max_age = max_age
+        self.revalidate_age = revalidate_age
+        self._lock = threading.Lock()
+        data = self._load()
+        try:
+            self.devices = [DeviceInfo(**device) for device in data.get('devices', [])]
+        except TypeError:
+            # Файл старого формата
+            self.devices = []
+            data = {}
+        self.enumerated = data.get('enumerated', 0)
+        self.streams = data.get('streams', {})
+        self.generation = 0
+        self._refreshing = None
+
+    def _load(self):
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def save(self):
+        with self._lock:
+            data = {
+                'devices': [device._asdict() for device in self.devices],
+                'enumerated': self.enumerated,
+                'streams': self.streams,
+            }
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                temp_path = self.path + '.tmp'
+                with open(temp_path, 'w', encoding='utf-8') as f:
+                    json.dump(data, f, ensure_ascii=False, indent=2)
+                os.replace(temp_path, self.path)
+            except OSError as e:
+                print(f"Ошибка записи кэша устройств: {e}")
+
+    def refresh(self, sd):
+        """Перечислить устройства сейчас, обновить кэш и вернуть список"""
+        devices = enumerate_devices(sd)
+        present = {device.key for device in devices}
+        with self._lock:
+            # Проверки пар, где одно из устройств пропало или изменилось, больше не верны
+            self.streams = {
+                pair: results for pair, results in self.streams.items()
+                if all(key in present for key in pair.split(' -> '))
+            }
+            self.devices = devices
+            self.enumerated = time.time()
+            self.generation += 1
+        self.save()
+        return devices
+
+    def lookup(self, sd):
+        """Список из кэша без обращения к PortAudio, при пустом кэше - перечисление.
+
+        Список из кэша сразу перечитывается в фоновом потоке: номера устройств
+        могли смениться, поэтому перед открытием потока его дожидаются (wait)
+        и находят устройство заново по ключу (by_key).
+        """
+        if not self.devices:
+            return self.refresh(sd)
+        devices = self.devices
+        self._refreshing = threading.Thread(target=self.refresh, args=(sd,), daemon=True)
+        self._refreshing.start()
+        return devices
+
+    def wait(self):
+        """Дождаться перечисления, начатого lookup()"""
+        thread = self._refreshing
+        if thread is not None:
+            thread.join()
+            self._refreshing = None
+
+    def by_key(self, key):
+        """Устройство с таким ключом (имя, драйвер, каналы) или None"""
+        for device in self.devices:
+            if device.key == key:
+                return device
+        return None
+
+    def find(self, name, hostapi):
+        """Устройство с таким именем у драйвера hostapi или None"""
+        for device in self.devices:
+            if device.name == name and device.hostapi == hostapi:
+                return device
+        return None
+
+    def get(self, index):
+        for device in self.devices:
+            if device.index == index:
+                return device
+        return None
+
+    def verified(self, input_device, output_device, **settings):
+        """(True, None) из кэша или None, если удачной проверки нет или она устарела"""
+        pair = f"{input_device.key} -> {output_device.key}"
+        with self._lock:
+            result = self.streams.get(pair, {}).get(settings_key(**settings))
+        # Неудачи в кэше старого формата не в счёт: поток пробуется снова
+        if result is None or not result['ok'] or time.time() - result['checked'] > self.max_age:
+            return None
+        return True, None
+
+    def record(self, input_device, output_device, ok, **settings):
+        """Запомнить, что поток с такими настройками открылся; неудача забывает прошлый успех"""
+        self._store(f"{input_device.key} -> {output_device.key}", settings_key(**settings), ok,
+                    settings)
+
+    def _store(self, pair, key, ok, settings):
+        with self._lock:
+            results = self.streams.setdefault(pair, {})
+            if ok:
+                # Настройки - чтобы revalidate мог открыть поток заново
+                results[key] = {
+                    'ok': True,
+                    'error': None,
+                    'checked': time.time(),
+                    'settings': dict(settings, dtype=getattr(settings['dtype'], '__name__',
+                                                             settings['dtype'])),
+                }
+            else:
+                results.pop(key, None)
+                if not results:
+                    del self.streams[pair]
+        self.save()
+
+    def probe(self, sd, input_device, output_device, **settings):
+        """Открывается ли поток: из кэша, а если проверки нет - пробным открытием.
+
+        settings - channels, samplerate, dtype, blocksize, latency для
+        sd.Stream. Если задана другая output_samplerate, вход и выход
+        открываются отдельными потоками на своих частотах, как у
+        resampler.ResampledStream. Возвращает (ok, текст ошибки или None).
+        """
+        result = self.verified(input_device, output_device, **settings)
+        if result is not None:
+            return result
+        try:
+            open_probe(sd, input_device, output_device, settings)
+        except Exception as e:
+            self.record(input_device, output_device, False, **settings)
+            return False, str(e)
+        self.record(input_device, output_device, True, **settings)
+        return True, None
+
+    def revalidate(self, sd):
+        """Заново открыть потоки, проверенные раньше revalidate_age назад.
+
+        Вызывается в фоновом потоке после refresh(), пока программа ещё не
+        открыла свой поток: иначе пробное открытие спорило бы с ним за
+        устройство. Проверяются только пары, оба устройства которых на месте.
+        Возвращает число перепроверенных настроек.
+        """
+        devices = {device.key: device for device in self.devices}
+        now = time.time()
+        with self._lock:
+            stale = [
+                (pair, key, result['settings'])
+                for pair, results in self.streams.items()
+                for key, result in results.items()
+                if result['ok'] and 'settings' in result
+                and now - result['checked'] > self.revalidate_age
+            ]
+        for pair, key, settings in stale:
+            input_key, output_key = pair.split(' -> ')
+            if input_key not in devices or output_key not in devices:
+                continue
+            try:
+                open_probe(sd, devices[input_key], devices[output_key], settings)
+            except Exception:
+                self._store(pair, key, False, settings)
+            else:
+                self._store(pair, key, True, settings)
+        return len(stale)
+
+
+def open_probe(sd, input_device, output_device, settings):
+    """Открыть и закрыть поток с настройками settings; ошибка PortAudio - исключение"""
+    stream_settings = dict(settings)
+    output_samplerate = stream_settings.pop('output_samplerate', None)
+    if output_samplerate in (None, settings['samplerate']):
+        sd.Stream(device=(input_device.index, output_device.index), **stream_settings).close()
+        return
+    channels = stream_settings.pop('channels')
+    input_channels, output_channels = (channels if isinstance(channels, (tuple, list))
+                                       else (channels, channels))
+    sd.InputStream(device=input_device.index, channels=input_channels,
+                   **stream_settings).close()
+    # Блок выхода той же длительности, что и блок входа
+    stream_settings['blocksize'] = max(1, round(settings['blocksize'] * output_samplerate
+                                                / settings['samplerate']))
+    stream_settings['samplerate'] = output_samplerate
+    sd.OutputStream(device=output_device.index, channels=output_channels, **stream_settings).close()
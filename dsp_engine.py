@@ -0,0 +1,1607 @@
+"""
+Общий движок обработки звука для всех интерфейсов программы.
+
+Цепочка задаётся списком этапов (усиление, ограничитель, кривая искажения,
+смешивание, нормализация). При сборке подряд идущие поэлементные этапы
+объединяются в группу, которая проходит по буферу кусками по TILE_FRAMES
+кадров: все этапы группы применяются к куску, пока он ещё в кэше
+процессора, и только потом берётся следующий кусок.
+
+Рабочие буферы выделяются в prepare() по размеру блока и числу каналов
+потока, дальше каждый этап работает через out= / на месте, так что в
+колбэке память не выделяется.
+
+Микрофон почти всегда моно, а поток открывается стерео: драйвер отдаёт
+один и тот же сигнал в обоих каналах. Пока каналы входа совпадают, цепочка
+считает один канал и растягивает результат на все каналы выхода
+(ChannelLayout), так что обработка не делается дважды.
+
+Большую часть времени микрофон молчит, а усиление до 10000 превращает шум
+в постоянное шипение. Шумовой порог (NoiseGate) по энергии блока решает,
+считать ли цепочку вообще: пока он закрыт, колбэк только заполняет выход
+нулями.
+
+Уровни входа и выхода для индикатора в окне (LevelMeter) считаются тут же,
+по ходу того же прохода: пара сокращений и один dot на блок.
+
+По желанию (rumble) перед усилением цепочка срезает гул и постоянную
+составляющую (BiquadCascade, RUMBLE_FILTER): иначе усиление загоняет их
+прямо в нелинейность. Фильтр с памятью считается целыми блоками через матрицы,
+без цикла по отсчётам. По желанию (denoise) за ним идёт спектральное
+шумоподавление (SpectralDenoiser), которое учится на шуме, пока порог
+закрыт.
+
+С agc вместо постоянного усиления работает АРУ (AutoGain): оно держит
+громкость у цели, а усиление из снимка параметров становится пределом.
+
+Несколько микрофонов одного многоканального входа (MultiMicEngine) идут
+одним проходом той же цепочки: столбец буфера - микрофон, усиление -
+вектор, так что накладные расходы numpy на блок не растут с числом
+микрофонов.
+"""
+
+import math
+from collections import namedtuple
+
+import numpy as np
+
+from waveshaper import TableLookup, build_table
+
+# Размер куска для объединённых поэлементных этапов (кадров)
+TILE_FRAMES = 16384
+
+
+class AmpParams(namedtuple('AmpParams', ['gain', 'route', 'gains'], defaults=(None, None))):
+    """Неизменяемый снимок параметров обработки.
+
+    Поток интерфейса публикует новый снимок простой заменой ссылки
+    (self.params = self.params._replace(...)), а колбэк читает ссылку один
+    раз за блок. Блокировок нет, поэтому поток интерфейса не может
+    задержать аудиопоток. route - роль выхода из routing.py (только в окне
+    программы), gains - усиления по микрофонам для MultiMicEngine (массив
+    numpy, который после публикации не меняется).
+    """
+    __slots__ = ()
+
+
+class Stage:
+    """Этап цепочки.
+
+    process(src, dst, lo, hi) обрабатывает кадры lo:hi блока: src и dst уже
+    вырезаны по этим кадрам и могут быть одним массивом. curve() - та же
+    операция в float64, из неё строится таблица передаточной кривой.
+
+    Буферы этапа выделяет prepare(). Если операнды ufunc разных типов или
+    один растягивается по другому (кроме скаляра), numpy заводит временный
+    буфер размером с блок; copyto приводит тип и растягивает без него.
+    Поэтому множители и рампы хранятся на все кадры и каналы в нужном типе.
+    """
+
+    # Поэлементный этап не зависит от соседних отсчётов и может идти кусками
+    elementwise = True
+    # Кривой нужна замена координаты таблицы (корень в нуле)
+    warp = False
+    # Задержка выхода в кадрах
+    latency = 0
+
+    def prepare(self, frames, channels, dtype, sample_rate):
+        pass
+
+    def widen(self, frames, channels, dtype, sample_rate):
+        """Перейти с одного канала на channels посреди потока, сохранив состояние.
+
+        Этапам без состояния между блоками достаточно заново выделить буферы.
+        """
+        self.prepare(frames, channels, dtype, sample_rate)
+
+    def reset(self):
+        """Забыть состояние между блоками: цепочка не считалась (шумовой порог)"""
+
+    def learn(self, block, frames):
+        """Блок входа, который цепочка не считала: шумовой порог закрыт, это шум"""
+
+    def begin(self, frames, gain):
+        """Вызывается один раз за блок до обработки кусков"""
+
+    def process(self, src, dst, lo, hi):
+        raise NotImplementedError
+
+    def curve(self, x, gain, taps):
+        raise NotImplementedError
+
+
+class Gain(Stage):
+    """Усиление из снимка параметров с линейным переходом при смене значения.
+
+    Ступенька усиления посреди звука даёт щелчок, поэтому при смене значения
+    множитель плавно меняется по кадрам блока. Пока усиление не меняется,
+    умножение идёт на скаляр. Усиление может быть и вектором по каналам
+    (MultiMicEngine) - тогда у каждого канала свой множитель и свой переход.
+    """
+
+    def __init__(self):
+        self.gain = None
+        self.steady = True
+
+    def prepare(self, frames, channels, dtype, sample_rate):
+        # Номера кадров 1..frames, из них переход получается без выделения памяти
+        self._steps = np.arange(1, frames + 1, dtype=dtype)[:, np.newaxis]
+        self._ramp = np.zeros((frames, channels), dtype=dtype)
+        self._step = np.zeros(channels, dtype=dtype)
+        self._width = 1
+        # Вектор усиления на все кадры
+        self._gains = np.zeros((frames, channels), dtype=dtype)
+        if np.ndim(self.gain):
+            np.copyto(self._gains, self.gain)
+
+    def begin(self, frames, gain):
+        last = self.gain
+        self.gain = gain
+        if last is not gain and np.ndim(gain):
+            # Весь буфер: следующий блок может оказаться длиннее этого
+            np.copyto(self._gains, gain)
+        # Пока снимок параметров тот же, усиление - тот же объект и сравнивать нечего
+        self.steady = last is None or last is gain or np.array_equal(last, gain)
+        if not self.steady:
+            width = self._width = np.size(gain)
+            step = self._step[:width]
+            np.subtract(gain, last, out=step)
+            np.divide(step, frames, out=step)
+            ramp = self._ramp[:frames, :width]
+            np.multiply(self._steps[:frames], step, out=ramp)
+            np.add(ramp, last, out=ramp)
+
+    def process(self, src, dst, lo, hi):
+        if self.steady:
+            gain = self.gain
+            np.multiply(src, self._gains[lo:hi] if np.ndim(gain) else gain, out=dst)
+        else:
+            np.multiply(src, self._ramp[lo:hi, :self._width], out=dst)
+
+    def curve(self, x, gain, taps):
+        return x * gain
+
+
+class Scale(Stage):
+    """Умножение на постоянный коэффициент"""
+
+    def __init__(self, factor):
+        self.factor = factor
+
+    def process(self, src, dst, lo, hi):
+        np.multiply(src, self.factor, out=dst)
+
+    def curve(self, x, gain, taps):
+        return x * self.factor
+
+
+class Clipper(Stage):
+    """Жёсткое ограничение в пределах [-limit, limit]"""
+
+    def __init__(self, limit=1):
+        self.limit = limit
+
+    def process(self, src, dst, lo, hi):
+        np.minimum(src, self.limit, out=dst)
+        np.maximum(dst, -self.limit, out=dst)
+
+    def curve(self, x, gain, taps):
+        return np.clip(x, -self.limit, self.limit)
+
+
+class Waveshaper(Stage):
+    """Нелинейная кривая: 'sqrt' - sign(x)*|x|^0.5, 'sin' - sin(pi*x), 'tanh'"""
+
+    KINDS = ('sqrt', 'sin', 'tanh')
+
+    def __init__(self, kind):
+        if kind not in self.KINDS:
+            raise ValueError(f"Неизвестная кривая: {kind}")
+        self.kind = kind
+        self.warp = kind == 'sqrt'
+
+    def prepare(self, frames, channels, dtype, sample_rate):
+        if self.kind == 'sqrt':
+            self._scratch = np.zeros((frames, channels), dtype=dtype)
+
+    def process(self, src, dst, lo, hi):
+        if self.kind == 'sqrt':
+            scratch = self._scratch[lo:hi]
+            np.abs(src, out=scratch)
+            np.power(scratch, 0.5, out=scratch)
+            np.sign(src, out=dst)
+            np.multiply(dst, scratch, out=dst)
+        elif self.kind == 'sin':
+            np.multiply(src, np.pi, out=dst)
+            np.sin(dst, out=dst)
+        else:
+            np.tanh(src, out=dst)
+
+    def curve(self, x, gain, taps):
+        if self.kind == 'sqrt':
+            return np.sign(x) * np.power(np.abs(x), 0.5)
+        if self.kind == 'sin':
+            return np.sin(x * np.pi)
+        return np.tanh(x)
+
+
+class Tap(Stage):
+    """Запомнить сигнал в этой точке цепочки для Mix"""
+
+    def __init__(self, name):
+        self.name = name
+
+    def prepare(self, frames, channels, dtype, sample_rate):
+        self.buffer = np.zeros((frames, channels), dtype=dtype)
+
+    def process(self, src, dst, lo, hi):
+        np.copyto(self.buffer[lo:hi], src)
+        if dst is not src:
+            np.copyto(dst, src)
+
+    def curve(self, x, gain, taps):
+        taps[self.name] = x
+        return x
+
+
+class Mix(Stage):
+    """Смешать текущий сигнал (wet) с сигналом, запомненным в Tap (dry)"""
+
+    def __init__(self, tap, wet, dry):
+        self.tap = tap
+        self.wet = wet
+        self.dry = dry
+        # Этап Tap подставляет Chain при сборке
+        self.source = None
+
+    def prepare(self, frames, channels, dtype, sample_rate):
+        self._scratch = np.zeros((frames, channels), dtype=dtype)
+
+    def process(self, src, dst, lo, hi):
+        scratch = self._scratch[lo:hi]
+        np.multiply(src, self.wet, out=dst)
+        np.multiply(self.source.buffer[lo:hi], self.dry, out=scratch)
+        np.add(dst, scratch, out=dst)
+
+    def curve(self, x, gain, taps):
+        return self.wet * x + self.dry * taps[self.tap]
+
+
+def shift_history(buffer, keep, frames):
+    """Сдвинуть последние keep элементов (buffer[frames:frames + keep]) в начало.
+
+    Копируется кусками не длиннее frames, чтобы источник и приёмник не
+    перекрывались: иначе numpy делает временную копию.
+    """
+    for lo in range(0, keep, frames):
+        hi = min(lo + frames, keep)
+        np.copyto(buffer[lo:hi], buffer[lo + frames:hi + frames])
+
+
+class LookaheadLimiter(Stage):
+    """Ограничитель пиков с заглядыванием вперёд вместо нормализации блока.
+
+    Выход задержан на lookahead_ms: усиление начинает снижаться заранее и к
+    приходу пика уже не больше ceiling/|пик|, поэтому нет ни перегрузки, ни
+    скачков громкости на границах блоков, а громкость не зависит от размера
+    блока. Снижение (атака) занимает всё окно заглядывания, восстановление
+    экспоненциальное с постоянной release_ms. Линия задержки и история
+    усиления переносятся между блоками.
+
+    Циклов по отсчётам нет:
+    - скользящий минимум за окно - алгоритм ван Херка/Гиль-Вермана на
+      minimum.accumulate по строкам длиной в окно;
+    - экспоненциальное восстановление max(d[n], a*d[n-1]) - накопленный
+      максимум log(d[k]) + k/tau, из которого потом вычитается n/tau;
+    - сглаживание атаки - скользящее среднее через cumsum.
+    Со linked каналы связаны: усиление общее, по максимальному из каналов.
+    Без него (независимые микрофоны, MultiMicEngine) у каждого канала своё
+    усиление: те же операции идут по столбцам сразу для всех каналов.
+    """
+
+    elementwise = False
+
+    def __init__(self, ceiling=0.95, lookahead_ms=1.5, release_ms=60.0, linked=True):
+        self.ceiling = ceiling
+        self.lookahead_ms = lookahead_ms
+        self.release_ms = release_ms
+        self.linked = linked
+        self.latency = 0
+
+    def prepare(self, frames, channels, dtype, sample_rate):
+        lookahead = max(1, int(round(self.lookahead_ms * sample_rate / 1000)))
+        window = lookahead + 1
+        self.latency = lookahead
+        self.window = window
+        # Строки по window отсчётов для скользящего минимума, с запасом под хвост
+        rows = -(-(lookahead + frames) // window)
+        decay = 1000.0 / (self.release_ms * sample_rate)
+        # Столбцов усиления: один общий или по одному на канал
+        width = 1 if self.linked else channels
+
+        self._delay = np.zeros((lookahead + frames, channels), dtype=dtype)
+        self._abs = np.zeros((frames, channels), dtype=dtype)
+        self._peak = np.zeros((frames, width))
+        # Допустимое усиление по отсчётам: lookahead прошлых + текущий блок + хвост
+        self._limit = np.ones((rows * window, width))
+        self._prefix = np.ones((rows * window, width))
+        self._suffix = np.ones((rows * window, width))
+        self._reversed = np.ones((rows * window, width))
+        self._atten = np.zeros((frames, width))
+        # Рампа на каждый столбец
+        self._decay_ramp = np.repeat((np.arange(frames) * decay)[:, np.newaxis], width, axis=1)
+        self._decay = decay
+        self._carry = np.full(width, -np.inf)
+        # Усиление до сглаживания: lookahead прошлых + текущий блок
+        self._gain = np.ones((lookahead + frames, width))
+        self._sums = np.zeros((lookahead + frames + 1, width))
+        self._smoothed = np.zeros((frames, width))
+        # Множитель в типе цепочки на все каналы
+        self._factor = np.zeros((frames, channels), dtype=dtype)
+
+    def widen(self, frames, channels, dtype, sample_rate):
+        # Линия задержки одноканальная: каналы совпадали, копируем её во все.
+        # История усиления тоже одна - общая или одинаковая для всех каналов
+        delay, limit, gain, carry = self._delay, self._limit, self._gain, self._carry
+        self.prepare(frames, channels, dtype, sample_rate)
+        np.copyto(self._delay, delay)
+        np.copyto(self._limit, limit)
+        np.copyto(self._gain, gain)
+        np.copyto(self._carry, carry)
+
+    def reset(self):
+        # Иначе после паузы из линии задержки выйдет хвост звука до неё
+        self._delay.fill(0)
+        self._limit.fill(1.0)
+        self._gain.fill(1.0)
+        self._carry.fill(-np.inf)
+
+    def process(self, src, dst, lo, hi):
+        frames = hi - lo
+        lookahead = self.latency
+        window = self.window
+
+        # Линия задержки: выход отстаёт от входа на lookahead кадров
+        delay = self._delay
+        np.copyto(delay[lookahead:lookahead + frames], src)
+
+        # Допустимое усиление для каждого входного кадра: ceiling / пик (по каналам, если связаны)
+        peak = self._peak[:frames]
+        magnitude = self._abs[:frames]
+        np.abs(src, out=magnitude)
+        if self.linked:
+            # max(axis=1) по двум-трём каналам в numpy в десятки раз медленнее попарного maximum
+            column = magnitude[:, 0]
+            for channel in range(1, magnitude.shape[1]):
+                np.maximum(column, magnitude[:, channel], out=column)
+            np.copyto(peak[:, 0], column)
+        else:
+            np.copyto(peak, magnitude)
+        np.maximum(peak, 1e-12, out=peak)
+        limit = self._limit
+        current = limit[lookahead:lookahead + frames]
+        np.divide(self.ceiling, peak, out=current)
+        np.minimum(current, 1.0, out=current)
+
+        # Скользящий минимум за окно [n - lookahead, n]
+        used = -(-(lookahead + frames) // window) * window
+        limit[lookahead + frames:used] = 1.0
+        width = limit.shape[1]
+        rows = limit[:used].reshape(-1, window, width)
+        prefix = self._prefix[:used].reshape(-1, window, width)
+        suffix = self._suffix[:used].reshape(-1, window, width)
+        reversed_rows = self._reversed[:used].reshape(-1, window, width)
+        np.minimum.accumulate(rows, axis=1, out=prefix)
+        # Минимум с конца строки: в прямой буфер, out с обратным шагом numpy пишет через копию
+        np.minimum.accumulate(rows[:, ::-1], axis=1, out=reversed_rows)
+        np.copyto(suffix[:, ::-1], reversed_rows)
+        atten = self._atten[:frames]
+        np.minimum(self._suffix[:frames], self._prefix[lookahead:lookahead + frames], out=atten)
+        shift_history(limit, lookahead, frames)
+
+        # Восстановление: d[n] = max(1 - min[n], d[n-1] * exp(-1/tau)) в логарифмах
+        np.subtract(1.0, atten, out=atten)
+        np.maximum(atten, 1e-9, out=atten)
+        np.log(atten, out=atten)
+        ramp = self._decay_ramp[:frames]
+        np.add(atten, ramp, out=atten)
+        np.maximum(atten[0], self._carry, out=atten[0])
+        np.maximum.accumulate(atten, axis=0, out=atten)
+        np.subtract(atten, ramp, out=atten)
+        np.subtract(atten[frames - 1], self._decay, out=self._carry)
+        np.exp(atten, out=atten)
+
+        # Сглаживание атаки: среднее усиления за окно длиной lookahead + 1
+        gain = self._gain
+        np.subtract(1.0, atten, out=gain[lookahead:lookahead + frames])
+        sums = self._sums
+        np.cumsum(gain[:lookahead + frames], axis=0, out=sums[1:lookahead + frames + 1])
+        smoothed = self._smoothed[:frames]
+        np.subtract(sums[window:window + frames], sums[:frames], out=smoothed)
+        np.multiply(smoothed, 1.0 / window, out=smoothed)
+        shift_history(gain, lookahead, frames)
+
+        factor = self._factor[:frames]
+        np.copyto(factor, smoothed, casting='same_kind')
+        np.multiply(delay[:frames], factor, out=dst)
+        shift_history(delay, lookahead, frames)
+
+
+class AutoGain(Gain):
+    """Автоматическое усиление (АРУ): громкость на выходе этапа держится около target_db.
+
+    Громкость - среднеквадратичное за окно attack_ms (скользящее среднее
+    квадратов через cumsum, история окна переносится между блоками), так
+    что рост громкости учитывается за время атаки. Спад огибающей -
+    экспоненциальный с постоянной release_ms: max(уровень[n], огибающая[n-1]
+    * exp(-1/tau)) в логарифмах считается накопленным максимумом, как
+    восстановление у LookaheadLimiter. Усиление - target / огибающая, но не
+    больше усиления из снимка параметров: в режиме АРУ поле усиления -
+    это предел. Переход предела при его смене - тот же, что у Gain.
+
+    Со linked у каналов одна огибающая (по средней мощности), без него
+    (MultiMicEngine) у каждого канала своя, а предел может быть вектором.
+    """
+
+    elementwise = False
+
+    def __init__(self, target_db=-20.0, attack_ms=10.0, release_ms=500.0, linked=True):
+        super().__init__()
+        self.target_db = target_db
+        self.attack_ms = attack_ms
+        self.release_ms = release_ms
+        self.linked = linked
+
+    def prepare(self, frames, channels, dtype, sample_rate):
+        super().prepare(frames, channels, dtype, sample_rate)
+        window = max(1, int(round(self.attack_ms * sample_rate / 1000)))
+        decay = 1000.0 / (self.release_ms * sample_rate)
+        width = 1 if self.linked else channels
+        self.window = window
+        self._decay = decay
+        # Квадраты входа: window прошлых + текущий блок
+        self._squares = np.zeros((window + frames, width))
+        self._sums = np.zeros((window + frames + 1, width))
+        self._power = np.zeros((frames, channels))
+        self._level = np.zeros((frames, width))
+        # Множитель в типе цепочки на все каналы
+        self._factor = np.zeros((frames, channels), dtype=dtype)
+        self._limit = np.zeros((frames, width))
+        self._log_gain = np.zeros(width)
+        # Предел на каждый кадр блока, рампа на каждый столбец
+        self._log_limit = np.zeros((frames, width))
+        self._decay_ramp = np.repeat((np.arange(frames) * decay)[:, np.newaxis], width, axis=1)
+        self._carry = np.full(width, -np.inf)
+
+    def widen(self, frames, channels, dtype, sample_rate):
+        # История и огибающая одна - общая или одинаковая для всех каналов
+        squares, carry = self._squares, self._carry
+        self.prepare(frames, channels, dtype, sample_rate)
+        np.copyto(self._squares, squares)
+        np.copyto(self._carry, carry)
+
+    def reset(self):
+        # Огибающую не сбрасываем: после паузы усиление продолжается с прежнего
+        # уровня, а не с предела, иначе первые миллисекунды звука выйдут слишком громко
+        pass
+
+    def begin(self, frames, gain):
+        super().begin(frames, gain)
+        if self.steady:
+            if np.ndim(gain):
+                np.maximum(gain, 1e-9, out=self._log_gain)
+                np.log(self._log_gain, out=self._log_gain)
+            else:
+                self._log_gain.fill(math.log(max(gain, 1e-9)))
+            np.copyto(self._log_limit[:frames], self._log_gain)
+
+    def process(self, src, dst, lo, hi):
+        frames = hi - lo
+        window = self.window
+
+        # Квадраты входа в историю окна (средняя мощность каналов, если связаны)
+        squares = self._squares
+        current = squares[window:window + frames]
+        power = self._power[:frames]
+        np.copyto(power, src)
+        np.multiply(power, power, out=power)
+        if self.linked:
+            column = current[:, 0]
+            np.copyto(column, power[:, 0])
+            for channel in range(1, power.shape[1]):
+                np.add(column, power[:, channel], out=column)
+            np.multiply(current, 1.0 / power.shape[1], out=current)
+        else:
+            np.copyto(current, power)
+        sums = self._sums
+        np.cumsum(squares[:window + frames], axis=0, out=sums[1:window + frames + 1])
+        level = self._level[:frames]
+        np.subtract(sums[window + 1:window + frames + 1], sums[1:frames + 1], out=level)
+        shift_history(squares, window, frames)
+
+        # Логарифм RMS за окно атаки
+        np.multiply(level, 1.0 / window, out=level)
+        np.maximum(level, 1e-12, out=level)
+        np.log(level, out=level)
+        np.multiply(level, 0.5, out=level)
+
+        # Огибающая: спад exp(-n/tau) через накопленный максимум со сдвигом n/tau
+        ramp = self._decay_ramp[:frames]
+        np.add(level, ramp, out=level)
+        np.maximum(level[0], self._carry, out=level[0])
+        np.maximum.accumulate(level, axis=0, out=level)
+        np.subtract(level, ramp, out=level)
+        np.subtract(level[frames - 1], self._decay, out=self._carry)
+
+        # Усиление в логарифмах: target - огибающая, не больше предела
+        np.subtract(self.target_db * math.log(10) / 20, level, out=level)
+        if self.steady:
+            np.minimum(level, self._log_limit[lo:hi], out=level)
+        else:
+            limit = self._limit[:frames]
+            np.copyto(limit, self._ramp[lo:hi, :self._width])
+            np.maximum(limit, 1e-9, out=limit)
+            np.log(limit, out=limit)
+            np.minimum(level, limit, out=level)
+        np.exp(level, out=level)
+        factor = self._factor[:frames]
+        np.copyto(factor, level)
+        np.multiply(src, factor, out=dst)
+
+
+class BiquadSection(namedtuple('BiquadSection', ['kind', 'frequency', 'q', 'gain_db'],
+                               defaults=(math.sqrt(0.5), 0.0))):
+    """Звено фильтра: kind - 'highpass', 'lowshelf' или 'peaking', частота в Гц,
+    добротность и усиление в дБ (для полки и колокола)"""
+    __slots__ = ()
+
+
+# Срез от гула и постоянной составляющей перед усилением: Баттерворт 4-го порядка, 80 Гц
+RUMBLE_FILTER = (
+    BiquadSection('highpass', 80.0, 0.5412),
+    BiquadSection('highpass', 80.0, 1.3066),
+)
+# Длина куска блочного фильтра не меньше (кадров)
+BIQUAD_MIN_CHUNK = 32
+
+
+def biquad_coefficients(section, sample_rate):
+    """Коэффициенты звена по формулам RBJ: (b0, b1, b2, a1, a2), a0 = 1"""
+    w0 = 2 * math.pi * min(section.frequency, 0.49 * sample_rate) / sample_rate
+    cos_w0 = math.cos(w0)
+    alpha = math.sin(w0) / (2 * section.q)
+    amp = 10 ** (section.gain_db / 40)
+    if section.kind == 'highpass':
+        b = ((1 + cos_w0) / 2, -(1 + cos_w0), (1 + cos_w0) / 2)
+        a = (1 + alpha, -2 * cos_w0, 1 - alpha)
+    elif section.kind == 'peaking':
+        b = (1 + alpha * amp, -2 * cos_w0, 1 - alpha * amp)
+        a = (1 + alpha / amp, -2 * cos_w0, 1 - alpha / amp)
+    elif section.kind == 'lowshelf':
+        root = 2 * math.sqrt(amp) * alpha
+        b = (amp * ((amp + 1) - (amp - 1) * cos_w0 + root),
+             2 * amp * ((amp - 1) - (amp + 1) * cos_w0),
+             amp * ((amp + 1) - (amp - 1) * cos_w0 - root))
+        a = ((amp + 1) + (amp - 1) * cos_w0 + root,
+             -2 * ((amp - 1) + (amp + 1) * cos_w0),
+             (amp + 1) + (amp - 1) * cos_w0 - root)
+    else:
+        raise ValueError(f"Неизвестный вид звена: {section.kind}")
+    return b[0] / a[0], b[1] / a[0], b[2] / a[0], a[1] / a[0], a[2] / a[0]
+
+
+def cascade_state_space(sections, sample_rate):
+    """Каскад звеньев как одна линейная система s' = A s + B x, y = C s + D x.
+
+    Состояние - (z1, z2) транспонированной прямой формы II каждого звена
+    подряд, так что смена коэффициентов не меняет смысла состояния.
+    """
+    order = 2 * len(sections)
+    A = np.zeros((order, order))
+    B = np.zeros(order)
+    C = np.zeros(order)
+    D = 1.0
+    for index, section in enumerate(sections):
+        b0, b1, b2, a1, a2 = biquad_coefficients(section, sample_rate)
+        k = 2 * index
+        # Вход звена - выход предыдущих: C s + D x
+        A[k, :k] = (b1 - a1 * b0) * C[:k]
+        A[k + 1, :k] = (b2 - a2 * b0) * C[:k]
+        A[k:k + 2, k:k + 2] = ((-a1, 1.0), (-a2, 0.0))
+        B[k:k + 2] = ((b1 - a1 * b0) * D, (b2 - a2 * b0) * D)
+        C[:k] *= b0
+        C[k] = 1.0
+        D *= b0
+    return A, B, C, D
+
+
+class BiquadCascade(Stage):
+    """Каскад биквадратных звеньев (срез низов, полка, колокол) целыми блоками.
+
+    Рекурсию по отсчётам на Python колбэк не потянет, поэтому блок делится
+    на куски по chunk кадров и фильтр считается как линейная система
+    (cascade_state_space):
+    - выход куска - нижнетреугольная тёплицева матрица импульсной
+      характеристики на вход куска плюс вклад состояния на его начале;
+    - состояния на началах всех кусков блока - одно умножение на матрицу
+      из степеней A^chunk, рекурсия между кусками тоже уходит в неё.
+    Так блок - три-четыре matmul для всех звеньев и каналов сразу, а
+    состояние переносится между блоками: результат не зависит от того, как
+    поток поделён на блоки. Матрицы считаются в prepare() и при
+    set_sections(), а не в колбэке.
+
+    Замер и проверка стыков блоков: python benchmark.py biquad
+    """
+
+    elementwise = False
+
+    def __init__(self, sections=RUMBLE_FILTER):
+        self.sections = tuple(sections)
+        self._design = None
+
+    def prepare(self, frames, channels, dtype, sample_rate):
+        order = 2 * len(self.sections)
+        # Тёплицева часть дорожает с длиной куска, рекурсия по кускам - с их числом;
+        # кусок ~ sqrt(frames * order) / 2 - лучший по замеру (benchmark.py biquad)
+        chunk = min(frames, max(BIQUAD_MIN_CHUNK, int(math.sqrt(frames * order) / 2)))
+        chunks = frames // chunk
+        self.sample_rate = sample_rate
+        self.order = order
+        self.chunk = chunk
+        self.chunks = chunks
+        self._design = self._build(self.sections)
+        # Внутри float64: в float32 ошибка рекурсии около -80 дБ, а дальше её поднимает усиление.
+        # Куски входа (с хвостом блока) и состояния на их началах: [вход | состояние]
+        self._inputs = np.zeros((channels, chunks + 1, chunk + order))
+        # Состояние фильтра и вклады кусков в состояние: [состояние | u_0 ... u_chunks-1]
+        self._states = np.zeros((channels, order * (chunks + 1)))
+        self._starts = np.zeros((channels, order * (chunks + 1)))
+        self._outputs = np.zeros((channels, chunks + 1, chunk))
+        self._carry = np.zeros((channels, order))
+
+    def widen(self, frames, channels, dtype, sample_rate):
+        # Каналы совпадали: состояние одно, копируем его во все
+        state = self._states[0, :self.order].copy()
+        self.prepare(frames, channels, dtype, sample_rate)
+        self._states[:, :self.order] = state
+
+    def reset(self):
+        self._states[:, :self.order].fill(0)
+
+    def set_sections(self, sections):
+        """Новые параметры звеньев. Матрицы пересчитываются здесь (вне колбэка)
+        и подменяются одной записью ссылки, состояние сохраняется."""
+        sections = tuple(sections)
+        if sections == self.sections:
+            return
+        if self._design is not None and len(sections) != len(self.sections):
+            raise ValueError("Число звеньев меняется только до prepare()")
+        self.sections = sections
+        if self._design is not None:
+            self._design = self._build(sections)
+
+    def _build(self, sections):
+        """Матрицы блочного расчёта: (feed, starts, weights, tails)"""
+        A, B, C, D = cascade_state_space(sections, self.sample_rate)
+        order, chunk, chunks = self.order, self.chunk, self.chunks
+        powers = np.empty((chunk + 1, order, order))
+        powers[0] = np.eye(order)
+        for n in range(chunk):
+            np.matmul(A, powers[n], out=powers[n + 1])
+        # C A^n и A^n B, импульсная характеристика h[0] = D, h[n] = C A^(n-1) B
+        observed = C @ powers[:chunk]
+        driven = powers[:chunk] @ B
+        impulse = np.concatenate(([D], driven[:chunk - 1] @ C))
+        lag = np.subtract.outer(np.arange(chunk), np.arange(chunk))
+        toeplitz = np.where(lag >= 0, impulse[np.maximum(lag, 0)], 0.0)
+        # Выход куска: [вход | состояние] @ weights
+        weights = np.concatenate((toeplitz.T, observed.T))
+        # Вклад входа куска в состояние после него: вход @ feed
+        feed = driven[::-1]
+        # Состояния на началах кусков: [состояние | u_0 ...] @ starts, блок (i, k) = (M^(k-i))^T
+        step = powers[chunk]
+        jumps = np.empty((chunks + 1, order, order))
+        jumps[0] = np.eye(order)
+        for n in range(chunks):
+            np.matmul(step, jumps[n], out=jumps[n + 1])
+        distance = np.subtract.outer(np.arange(chunks + 1), np.arange(chunks + 1)).T
+        blocks = np.where((distance >= 0)[:, :, np.newaxis, np.newaxis],
+                          jumps[np.maximum(distance, 0)].transpose(0, 1, 3, 2), 0.0)
+        starts = blocks.transpose(0, 2, 1, 3).reshape((chunks + 1) * order, (chunks + 1) * order)
+        tails = np.ascontiguousarray(powers.transpose(0, 2, 1))
+        return np.ascontiguousarray(feed), starts, weights, tails
+
+    def process(self, src, dst, lo, hi):
+        frames = hi - lo
+        # Один раз за блок: set_sections() может подменить матрицы из другого потока
+        feed, starts, weights, tails = self._design
+        order, chunk = self.order, self.chunk
+        count, rest = divmod(frames, chunk)
+        main = count * chunk
+        used = count + (rest > 0)
+
+        inputs = self._inputs
+        if count:
+            np.copyto(inputs[:, :count, :chunk], src[:main].reshape(count, chunk, -1).transpose(2, 0, 1))
+        if rest:
+            # Хвост блока - неполный кусок, добитый нулями: на первые rest выходов они не влияют
+            np.copyto(inputs[:, count, :rest], src[main:].T)
+            inputs[:, count, rest:chunk] = 0
+
+        states = self._states
+        channels = len(states)
+        width = order * (count + 1)
+        np.matmul(inputs[:, :count, :chunk], feed,
+                  out=states[:, order:width].reshape(channels, count, order))
+        begin = self._starts[:, :width]
+        np.matmul(states[:, :width], starts[:width, :width], out=begin)
+        np.copyto(inputs[:, :used, chunk:], begin.reshape(channels, count + 1, order)[:, :used])
+        outputs = self._outputs[:, :used]
+        np.matmul(inputs[:, :used], weights, out=outputs)
+
+        if count:
+            np.copyto(dst[:main].reshape(count, chunk, -1), outputs[:, :count].transpose(1, 2, 0))
+        if rest:
+            np.copyto(dst[main:], outputs[:, count, :rest].T)
+
+        # Состояние после блока
+        last = begin[:, count * order:]
+        state = states[:, :order]
+        if rest:
+            np.matmul(last, tails[rest], out=state)
+            np.matmul(inputs[:, count, :rest], feed[chunk - rest:], out=self._carry)
+            np.add(state, self._carry, out=state)
+        else:
+            np.copyto(state, last)
+
+
+class SpectralDenoiser(Stage):
+    """Спектральное шумоподавление: STFT с перекрытием половиной окна.
+
+    Профиль шума (средняя мощность по частотам) набирается из блоков,
+    которые цепочка не считала, пока шумовой порог закрыт (learn). В
+    каждом кадре полоса ослабляется на max(floor, 1 - oversubtract *
+    шум / мощность), не больше чем на reduction_db. Пока профиля нет, звук
+    проходит без изменений.
+
+    Кадры идут с шагом hop = size / 2 независимо от размера блока потока:
+    вход копится в очереди, за блок считаются все полные кадры разом
+    (одно rfft и одно irfft на пакет кадров и каналов), выход берётся из
+    очереди готовых отсчётов. Окна - корень из окна Ханна на анализе и
+    синтезе, их произведение с перекрытием 1/2 в сумме даёт единицу.
+    Очередь выхода заранее заполнена hop - 1 нулями, так что на любой
+    размер блока выхода хватает, а задержка постоянная: size - 1 кадров
+    (latency). Цена на блок - python benchmark.py denoise.
+
+    Очереди и кадры - float64 (rfft в float32 копирует вход при каждом
+    вызове), кадры лежат по порядку, внутри по каналам, так что срез
+    [:count] непрерывен.
+    """
+
+    elementwise = False
+
+    def __init__(self, reduction_db=15.0, oversubtract=3.0, frame_ms=10.0, learn_ms=500.0):
+        self.reduction_db = reduction_db
+        self.oversubtract = oversubtract
+        self.frame_ms = frame_ms
+        self.learn_ms = learn_ms
+        self.latency = 0
+        self.size = 0
+        self.sample_rate = None
+        self.learned = 0
+
+    def prepare(self, frames, channels, dtype, sample_rate):
+        # Кадр - степень двойки около frame_ms: 512 на 44100 и 48000
+        size = 2 ** max(4, round(math.log2(self.frame_ms * sample_rate / 1000)))
+        hop = size // 2
+        bins = hop + 1
+        if size != self.size or sample_rate != self.sample_rate:
+            # Профиль шума переживает новый prepare, пока частоты полос те же
+            self._profile = np.zeros(bins)
+            self._threshold = np.zeros(bins)
+            self.learned = 0
+        self.size = size
+        self.hop = hop
+        self.sample_rate = sample_rate
+        self.latency = size - 1
+        self._floor = 10 ** (-self.reduction_db / 20)
+        n = np.arange(size)
+        window = np.sqrt(0.5 - 0.5 * np.cos(2 * np.pi * n / size))
+        # Кадров за блок не больше, чем помещается шагов в неполный шаг + блок
+        count = (hop - 1 + frames) // hop
+        # Очередь входа: hop прошлых отсчётов (половина кадра) + неполный шаг + блок
+        self._input = np.zeros((size + frames, channels))
+        # Очередь выхода: готовые отсчёты (меньше hop) + кадры блока
+        self._output = np.zeros((2 * hop + frames, channels))
+        self._frames = np.zeros((count, channels, size))
+        self._windows = np.zeros((count, channels, size))
+        np.copyto(self._windows, window)
+        self._spectrum = np.zeros((count, channels, bins), dtype=np.complex128)
+        self._power = np.zeros((count, channels, bins))
+        # Ослабление полос в комплексном виде, как и спектр
+        self._attenuation = np.zeros((count, channels, bins), dtype=np.complex128)
+        self._thresholds = np.zeros((count, channels, bins))
+        np.copyto(self._thresholds, self._threshold)
+        self._tail = np.zeros((channels, hop))
+        # Обучение: свои непересекающиеся кадры из одного канала входа
+        learn_count = (size - 1 + frames) // size
+        self._learn_input = np.zeros(size + frames)
+        self._learn_frames = np.zeros((learn_count, size))
+        self._learn_windows = np.zeros((learn_count, size))
+        np.copyto(self._learn_windows, window)
+        self._learn_spectrum = np.zeros((learn_count, bins), dtype=np.complex128)
+        self._learn_power = np.zeros((learn_count, bins))
+        self._learn_mean = np.zeros(bins)
+        self._learn_filled = 0
+        self.reset()
+
+    def widen(self, frames, channels, dtype, sample_rate):
+        # Каналы совпадали: очереди и хвост одноканальные, копируем их во все
+        state = self._input[:, :1].copy(), self._output[:, :1].copy(), self._tail[:1].copy()
+        filled, ready = self._filled, self._ready
+        self.prepare(frames, channels, dtype, sample_rate)
+        np.copyto(self._input[:len(state[0])], state[0])
+        np.copyto(self._output[:len(state[1])], state[1])
+        np.copyto(self._tail, state[2])
+        self._filled, self._ready = filled, ready
+
+    def reset(self):
+        # Профиль шума остаётся: его и набирали, пока цепочка не считалась
+        self._input.fill(0)
+        self._output.fill(0)
+        self._tail.fill(0)
+        self._filled = self.hop
+        self._ready = self.hop - 1
+
+    def learn(self, block, frames):
+        size = self.size
+        column = block if block.ndim == 1 else block[:, 0]
+        buffer = self._learn_input
+        filled = self._learn_filled
+        np.copyto(buffer[filled:filled + frames], column)
+        filled += frames
+        count = filled // size
+        if count:
+            frames_view = self._learn_frames[:count]
+            np.multiply(buffer[:count * size].reshape(count, size), self._learn_windows[:count],
+                        out=frames_view)
+            spectrum = self._learn_spectrum[:count]
+            np.fft.rfft(frames_view, axis=-1, out=spectrum)
+            power = self._learn_power[:count]
+            np.abs(spectrum, out=power)
+            np.multiply(power, power, out=power)
+            mean = self._learn_mean
+            np.mean(power, axis=0, out=mean)
+            # Экспоненциальное среднее с постоянной learn_ms, count кадров сразу
+            step = 1 - math.exp(-size / (self.learn_ms * self.sample_rate / 1000))
+            rate = 1.0 if not self.learned else 1 - (1 - step) ** count
+            profile = self._profile
+            np.subtract(mean, profile, out=mean)
+            np.multiply(mean, rate, out=mean)
+            np.add(profile, mean, out=profile)
+            np.multiply(profile, self.oversubtract, out=self._threshold)
+            np.copyto(self._thresholds, self._threshold)
+            self.learned += count
+            shift_history(buffer, filled - count * size, count * size)
+            filled -= count * size
+        self._learn_filled = filled
+
+    def process(self, src, dst, lo, hi):
+        frames = hi - lo
+        hop = self.hop
+
+        inputs = self._input
+        filled = self._filled
+        np.copyto(inputs[filled:filled + frames], src)
+        filled += frames
+        # Полных кадров: hop прошлых отсчётов + шаги
+        count = (filled - hop) // hop
+
+        if count:
+            channels = inputs.shape[1]
+            steps = inputs[:(count + 1) * hop].reshape(count + 1, hop, channels).transpose(0, 2, 1)
+            blocks = self._frames[:count]
+            windows = self._windows[:count]
+            np.copyto(blocks[:, :, :hop], steps[:count])
+            np.copyto(blocks[:, :, hop:], steps[1:])
+            np.multiply(blocks, windows, out=blocks)
+            spectrum = self._spectrum[:count]
+            np.fft.rfft(blocks, axis=-1, out=spectrum)
+
+            # Ослабление полос: max(floor, 1 - порог / мощность)
+            power = self._power[:count]
+            np.abs(spectrum, out=power)
+            np.multiply(power, power, out=power)
+            np.maximum(power, 1e-20, out=power)
+            np.divide(self._thresholds[:count], power, out=power)
+            np.subtract(1.0, power, out=power)
+            np.maximum(power, self._floor, out=power)
+            attenuation = self._attenuation[:count]
+            np.copyto(attenuation, power)
+            np.multiply(spectrum, attenuation, out=spectrum)
+
+            np.fft.irfft(spectrum, n=self.size, axis=-1, out=blocks)
+            np.multiply(blocks, windows, out=blocks)
+
+            # Сложение с перекрытием прямо в очередь выхода, по кадру
+            ready = self._ready
+            added = self._output[ready:ready + count * hop].reshape(count, hop, channels)
+            added = added.transpose(0, 2, 1)
+            np.add(blocks[0, :, :hop], self._tail, out=added[0])
+            for frame in range(1, count):
+                np.add(blocks[frame, :, :hop], blocks[frame - 1, :, hop:], out=added[frame])
+            np.copyto(self._tail, blocks[-1, :, hop:])
+            self._ready = ready + count * hop
+
+            shift_history(inputs, filled - count * hop, count * hop)
+            filled -= count * hop
+        self._filled = filled
+
+        outputs = self._output
+        np.copyto(dst, outputs[:frames], casting='same_kind')
+        self._ready -= frames
+        shift_history(outputs, self._ready, frames)
+
+
+class StageGroup:
+    """Подряд идущие этапы, которые проходят по буферу за один проход.
+
+    Поэлементная группа идёт кусками по tile_frames кадров. Если она
+    начинается с усиления, её целиком можно заменить таблицей передаточной
+    кривой (waveshaper.py).
+    """
+
+    def __init__(self, stages, tile_frames=TILE_FRAMES):
+        self.stages = stages
+        self.elementwise = all(stage.elementwise for stage in stages)
+        self.tile_frames = tile_frames if self.elementwise else None
+        self.warp = any(stage.warp for stage in stages)
+        self.gain_stage = stages[0] if isinstance(stages[0], Gain) else None
+        self.table = None
+        self._lookup = TableLookup()
+        # Связанные методы собираются заранее: в колбэке на счету каждая микросекунда
+        self._begins = [stage.begin for stage in stages if type(stage).begin is not Stage.begin]
+        self._processes = [stage.process for stage in stages]
+
+    @property
+    def tabulable(self):
+        return self.elementwise and self.gain_stage is not None
+
+    def prepare(self, frames, channels, dtype, sample_rate):
+        for stage in self.stages:
+            stage.prepare(frames, channels, dtype, sample_rate)
+        if self.tabulable:
+            self._lookup.prepare(frames, channels)
+
+    def widen(self, frames, channels, dtype, sample_rate):
+        for stage in self.stages:
+            stage.widen(frames, channels, dtype, sample_rate)
+        if self.tabulable:
+            self._lookup.prepare(frames, channels)
+
+    def reset(self):
+        for stage in self.stages:
+            stage.reset()
+
+    def curve(self, x, gain):
+        """Передаточная кривая всей группы (точная, float64)"""
+        taps = {}
+        for stage in self.stages:
+            x = stage.curve(x, gain, taps)
+        return x
+
+    def set_table(self, table):
+        self.table = table
+
+    def run(self, src, dst, frames, gain):
+        for begin in self._begins:
+            begin(frames, gain)
+
+        # Таблица построена под одно усиление, во время перехода считаем точно
+        table = self.table
+        if table is not None and table.gain == gain and self.gain_stage.steady:
+            self._lookup.process(table, src, dst)
+            return
+
+        tile = self.tile_frames
+        if tile is None or frames <= tile:
+            # Обычный блок потока помещается в один кусок
+            for process in self._processes:
+                process(src, dst, 0, frames)
+                src = dst
+            return
+
+        for lo in range(0, frames, tile):
+            hi = min(lo + tile, frames)
+            stage_src = src[lo:hi]
+            stage_dst = dst[lo:hi]
+            for process in self._processes:
+                process(stage_src, stage_dst, lo, hi)
+                stage_src = stage_dst
+
+
+class ChannelLayout:
+    """Какой канал входа обрабатывается и в какие каналы выхода он идёт.
+
+    source - номер канала входа, который обрабатывается один раз и
+    копируется в каналы выхода targets (None - во все, остальные молчат);
+    так раскладываются устройства больше чем с двумя каналами. Без source
+    цепочка сама сравнивает каналы входа: пока они совпадают (или вход
+    моно), считается только первый. Как только каналы разошлись, до
+    следующего prepare() все каналы обрабатываются как есть.
+    """
+
+    def __init__(self, source=None, targets=None):
+        self.source = source
+        self.targets = targets
+
+    def broadcast(self, mono, outdata):
+        """Разложить обработанный канал (frames, 1) по каналам выхода"""
+        # Копия по столбцам: copyto(outdata, mono) с растяжением идёт по строкам
+        # длиной в число каналов и в несколько раз медленнее
+        column = mono[:, 0]
+        targets = self.targets
+        for channel in range(outdata.shape[1]):
+            if targets is None or channel in targets:
+                np.copyto(outdata[:, channel], column)
+            else:
+                outdata[:, channel] = 0
+
+
+def consecutive(channels):
+    """slice, если каналы идут подряд по возрастанию, иначе None"""
+    first = channels[0]
+    if channels == tuple(range(first, first + len(channels))):
+        return slice(first, first + len(channels))
+    return None
+
+
+class MicLayout:
+    """Несколько микрофонов в одном потоке: вход inputs[i] - микрофон i, его выход - outputs[i].
+
+    Микрофоны, направленные в один канал выхода, складываются (сумму
+    ограничивает MultiMicEngine); каналы выхода без микрофонов молчат. Номера каналов с нуля. Если каналы идут
+    подряд, цепочка читает вход и пишет выход видами без копий
+    (input_slice, output_slice).
+    """
+
+    # Для кода, который смотрит на ChannelLayout: один канал источника не выбран
+    source = None
+
+    def __init__(self, inputs, outputs=None):
+        inputs = tuple(inputs)
+        if outputs is None:
+            outputs = tuple(range(len(inputs)))
+        if len(outputs) != len(inputs):
+            raise ValueError("Каналов выхода должно быть столько же, сколько микрофонов")
+        self.inputs = inputs
+        self.outputs = tuple(outputs)
+        self.targets = tuple(sorted(set(self.outputs)))
+        self.input_slice = consecutive(self.inputs)
+        unique = len(self.targets) == len(self.outputs)
+        self.output_slice = consecutive(self.outputs) if unique else None
+        self.shared = not unique
+        self._inputs = np.array(self.inputs, dtype=np.intp)
+        # Несколько микрофонов в одном канале: первый копируется, следующие прибавляются
+        seen = set()
+        self._routes = []
+        for mic, channel in enumerate(self.outputs):
+            self._routes.append((mic, channel, channel in seen))
+            seen.add(channel)
+
+    @property
+    def mics(self):
+        return len(self.inputs)
+
+    def gather(self, indata, mics):
+        """Каналы микрофонов из блока входа в буфер (frames, микрофонов)"""
+        # mode='clip' - без промежуточного буфера, номера уже проверены при настройке
+        np.take(indata, self._inputs, axis=1, out=mics, mode='clip')
+
+    def silence_others(self, outdata):
+        """Каналы выхода без микрофонов молчат"""
+        targets = self.targets
+        for channel in range(outdata.shape[1]):
+            if channel not in targets:
+                outdata[:, channel] = 0
+
+    def scatter(self, mics, outdata):
+        """Обработанные микрофоны по каналам выхода"""
+        self.silence_others(outdata)
+        # По столбцам: присваивание по списку номеров выделяет память
+        for mic, channel, add in self._routes:
+            if add:
+                np.add(outdata[:, channel], mics[:, mic], out=outdata[:, channel])
+            else:
+                np.copyto(outdata[:, channel], mics[:, mic])
+
+
+def mean_square(block, frames):
+    """Средний квадрат блока без копий.
+
+    Весь блок - плоский vdot; один столбец - вид с шагом, dot обходится без копии.
+    """
+    if block.ndim > 1:
+        return float(np.vdot(block, block)) / block.size
+    return float(np.dot(block, block)) / frames
+
+
+class NoiseGate:
+    """Шумовой порог по энергии блока с гистерезисом и удержанием.
+
+    Энергия - средний квадрат входа за блок (один dot), без логарифмов:
+    пороги переведены в мощность заранее. Порог открывается, когда
+    уровень выше open_db, и закрывается, когда уровень ниже close_db
+    дольше hold_ms. На блоке открытия и закрытия выход цепочки плавно
+    нарастает или спадает за fade_ms, дальше закрытый порог - это тишина
+    без расчёта цепочки (bypassed).
+
+    Пишет только аудиопоток; open, power и счётчики читаются снаружи как есть.
+    """
+
+    def __init__(self, open_db=-55.0, close_db=-60.0, hold_ms=250.0, fade_ms=5.0):
+        if close_db > open_db:
+            raise ValueError("Порог закрытия должен быть не выше порога открытия")
+        self.open_db = open_db
+        self.close_db = close_db
+        self.hold_ms = hold_ms
+        self.fade_ms = fade_ms
+        self.open_power = 10 ** (open_db / 10)
+        self.close_power = 10 ** (close_db / 10)
+        self.hold = 0
+        self.reset()
+
+    def reset(self):
+        self.open = False
+        # +1 - блок открытия (нарастание), -1 - блок закрытия (спад), 0 - без перехода
+        self.fading = 0
+        # Блок прошёл быстрым путём: цепочка не считалась
+        self.bypassed = False
+        self.power = 0.0
+        self.quiet = 0
+        self.transitions = 0
+        self.closed_blocks = 0
+
+    @property
+    def level_db(self):
+        """Уровень последнего блока, дБ от полной шкалы"""
+        return 10 * np.log10(self.power + 1e-20)
+
+    def prepare(self, frames, dtype, sample_rate):
+        self.hold = int(self.hold_ms * sample_rate / 1000)
+        fade = max(1, min(frames, int(round(self.fade_ms * sample_rate / 1000))))
+        self._fade_in = (np.arange(1, fade + 1) / fade).astype(dtype)
+        self._fade_out = (np.arange(fade - 1, -1, -1) / fade).astype(dtype)
+        self.reset()
+
+    def update(self, probe, frames):
+        """Решение по блоку входа probe; False - цепочку считать не нужно"""
+        power = mean_square(probe, frames)
+        self.power = power
+        self.fading = 0
+        if self.open:
+            if power < self.close_power:
+                self.quiet += frames
+                if self.quiet >= self.hold:
+                    self.open = False
+                    self.fading = -1
+                    self.transitions += 1
+            else:
+                self.quiet = 0
+        elif power > self.open_power:
+            self.open = True
+            self.quiet = 0
+            self.fading = 1
+            self.transitions += 1
+        self.bypassed = not self.open and not self.fading
+        if self.bypassed:
+            self.closed_blocks += 1
+        return not self.bypassed
+
+    def apply_fade(self, outdata, frames):
+        """Нарастание или спад в начале блока перехода, после спада - тишина"""
+        ramp = self._fade_in if self.fading > 0 else self._fade_out
+        # Хвост рампы: на коротком блоке она всё равно доходит до 1 или 0
+        count = min(len(ramp), frames)
+        ramp = ramp[len(ramp) - count:]
+        # По столбцам, без растяжения рампы
+        for channel in range(outdata.shape[1]):
+            column = outdata[:count, channel]
+            np.multiply(column, ramp, out=column)
+        if self.fading < 0:
+            outdata[count:] = 0
+
+
+# Порог закрытия ниже порога открытия, чтобы порог не дребезжал на границе
+GATE_HYSTERESIS_DB = 5.0
+
+
+def noise_gate(gate_db):
+    """Шумовой порог, открывающийся на gate_db дБ (закрывается на GATE_HYSTERESIS_DB ниже)"""
+    return NoiseGate(gate_db, gate_db - GATE_HYSTERESIS_DB)
+
+
+class LevelMeter:
+    """Пик, RMS и число перегрузок на входе и выходе цепочки для индикатора.
+
+    Аудиопоток пишет текущие значения в values - массив из шести чисел,
+    выделенный заранее; окно читает его таймером с любой частотой и ничего
+    не сбрасывает. Поэтому спад пика и усреднение RMS (постоянная
+    release_ms) считаются здесь же: пик - max(пик блока, пик * спад), RMS -
+    экспоненциальное среднее квадрата. На блок - max и min, один dot (на
+    входе мощность берётся у шумового порога) и подсчёт перегрузок, только
+    если пик дошёл до clip_level.
+    """
+
+    INPUT = 0
+    OUTPUT = 3
+    # Смещения внутри стороны: пик, средний квадрат, кадров с перегрузкой с запуска
+    PEAK, POWER, CLIPS = range(3)
+
+    def __init__(self, release_ms=300.0, clip_level=0.99):
+        self.release_ms = release_ms
+        self.clip_level = clip_level
+        self.values = np.zeros(6)
+        self._release = 1.0
+
+    def prepare(self, frames, sample_rate):
+        self._release = self.release_ms * sample_rate / 1000
+        self._magnitude = np.zeros(frames, dtype=np.float32)
+        self._flags = np.zeros(frames, dtype=bool)
+        self._clipped = np.zeros(frames, dtype=bool)
+        self.values.fill(0)
+
+    def measure(self, side, block, frames, power=None):
+        """Уровни блока (frames,) или (frames, каналы) для стороны INPUT/OUTPUT"""
+        values = self.values
+        peak = max(float(block.max()), -float(block.min()))
+        if power is None:
+            power = mean_square(block, frames)
+        decay = math.exp(-frames / self._release)
+        values[side] = max(peak, values[side] * decay)
+        values[side + 1] = values[side + 1] * decay + power * (1 - decay)
+        if peak >= self.clip_level:
+            values[side + 2] += self._count_clips(block, frames)
+
+    def silence(self, side, frames):
+        """Блок тишины: уровни только спадают"""
+        decay = math.exp(-frames / self._release)
+        self.values[side] *= decay
+        self.values[side + 1] *= decay
+
+    def _count_clips(self, block, frames):
+        # Кадр перегружен, если перегружен любой из каналов
+        magnitude = self._magnitude[:frames]
+        flags = self._flags[:frames]
+        clipped = self._clipped[:frames]
+        clipped.fill(False)
+        columns = (block,) if block.ndim == 1 else (block[:, channel] for channel in range(block.shape[1]))
+        for column in columns:
+            np.abs(column, out=magnitude)
+            np.greater_equal(magnitude, self.clip_level, out=flags)
+            np.logical_or(clipped, flags, out=clipped)
+        return np.count_nonzero(clipped)
+
+
+class Chain:
+    """Цепочка этапов обработки с объединением поэлементных этапов.
+
+    Группа, которая начинается с усиления, может работать по таблице
+    передаточной кривой (build_table_now, обработка файлов): таблица
+    построена под одно усиление, при другом работает точный расчёт.
+
+    Раскладку каналов задаёт layout (ChannelLayout). Когда каналы входа
+    расходятся, этапы переходят на все каналы с сохранением состояния
+    (widen), поэтому результат совпадает с обработкой всех каналов с начала.
+
+    С шумовым порогом gate (NoiseGate) закрытый порог пропускает цепочку
+    целиком; при открытии состояние этапов сбрасывается (reset), чтобы не
+    вышел хвост звука до паузы. Вход закрытых блоков получают этапы с
+    learn() (профиль шума SpectralDenoiser). Уровни входа и выхода пишутся в meter
+    (LevelMeter), если он задан.
+    """
+
+    def __init__(self, stages, dtype=np.float32, tile_frames=TILE_FRAMES,
+                 sample_rate=48000, layout=None, gate=None):
+        self.stages = stages
+        self.dtype = dtype
+        self.sample_rate = sample_rate
+        self.layout = layout or ChannelLayout()
+        self.gate = gate
+        self.meter = None
+        self.frames = 0
+        self.channels = 0
+        # Каналы входа разошлись: обрабатываются все, а не один
+        self.split = False
+
+        # Этапы, которым нужен вход, пока порог закрыт (профиль шума)
+        self._learners = [stage.learn for stage in stages if type(stage).learn is not Stage.learn]
+
+        taps = {stage.name: stage for stage in stages if isinstance(stage, Tap)}
+        for stage in stages:
+            if isinstance(stage, Mix):
+                stage.source = taps[stage.tap]
+
+        self.groups = []
+        fused = []
+        for stage in stages:
+            if stage.elementwise:
+                fused.append(stage)
+                continue
+            if fused:
+                self.groups.append(StageGroup(fused, tile_frames))
+                fused = []
+            self.groups.append(StageGroup([stage], tile_frames))
+        if fused:
+            self.groups.append(StageGroup(fused, tile_frames))
+
+        self.shaped = next((group for group in self.groups if group.tabulable), None)
+
+    @property
+    def table(self):
+        return self.shaped.table if self.shaped is not None else None
+
+    @property
+    def latency(self):
+        """Задержка выхода относительно входа в кадрах (известна после prepare)"""
+        return sum(stage.latency for stage in self.stages)
+
+    def prepare(self, frames, channels):
+        """Выделить рабочие буферы под размер блока и число каналов выхода потока.
+
+        Этапы готовятся на один канал: пока каналы входа совпадают, больше не нужно.
+        """
+        self.frames = frames
+        self.channels = channels
+        self.split = False
+        self._mono = np.zeros((frames, 1), dtype=self.dtype)
+        self._equal = np.zeros(frames, dtype=bool)
+        for group in self.groups:
+            group.prepare(frames, 1, self.dtype, self.sample_rate)
+        if self.gate is not None:
+            self.gate.prepare(frames, self.dtype, self.sample_rate)
+        if self.meter is not None:
+            self.meter.prepare(frames, self.sample_rate)
+
+    def reset(self):
+        for group in self.groups:
+            group.reset()
+
+    def _same_channels(self, indata, frames):
+        equal = self._equal[:frames]
+        first = indata[:, 0]
+        for channel in range(1, indata.shape[1]):
+            np.equal(first, indata[:, channel], out=equal)
+            if not equal.all():
+                return False
+        return True
+
+    def _split(self):
+        self.split = True
+        for group in self.groups:
+            group.widen(self.frames, self.channels, self.dtype, self.sample_rate)
+
+    def build_table_now(self, gain):
+        """Построить таблицу синхронно (для обработки файлов)"""
+        if self.shaped is not None:
+            self.shaped.set_table(build_table(self.shaped.curve, gain, self.shaped.warp))
+
+    def process(self, indata, outdata, gain):
+        frames = len(indata)
+        if frames > self.frames or outdata.shape[1] != self.channels:
+            # PortAudio может прислать блок другого размера (blocksize=0 и т.п.)
+            self.prepare(max(frames, self.frames), outdata.shape[1])
+
+        gate = self.gate
+        meter = self.meter
+        if gate is None and meter is None:
+            self._process(indata, outdata, frames, gain)
+            return
+        source = self.layout.source
+        probe = indata if source is None else indata[:, source]
+        active = gate.update(probe, frames) if gate is not None else True
+        if meter is not None:
+            # Мощность входа порог уже посчитал
+            meter.measure(meter.INPUT, probe, frames, gate.power if gate is not None else None)
+        if not active:
+            # Быстрый путь: порог закрыт, цепочка не считается
+            for learn in self._learners:
+                learn(probe, frames)
+            outdata.fill(0)
+            if meter is not None:
+                meter.silence(meter.OUTPUT, frames)
+            return
+        if gate is not None and gate.fading > 0:
+            self.reset()
+        result = self._process(indata, outdata, frames, gain)
+        if gate is not None and gate.fading:
+            gate.apply_fade(outdata, frames)
+            result = outdata
+        if meter is not None:
+            meter.measure(meter.OUTPUT, result, frames)
+
+    def _process(self, indata, outdata, frames, gain):
+        """Обработать блок, вернуть буфер с результатом (один канал до раскладки или outdata)"""
+        source = self.layout.source
+        if source is None and not self.split:
+            source = 0
+            if indata.shape[1] == self.channels > 1 and not self._same_channels(indata, frames):
+                # Стереовход: этапы переходят на все каналы (один раз до prepare)
+                self._split()
+        if self.split:
+            self._run(indata, outdata, frames, gain)
+            return outdata
+
+        # Один канал входа - вид без копии; на один канал выхода пишем сразу
+        column = indata[:, source:source + 1]
+        if self.channels == 1:
+            self._run(column, outdata, frames, gain)
+            return outdata
+        mono = self._mono[:frames]
+        self._run(column, mono, frames, gain)
+        self.layout.broadcast(mono, outdata)
+        return mono
+
+    def _run(self, src, dst, frames, gain):
+        # Первая группа читает вход, остальные работают в dst на месте
+        for group in self.groups:
+            group.run(src, dst, frames, gain)
+            src = dst
+
+
+def rumble_stages(rumble):
+    """Срез гула и постоянной составляющей для начала цепочки (пустой список без rumble)"""
+    return [BiquadCascade(RUMBLE_FILTER)] if rumble else []
+
+
+def denoise_stages(denoise):
+    """Этапы шумоподавления для начала цепочки (пустой список без denoise)"""
+    return [SpectralDenoiser()] if denoise else []
+
+
+def amplifier_stage(agc):
+    """Усиление цепочки: agc - целевая громкость АРУ в дБ, None - постоянное усиление"""
+    return Gain() if agc is None else AutoGain(agc)
+
+
+class HardClipEngine(Chain):
+    """Усиление с жёстким ограничением (mic_amplifier.py)"""
+
+    def __init__(self, dtype=np.float32, sample_rate=48000, denoise=False, agc=None,
+                 rumble=False):
+        super().__init__([
+            # Гул и постоянная составляющая до усиления сдвигают порог ограничения
+            *rumble_stages(rumble),
+            *denoise_stages(denoise),
+            amplifier_stage(agc),
+            # Ограничиваем значения для предотвращения искажений
+            Clipper(1),
+        ], dtype, sample_rate=sample_rate)
+
+
+class SoftClipEngine(Chain):
+    """Усиление с мягким ограничением tanh и ограничителем пиков (app.py)"""
+
+    def __init__(self, dtype=np.float32, sample_rate=48000, denoise=False, agc=None,
+                 rumble=False):
+        super().__init__([
+            # Срез гула и постоянной составляющей до нелинейности
+            *rumble_stages(rumble),
+            *denoise_stages(denoise),
+            amplifier_stage(agc),
+            Waveshaper('tanh'),
+            LookaheadLimiter(0.95),
+        ], dtype, sample_rate=sample_rate)
+
+
+class DistortionEngine(Chain):
+    """Цепочка искажения для виртуального кабеля (mic_amplifier_gui.py)"""
+
+    def __init__(self, dtype=np.float32, sample_rate=48000, denoise=False, agc=None,
+                 rumble=False):
+        super().__init__([
+            # Гул и постоянная составляющая после усиления в 50 раз ушли бы прямо в искажение
+            *rumble_stages(rumble),
+            # Шум дешёвого микрофона до усиления (по желанию, с задержкой в кадр STFT)
+            *denoise_stages(denoise),
+            # ОЧЕНЬ сильное усиление (или АРУ с ним как пределом)
+            amplifier_stage(agc),
+            Scale(50),
+            Tap('amplified'),
+            # Сильное искажение (эффект "пердения")
+            Scale(2.5),
+            Clipper(1),
+            Waveshaper('sqrt'),
+            # Смешиваем с небольшой долей оригинального сигнала
+            Mix('amplified', wet=0.9, dry=0.1),
+            # Дополнительное синусоидальное искажение
+            Waveshaper('sin'),
+            # Ограничитель пиков для предотвращения перегрузки
+            LookaheadLimiter(0.95),
+        ], dtype, sample_rate=sample_rate)
+
+
+# Цепочки обработки по именам, как в интерфейсах программы. С rumble=True
+# каждая начинается со среза гула RUMBLE_FILTER (80 Гц)
+ENGINES = {
+    'distortion': DistortionEngine,  # mic_amplifier_gui.py
+    'softclip': SoftClipEngine,  # app.py
+    'hardclip': HardClipEngine,  # mic_amplifier.py
+}
+
+
+class MultiMicEngine(Chain):
+    """Несколько микрофонов одним проходом цепочки (по ведущему на микрофон).
+
+    Микрофоны из одного многоканального потока собираются в буфер
+    (frames, микрофонов), и этапы цепочки kind из ENGINES считают все
+    столбцы разом: вызовов numpy на блок столько же, сколько у одного
+    микрофона. Усиление - вектор по микрофонам (AmpParams.gains),
+    ограничитель и АРУ (agc) у каждого микрофона свои. Раскладка - MicLayout.
+    Шумовой порог и индикатор уровня, если заданы, общие на все микрофоны.
+
+    Если несколько микрофонов направлены в один канал (layout.shared), их
+    сумма может выйти за потолок ограничителя каждого микрофона. Тогда
+    после сложения выход проходит общий ограничитель (bus) по каналам
+    выхода с потолком последнего ограничителя цепочки (1.0 без него);
+    его задержка входит в latency.
+
+    Замер цены на микрофон: python benchmark.py mics
+    """
+
+    def __init__(self, layout, kind='softclip', dtype=np.float32, sample_rate=48000, agc=None,
+                 rumble=False):
+        stages = ENGINES[kind](dtype, agc=agc, rumble=rumble).stages
+        for stage in stages:
+            if isinstance(stage, (LookaheadLimiter, AutoGain)):
+                stage.linked = False
+        super().__init__(stages, dtype, sample_rate=sample_rate, layout=layout)
+        self.bus = None
+        if layout.shared:
+            limiters = [stage for stage in stages if isinstance(stage, LookaheadLimiter)]
+            ceiling = limiters[-1].ceiling if limiters else 1.0
+            self.bus = LookaheadLimiter(ceiling, linked=False)
+
+    @property
+    def latency(self):
+        bus = self.bus.latency if self.bus is not None else 0
+        return super().latency + bus
+
+    def prepare(self, frames, channels):
+        super().prepare(frames, channels)
+        mics = self.layout.mics
+        self._mics = np.zeros((frames, mics), dtype=self.dtype)
+        self._result = np.zeros((frames, mics), dtype=self.dtype)
+        # Микрофоны независимы: каналы не сравниваются, этапы сразу на все столбцы
+        self.split = True
+        for group in self.groups:
+            group.prepare(frames, mics, self.dtype, self.sample_rate)
+        if self.bus is not None:
+            self.bus.prepare(frames, channels, self.dtype, self.sample_rate)
+
+    def reset(self):
+        super().reset()
+        if self.bus is not None:
+            self.bus.reset()
+
+    def _process(self, indata, outdata, frames, gain):
+        layout = self.layout
+        if layout.input_slice is not None:
+            mics = indata[:, layout.input_slice]
+        else:
+            mics = self._mics[:frames]
+            layout.gather(indata, mics)
+        if layout.output_slice is not None:
+            # Этапы пишут прямо в каналы выхода
+            result = outdata[:, layout.output_slice]
+            layout.silence_others(outdata)
+            self._run(mics, result, frames, gain)
+            return result
+        result = self._result[:frames]
+        self._run(mics, result, frames, gain)
+        layout.scatter(result, outdata)
+        if self.bus is not None:
+            # Сумма микрофонов в общем канале: потолок после сложения
+            self.bus.process(outdata, outdata, 0, frames)
+            return outdata
+        return result
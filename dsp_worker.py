@@ -0,0 +1,440 @@
+"""
+Обработка звука в отдельном процессе.
+
+В окне колбэк PortAudio, numpy и цикл событий Qt делят один интерпретатор
+и один GIL: тяжёлая перерисовка или раскрытие списка устройств задерживают
+колбэк, и на выходе щелчки. В этом режиме поток и цепочка живут в
+дочернем процессе, который занят только вводом-выводом и обработкой, а с
+окном его связывают:
+  - блок общей памяти (float64): параметры обработки под счётчиком
+    версии, отметка жизни процесса и шесть чисел индикатора уровня
+    (dsp_engine.LevelMeter пишет прямо в общую память);
+  - кольцо кадров в общей памяти (recorder.FrameRing) для записи: колбэк
+    процесса кладёт в него блоки, поток записи окна забирает;
+  - канал команд (multiprocessing.Pipe): запуск и остановка потока,
+    подключение кольца записи, показания диагностики и события колбэка
+    обратно в окно.
+Колбэк процесса ничего не ждёт от окна: параметры из общей памяти читает
+цикл команд процесса и публикует снимком, как это делает окно.
+
+DspWorker на стороне окна следит за процессом: если тот умер или перестал
+обновлять отметку жизни, запускается новый процесс с теми же
+настройками, параметрами и кольцом записи (не больше max_restarts раз за
+restart_window секунд).
+
+Замер неравномерности вызовов под нагрузкой окна: python benchmark.py worker
+"""
+
+import multiprocessing
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from audio_backend import load_backend
+from dsp_engine import AmpParams, noise_gate
+from events import EVENT_ERROR, EVENT_RESTART, EventRing
+from instrumentation import CallbackStats
+from recorder import FrameRing
+from routing import ROUTE_CABLE, ROUTE_MONITOR, ROUTE_MUTED, build_graph
+
+# Блок общей памяти: счётчик версии параметров, усиление, роль выхода,
+# отметка жизни процесса (time.monotonic), уровни LevelMeter
+PARAMS_VERSION = 0
+PARAMS_GAIN = 1
+PARAMS_ROUTE = 2
+HEARTBEAT = 3
+LEVELS = 4
+STATE_SIZE = LEVELS + 6
+
+# Роль выхода в общей памяти - номер в этом списке, -1 - роль не задана
+ROUTES = (ROUTE_CABLE, ROUTE_MONITOR, ROUTE_MUTED)
+
+# Период цикла команд процесса: с ним обновляются параметры и отметка жизни
+POLL_INTERVAL = 0.02
+# Процесс считается зависшим, если отметка жизни старше стольких секунд
+HEARTBEAT_TIMEOUT = 5.0
+# Запас на запуск процесса (импорт numpy и PortAudio) до первой отметки
+STARTUP_GRACE = 15.0
+MAX_RESTARTS = 5
+RESTART_WINDOW = 60.0
+# Ожидание ответа процесса на запуск и остановку потока. Открытие
+# устройства (драйверы ASIO и WASAPI - иногда секунды) держит цикл команд,
+# и отметка жизни не обновляется: до ответа на запуск надзор ждёт столько же
+REPLY_TIMEOUT = 15.0
+
+
+class SharedFrameRing(FrameRing):
+    """recorder.FrameRing в общей памяти.
+
+    Окно создаёт кольцо (name=None) и владеет им, процесс обработки
+    подключается по имени из describe(). Отсчёты float32. Массивы кольца
+    смотрят прямо в отображение памяти, поэтому оно закрывается только
+    вместе с объектом кольца, когда на него больше никто не ссылается;
+    close() лишь удаляет имя.
+    """
+
+    def __init__(self, capacity, channels, dry_channels=0, name=None):
+        create = name is None
+        width = channels + dry_channels
+        self.memory = shared_memory.SharedMemory(name=name, create=create,
+                                                 size=32 + capacity * width * 4 if create else 0)
+        self.owner = create
+        self.name = self.memory.name
+        self.dry_channels = dry_channels
+        counters = np.ndarray(4, dtype=np.int64, buffer=self.memory.buf)
+        buffer = np.ndarray((capacity, width), dtype=np.float32, buffer=self.memory.buf, offset=32)
+        if create:
+            counters.fill(0)
+        super().__init__(buffer, channels, counters)
+
+    def describe(self):
+        """Всё, что нужно процессу обработки для подключения"""
+        return self.name, self.capacity, self.channels, self.dry_channels
+
+    def close(self):
+        if self.owner:
+            self.owner = False
+            try:
+                self.memory.unlink()
+            except FileNotFoundError:
+                pass
+
+
+class WorkerLoop:
+    """Сторона дочернего процесса: поток, цепочка и цикл команд"""
+
+    def __init__(self, conn, state_name):
+        self.conn = conn
+        self.state_memory = shared_memory.SharedMemory(name=state_name)
+        self.state = np.ndarray(STATE_SIZE, dtype=np.float64, buffer=self.state_memory.buf)
+        self.params = AmpParams(gain=1.0)
+        self.version = -1
+        self.build_engine(False, None, False)
+        self.events = EventRing()
+        self.stats = None
+        self.stream = None
+        self.ring = None
+
+    def build_engine(self, denoise, agc, rumble):
+        """Цепочка процесса: шумоподавление, автоусиление и срез гула - как выбрано в окне"""
+        self.graph = build_graph(np.float32, denoise=denoise, agc=agc, rumble=rumble)
+        self.engine = self.graph.engine
+        self.options = (denoise, agc, rumble)
+        # Уровни пишутся сразу в общую память, окно читает их таймером
+        self.engine.meter.values = self.state[LEVELS:STATE_SIZE]
+
+    def audio_callback(self, indata, outdata, frames, time, status):
+        self.graph.callback(indata, outdata, status, self.params, self.events, self.ring)
+
+    def run(self):
+        try:
+            while True:
+                self.state[HEARTBEAT] = time.monotonic()
+                self.read_params()
+                self.send_events()
+                if not self.conn.poll(POLL_INTERVAL):
+                    continue
+                message = self.conn.recv()
+                if message[0] == 'quit':
+                    break
+                self.handle(message)
+        except (EOFError, OSError):
+            # Окно закрылось, не остановив процесс
+            pass
+        finally:
+            self.close_stream()
+
+    def read_params(self):
+        """Опубликовать новый снимок, если окно поменяло параметры"""
+        state = self.state
+        version = state[PARAMS_VERSION]
+        # Нечётная версия - окно посреди записи
+        if version == self.version or version % 2:
+            return
+        gain = float(state[PARAMS_GAIN])
+        code = int(state[PARAMS_ROUTE])
+        if state[PARAMS_VERSION] != version:
+            return
+        self.version = version
+        self.params = AmpParams(gain=gain, route=ROUTES[code] if code >= 0 else None)
+
+    def send_events(self):
+        for code, value, error, count in self.events.drain():
+            # Исключение может не пережить pickle, в окно уходит его текст
+            self.conn.send(('event', code, value, None if error is None else str(error), count))
+
+    def handle(self, message):
+        command = message[0]
+        if command == 'start':
+            try:
+                self.open_stream(message[1])
+            except Exception as e:
+                self.close_stream()
+                reply = ('error', str(e))
+            else:
+                reply = ('started', None)
+            # Пока открывалось устройство, цикл не отмечался: отметка до ответа,
+            # после которого окно снова проверяет её
+            self.state[HEARTBEAT] = time.monotonic()
+            self.conn.send(reply)
+        elif command == 'stop':
+            self.close_stream()
+            self.conn.send(('stopped', None))
+        elif command == 'stats':
+            if self.stats is not None:
+                data = self.stats.snapshot(self.stream)
+                # Симулированный поток знает и опоздания вызовов
+                if hasattr(self.stream, 'report'):
+                    data['simulation'] = self.stream.report()
+                self.conn.send(('stats', data))
+        elif command == 'record':
+            self.attach_ring(message[1])
+
+    def open_stream(self, config):
+        from resampler import open_stream
+
+        self.close_stream()
+        sample_rate = config['sample_rate']
+        block_size = config['block_size']
+        input_channels, channels = config['channels']
+        options = (config.get('denoise', False), config.get('agc'), config.get('rumble', False))
+        if options != self.options:
+            self.build_engine(*options)
+        gate_db = config.get('gate_db')
+        self.engine.gate = noise_gate(gate_db) if gate_db is not None else None
+        self.engine.sample_rate = sample_rate
+        self.graph.prepare(block_size, channels)
+        self.stats = CallbackStats(sample_rate, self.engine.gate)
+        callback = self.stats.instrument(self.audio_callback)
+        backend = load_backend(config.get('backend'), **config.get('simulation', {}))
+        if backend is None:
+            raise RuntimeError("не найдена библиотека PortAudio (sounddevice)")
+        self.stream = open_stream(backend, config['device'], sample_rate, config['output_rate'],
+                                  callback=callback, channels=(input_channels, channels),
+                                  dtype=np.float32, blocksize=block_size,
+                                  latency=config['latency'])
+        self.stream.start()
+
+    def close_stream(self):
+        stream = self.stream
+        self.stream = None
+        if stream is not None:
+            stream.stop()
+            stream.close()
+
+    def attach_ring(self, description):
+        # Отображение старого кольца закроется, когда колбэк допишет в него блок
+        self.ring = None
+        if description is not None:
+            self.ring = SharedFrameRing(*description[1:], name=description[0])
+
+
+def worker_main(conn, state_name):
+    """Точка входа процесса обработки"""
+    WorkerLoop(conn, state_name).run()
+
+
+class DspWorker:
+    """Процесс обработки со стороны окна: запуск, команды и перезапуск при падении.
+
+    Для окна это поток: start(config), stop(), close(), cpu_load, а levels -
+    уровни индикатора прямо в общей памяти. config -
+    словарь с device, sample_rate, output_rate, channels, block_size,
+    latency, backend (имя для audio_backend.load_backend, 'simulated' -
+    устройства без звуковой карты), simulation (параметры SimulatedBackend),
+    denoise (шумоподавление в цепочке), rumble (срез гула в цепочке),
+    agc (громкость автоусиления в дБ или None) и gate_db (шумовой порог в
+    дБ или None).
+    poll() вызывается таймером окна: разбирает сообщения процесса, следит
+    за ним и возвращает события колбэка в формате EventRing.drain().
+    """
+
+    def __init__(self, max_restarts=MAX_RESTARTS, restart_window=RESTART_WINDOW,
+                 heartbeat_timeout=HEARTBEAT_TIMEOUT):
+        self.max_restarts = max_restarts
+        self.restart_window = restart_window
+        self.heartbeat_timeout = heartbeat_timeout
+        self.context = multiprocessing.get_context('spawn')
+        self.state_memory = shared_memory.SharedMemory(create=True, size=STATE_SIZE * 8)
+        self.state = np.ndarray(STATE_SIZE, dtype=np.float64, buffer=self.state_memory.buf)
+        self.state.fill(0)
+        self.state[PARAMS_ROUTE] = -1
+        self.levels = self.state[LEVELS:STATE_SIZE]
+        self.config = None
+        self.ring = None
+        self.process = None
+        self.conn = None
+        self.restarts = 0
+        self.restart_times = []
+        # До какого момента процесс открывает поток и отметку жизни не проверяем
+        self.opening_until = 0.0
+        self.last_stats = None
+        self._events = []
+
+    @property
+    def cpu_load(self):
+        return self.last_stats['cpu_load'] if self.last_stats else None
+
+    def set_params(self, params):
+        """Записать снимок параметров в общую память (только поток окна)"""
+        state = self.state
+        version = state[PARAMS_VERSION]
+        state[PARAMS_VERSION] = version + 1
+        state[PARAMS_GAIN] = params.gain
+        state[PARAMS_ROUTE] = ROUTES.index(params.route) if params.route in ROUTES else -1
+        state[PARAMS_VERSION] = version + 2
+
+    def set_ring(self, ring):
+        """Подключить к колбэку кольцо записи SharedFrameRing или отключить (None)"""
+        self.ring = ring
+        if self.process is not None:
+            self._send(('record', ring.describe() if ring is not None else None))
+
+    def start(self, config):
+        """Запустить процесс и поток в нём; ошибка открытия устройств - RuntimeError"""
+        self.config = config
+        if self.process is None or not self.process.is_alive():
+            self._spawn()
+        self._send_start()
+        try:
+            self._wait('started')
+        finally:
+            self.opening_until = 0.0
+
+    def stop(self):
+        config, self.config = self.config, None
+        if config is not None and self.process is not None and self.process.is_alive():
+            self._send(('stop',))
+            self._wait('stopped')
+
+    def close(self):
+        """Остановить процесс и удалить общую память.
+
+        Сама память отображена, пока жив этот объект: окно не должно хранить
+        levels дольше него.
+        """
+        self.stop()
+        self._terminate()
+        self.state_memory.unlink()
+
+    def request_stats(self):
+        if self.process is not None:
+            self._send(('stats',))
+
+    def snapshot(self, stream=None):
+        """Последние показания процесса (или None) и запрос следующих"""
+        self.request_stats()
+        if self.last_stats is None:
+            return None
+        pid = self.process.pid if self.process is not None else None
+        return dict(self.last_stats, worker_pid=pid, worker_restarts=self.restarts)
+
+    def poll(self):
+        self._receive()
+        if self.config is not None:
+            self._supervise()
+        events, self._events = self._events, []
+        return events
+
+    def _spawn(self):
+        parent_conn, child_conn = self.context.Pipe()
+        # Отметка жизни с запасом на импорт numpy и PortAudio в новом процессе
+        self.state[HEARTBEAT] = time.monotonic() + STARTUP_GRACE
+        self.process = self.context.Process(target=worker_main,
+                                            args=(child_conn, self.state_memory.name),
+                                            name='MicStrenght DSP', daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.conn = parent_conn
+        # Параметры уже лежат в общей памяти, кольцо записи нужно подключить заново
+        if self.ring is not None:
+            self._send(('record', self.ring.describe()))
+
+    def _terminate(self):
+        process = self.process
+        if process is None:
+            return
+        if process.is_alive():
+            self._send(('quit',))
+            process.join(2.0)
+        if process.is_alive():
+            process.kill()
+            process.join()
+        self.conn.close()
+        self.process = None
+        self.conn = None
+
+    def _send(self, message):
+        try:
+            self.conn.send(message)
+        except (OSError, EOFError):
+            # Процесс уже умер: его перезапустит _supervise
+            pass
+
+    def _send_start(self):
+        self.opening_until = time.monotonic() + REPLY_TIMEOUT
+        self._send(('start', self.config))
+
+    def _handle(self, message):
+        kind = message[0]
+        if kind in ('started', 'error'):
+            self.opening_until = 0.0
+        if kind == 'stats':
+            self.last_stats = message[1]
+        elif kind == 'event':
+            self._events.append(message[1:])
+        elif kind == 'error':
+            self._events.append((EVENT_ERROR, 0, message[1], 1))
+
+    def _receive(self):
+        try:
+            while self.conn is not None and self.conn.poll():
+                self._handle(self.conn.recv())
+        except (OSError, EOFError):
+            pass
+
+    def _wait(self, reply, timeout=REPLY_TIMEOUT):
+        """Ждать ответа процесса, по пути разбирая остальные сообщения"""
+        deadline = time.monotonic() + timeout
+        try:
+            while self.conn.poll(max(0.0, deadline - time.monotonic())):
+                message = self.conn.recv()
+                if message[0] == reply:
+                    return
+                if message[0] == 'error':
+                    raise RuntimeError(message[1])
+                self._handle(message)
+        except (OSError, EOFError):
+            raise RuntimeError("Процесс обработки завершился") from None
+        raise RuntimeError("Процесс обработки не отвечает")
+
+    def _supervise(self):
+        alive = self.process.is_alive()
+        now = time.monotonic()
+        if alive and (now < self.opening_until
+                      or now - self.state[HEARTBEAT] < self.heartbeat_timeout):
+            return
+        if alive:
+            # Завис: цикл команд не отмечается
+            self.process.kill()
+        self.process.join()
+        exitcode = self.process.exitcode
+        self.conn.close()
+        self.process = None
+        self.conn = None
+
+        now = time.monotonic()
+        self.restart_times = [moment for moment in self.restart_times
+                              if now - moment < self.restart_window]
+        if len(self.restart_times) >= self.max_restarts:
+            self.config = None
+            self._events.append((EVENT_ERROR, 0, "процесс обработки падает слишком часто, "
+                                                 "поток остановлен", 1))
+            return
+        self.restart_times.append(now)
+        self.restarts += 1
+        self._events.append((EVENT_RESTART, exitcode if exitcode is not None else 0, None, 1))
+        self._spawn()
+        # Ответ на запуск разберёт следующий poll()
+        self._send_start()
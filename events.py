@@ -0,0 +1,175 @@
+"""
+Канал событий из аудиопотока в интерфейс без блокировок.
+
+Колбэк PortAudio не должен печатать, трогать виджеты Qt или ждать другие
+потоки. Вместо этого он кладёт код события в кольцо фиксированного размера,
+а интерфейс (QTimer) или отдельный поток в консольной версии забирает
+события и показывает их, схлопывая одинаковые подряд.
+
+Кольцо рассчитано на одного писателя (колбэк) и одного читателя. Писатель
+двигает только _write, читатель - только _read, поэтому блокировки не нужны.
+Если читатель не успевает, новые события отбрасываются и считаются в dropped.
+"""
+
+import threading
+
+import numpy as np
+
+EVENT_STATUS = 1  # флаги PortAudio (недогрузка/переполнение буферов)
+EVENT_ERROR = 2  # исключение в обработке звука
+EVENT_RESTART = 3  # процесс обработки (dsp_worker) перезапущен, значение - код выхода
+
+# Биты флагов состояния потока
+INPUT_UNDERFLOW = 0x1
+INPUT_OVERFLOW = 0x2
+OUTPUT_UNDERFLOW = 0x4
+OUTPUT_OVERFLOW = 0x8
+PRIMING_OUTPUT = 0x10
+
+FLAG_NAMES = (
+    (INPUT_UNDERFLOW, 'input underflow'),
+    (INPUT_OVERFLOW, 'input overflow'),
+    (OUTPUT_UNDERFLOW, 'output underflow'),
+    (OUTPUT_OVERFLOW, 'output overflow'),
+    (PRIMING_OUTPUT, 'priming output'),
+)
+
+
+def status_flags(status):
+    """Битовая маска из sd.CallbackFlags без форматирования строк"""
+    flags = 0
+    if status.input_underflow:
+        flags |= INPUT_UNDERFLOW
+    if status.input_overflow:
+        flags |= INPUT_OVERFLOW
+    if status.output_underflow:
+        flags |= OUTPUT_UNDERFLOW
+    if status.output_overflow:
+        flags |= OUTPUT_OVERFLOW
+    if status.priming_output:
+        flags |= PRIMING_OUTPUT
+    return flags
+
+
+def describe_flags(flags):
+    return ', '.join(name for bit, name in FLAG_NAMES if flags & bit)
+
+
+class EventRing:
+    """Кольцо событий фиксированной ёмкости: колбэк пишет, интерфейс читает"""
+
+    def __init__(self, capacity=256):
+        self.capacity = capacity
+        self._codes = np.zeros(capacity, dtype=np.int32)
+        self._values = np.zeros(capacity, dtype=np.int64)
+        # Исключения уже созданы интерпретатором, в кольце хранится только ссылка
+        self._errors = [None] * capacity
+        self._write = 0
+        self._read = 0
+        # Счётчики по типам флагов: [input underflow, input overflow, output underflow, output overflow]
+        self.flag_counts = np.zeros(4, dtype=np.int64)
+        self.error_count = 0
+        self.dropped = 0
+
+    def _push(self, code, value, error=None):
+        write = self._write
+        if write - self._read >= self.capacity:
+            self.dropped += 1
+            return
+        slot = write % self.capacity
+        self._codes[slot] = code
+        self._values[slot] = value
+        self._errors[slot] = error
+        # Индекс сдвигаем последним: читатель видит только заполненный слот
+        self._write = write + 1
+
+    def push_status(self, status):
+        """Записать флаги PortAudio (вызывается из колбэка)"""
+        flags = status_flags(status) & ~PRIMING_OUTPUT
+        if not flags:
+            # Заполнение буферов при старте - не ошибка
+            return
+        if flags & INPUT_UNDERFLOW:
+            self.flag_counts[0] += 1
+        if flags & INPUT_OVERFLOW:
+            self.flag_counts[1] += 1
+        if flags & OUTPUT_UNDERFLOW:
+            self.flag_counts[2] += 1
+        if flags & OUTPUT_OVERFLOW:
+            self.flag_counts[3] += 1
+        self._push(EVENT_STATUS, flags)
+
+    def push_error(self, error):
+        """Записать исключение из обработки (вызывается из колбэка)"""
+        self.error_count += 1
+        self._push(EVENT_ERROR, 0, error)
+
+    def drain(self):
+        """Забрать накопленные события, схлопнув одинаковые подряд.
+
+        Возвращает список (код, значение, исключение, повторов). Вызывается
+        только из читающего потока.
+        """
+        events = []
+        read = self._read
+        write = self._write
+        while read < write:
+            slot = read % self.capacity
+            code = int(self._codes[slot])
+            value = int(self._values[slot])
+            error = self._errors[slot]
+            self._errors[slot] = None
+            read += 1
+            last = events[-1] if events else None
+            if last and last[0] == code and last[1] == value and (
+                    code != EVENT_ERROR or str(last[2]) == str(error)):
+                events[-1] = (code, value, last[2], last[3] + 1)
+            else:
+                events.append((code, value, error, 1))
+        self._read = read
+        return events
+
+
+def format_event(code, value, error, count):
+    """Текст события для статуса или консоли"""
+    if code == EVENT_STATUS:
+        text = f"Ошибка: {describe_flags(value)}"
+    elif code == EVENT_RESTART:
+        text = f"Процесс обработки перезапущен (код выхода {value})"
+    else:
+        text = f"Ошибка в обработке звука: {error}"
+    if count > 1:
+        text += f" (x{count})"
+    return text
+
+
+class EventPrinter:
+    """Поток консольной версии: периодически печатает события из кольца"""
+
+    def __init__(self, ring, interval=0.5):
+        self.ring = ring
+        self.interval = interval
+        self._dropped = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        self._thread.join()
+        self._print_events()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._print_events()
+
+    def _print_events(self):
+        for event in self.ring.drain():
+            print(format_event(*event))
+        if self.ring.dropped != self._dropped:
+            print(f"Пропущено событий: {self.ring.dropped - self._dropped}")
+            self._dropped = self.ring.dropped
@@ -0,0 +1,221 @@
+"""
+Диагностика колбэка потока: время обработки, флаги PortAudio, загрузка CPU.
+
+Обёртка вокруг колбэка записывает время каждого вызова в гистограмму с
+фиксированными корзинами (степени двойки в микросекундах), считает флаги
+недогрузки/переполнения по типам и запоминает отметки времени, которые
+PortAudio передаёт в колбэк. Запись - это пара счётчиков, без блокировок
+и выделения буферов. Загрузку CPU (stream.cpu_load) читает не колбэк,
+а тот, кто снимает показания: таймер окна или поток StatsDumper.
+
+Если у цепочки есть шумовой порог (dsp_engine.NoiseGate), блоки, которые
+прошли быстрым путём без расчёта цепочки, считаются отдельно, а в
+показания попадают состояние порога и уровень входа.
+"""
+
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+from events import (INPUT_OVERFLOW, INPUT_UNDERFLOW, OUTPUT_OVERFLOW, OUTPUT_UNDERFLOW,
+                    status_flags)
+
+# Корзина i: время вызова в [2**(i-1), 2**i) мкс; последняя - всё, что дольше
+HISTOGRAM_BUCKETS = 25
+
+FLAG_KEYS = (
+    (INPUT_UNDERFLOW, 'input_underflow'),
+    (INPUT_OVERFLOW, 'input_overflow'),
+    (OUTPUT_UNDERFLOW, 'output_underflow'),
+    (OUTPUT_OVERFLOW, 'output_overflow'),
+)
+
+
+class CallbackStats:
+    """Счётчики колбэка. Пишет только аудиопоток, читают снимками через snapshot()"""
+
+    def __init__(self, sample_rate=48000, gate=None):
+        self.sample_rate = sample_rate
+        self.gate = gate
+        self.histogram = np.zeros(HISTOGRAM_BUCKETS, dtype=np.int64)
+        self.flag_counts = np.zeros(len(FLAG_KEYS), dtype=np.int64)
+        self.callbacks = 0
+        self.frames = 0
+        self.max_us = 0
+        self.last_us = 0
+        # Отметки времени PortAudio: задержка вход->выход и неравномерность вызовов
+        self.io_latency = 0.0
+        self.max_interval_error = 0.0
+        self._last_current_time = None
+        # Блоки быстрого пути шумового порога
+        self.fast_callbacks = 0
+        self.fast_us = 0
+        self.fast_max_us = 0
+
+    def instrument(self, callback):
+        """Обернуть колбэк потока замером времени"""
+        perf_counter = time.perf_counter
+
+        def instrumented(indata, outdata, frames, time_info, status):
+            start = perf_counter()
+            callback(indata, outdata, frames, time_info, status)
+            self.record(perf_counter() - start, frames, time_info, status)
+
+        return instrumented
+
+    def record(self, elapsed, frames, time_info=None, status=None):
+        us = int(elapsed * 1e6)
+        self.histogram[min(us.bit_length(), HISTOGRAM_BUCKETS - 1)] += 1
+        self.callbacks += 1
+        self.frames += frames
+        self.last_us = us
+        if us > self.max_us:
+            self.max_us = us
+        gate = self.gate
+        if gate is not None and gate.bypassed:
+            self.fast_callbacks += 1
+            self.fast_us += us
+            if us > self.fast_max_us:
+                self.fast_max_us = us
+
+        if status:
+            flags = status_flags(status)
+            for index, (bit, _) in enumerate(FLAG_KEYS):
+                if flags & bit:
+                    self.flag_counts[index] += 1
+
+        if time_info is not None:
+            current = time_info.currentTime
+            if time_info.outputBufferDacTime and time_info.inputBufferAdcTime:
+                self.io_latency = time_info.outputBufferDacTime - time_info.inputBufferAdcTime
+            last = self._last_current_time
+            if last is not None and current:
+                error = abs(current - last - frames / self.sample_rate)
+                if error > self.max_interval_error:
+                    self.max_interval_error = error
+            self._last_current_time = current
+
+    def percentile_us(self, percent, histogram=None):
+        """Оценка перцентиля по гистограмме (верхняя граница корзины)"""
+        histogram = self.histogram.copy() if histogram is None else histogram
+        total = histogram.sum()
+        if not total:
+            return 0
+        bucket = int(np.searchsorted(np.cumsum(histogram), total * percent / 100.0))
+        return 1 << bucket
+
+    def snapshot(self, stream=None):
+        """Показания для окна диагностики и выгрузки (читается не из аудиопотока)"""
+        histogram = self.histogram.copy()
+        data = {
+            'time': time.time(),
+            'callbacks': self.callbacks,
+            'frames': self.frames,
+            'last_us': self.last_us,
+            'max_us': self.max_us,
+            'p50_us': self.percentile_us(50, histogram),
+            'p99_us': self.percentile_us(99, histogram),
+            'histogram': histogram.tolist(),
+            'io_latency_ms': self.io_latency * 1000,
+            'max_interval_error_ms': self.max_interval_error * 1000,
+            'cpu_load': None,
+        }
+        for index, (_, key) in enumerate(FLAG_KEYS):
+            data[key] = int(self.flag_counts[index])
+        gate = self.gate
+        if gate is not None:
+            data['gate_open'] = gate.open
+            data['gate_level_db'] = float(gate.level_db)
+            data['gate_transitions'] = gate.transitions
+            data['fast_callbacks'] = self.fast_callbacks
+            data['fast_total_us'] = self.fast_us
+            data['fast_mean_us'] = self.fast_us / self.fast_callbacks if self.fast_callbacks else 0
+            data['fast_max_us'] = self.fast_max_us
+        if stream is not None:
+            try:
+                data['cpu_load'] = stream.cpu_load
+            except Exception:
+                pass
+        return data
+
+
+def format_prometheus(snapshot, prefix='micstrenght'):
+    """Показания в текстовом формате Prometheus (для node_exporter textfile)"""
+    lines = [
+        f"# TYPE {prefix}_callback_seconds histogram",
+    ]
+    cumulative = 0
+    for bucket, count in enumerate(snapshot['histogram'][:-1]):
+        cumulative += count
+        lines.append(f'{prefix}_callback_seconds_bucket{{le="{(1 << bucket) / 1e6:g}"}} {cumulative}')
+    lines.append(f'{prefix}_callback_seconds_bucket{{le="+Inf"}} {snapshot["callbacks"]}')
+    lines.append(f"{prefix}_callback_seconds_count {snapshot['callbacks']}")
+    lines.append(f"# TYPE {prefix}_xruns_total counter")
+    for _, key in FLAG_KEYS:
+        lines.append(f'{prefix}_xruns_total{{type="{key}"}} {snapshot[key]}')
+    lines.append(f"# TYPE {prefix}_callback_max_seconds gauge")
+    lines.append(f"{prefix}_callback_max_seconds {snapshot['max_us'] / 1e6:g}")
+    lines.append(f"# TYPE {prefix}_io_latency_seconds gauge")
+    lines.append(f"{prefix}_io_latency_seconds {snapshot['io_latency_ms'] / 1000:g}")
+    if 'gate_open' in snapshot:
+        lines.append(f"# TYPE {prefix}_gate_open gauge")
+        lines.append(f"{prefix}_gate_open {int(snapshot['gate_open'])}")
+        lines.append(f"# TYPE {prefix}_gate_level_dbfs gauge")
+        lines.append(f"{prefix}_gate_level_dbfs {snapshot['gate_level_db']:g}")
+        lines.append(f"# TYPE {prefix}_fast_path_callbacks_total counter")
+        lines.append(f"{prefix}_fast_path_callbacks_total {snapshot['fast_callbacks']}")
+        lines.append(f"# TYPE {prefix}_fast_path_seconds_total counter")
+        lines.append(f"{prefix}_fast_path_seconds_total {snapshot['fast_total_us'] / 1e6:g}")
+    if snapshot['cpu_load'] is not None:
+        lines.append(f"# TYPE {prefix}_cpu_load gauge")
+        lines.append(f"{prefix}_cpu_load {snapshot['cpu_load']:g}")
+    return '\n'.join(lines) + '\n'
+
+
+class StatsDumper:
+    """Поток консольной версии: периодически выгружает показания в файл.
+
+    Формат 'jsonl' дописывает по строке JSON за период, 'prometheus'
+    атомарно перезаписывает текстовый файл для node_exporter.
+    """
+
+    def __init__(self, stats, path, interval=10.0, fmt='jsonl', stream_getter=None):
+        self.stats = stats
+        self.path = path
+        self.interval = interval
+        self.fmt = fmt
+        self.stream_getter = stream_getter
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        self._thread.join()
+        self.dump()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.dump()
+
+    def dump(self):
+        stream = self.stream_getter() if self.stream_getter else None
+        snapshot = self.stats.snapshot(stream)
+        try:
+            if self.fmt == 'prometheus':
+                temp_path = self.path + '.tmp'
+                with open(temp_path, 'w', encoding='utf-8') as f:
+                    f.write(format_prometheus(snapshot))
+                os.replace(temp_path, self.path)
+            else:
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(snapshot) + '\n')
+        except OSError as e:
+            print(f"Ошибка записи статистики: {e}")
@@ -0,0 +1,236 @@
+"""
+Подбор размера блока и задержки потока под пару устройств.
+
+Калибровка по очереди открывает поток с кандидатами по возрастанию
+ожидаемой задержки, несколько секунд гоняет через него настоящую цепочку
+обработки и считает недогрузки/переполнения. Берётся первый кандидат без
+сбоев и ещё запас в margin шагов по размеру блока, результат сохраняется
+на диск для пары устройств, и при следующем запуске калибровка не нужна.
+
+Поток открывается через переданную функцию open_stream, поэтому подбор
+проверяется без звуковой карты на SimulatedDevice.
+
+Пример:
+    python app.py --calibrate
+"""
+
+import json
+import os
+import time
+from collections import namedtuple
+
+from audio_backend import SimulatedBackend, default_devices
+from instrumentation import CallbackStats
+from resampler import DEFAULT_QUALITY, open_stream
+
+BLOCK_SIZES = (64, 128, 256, 512, 1024, 2048, 4096)
+LATENCIES = ('low', 'high')
+# Оценка 'low'/'high' в секундах, если устройство не сообщило свои значения
+DEFAULT_LATENCY_VALUES = {'low': 0.01, 'high': 0.1}
+
+DEFAULT_STORE_PATH = os.path.join(os.path.expanduser('~'), '.micstrenght', 'latency.json')
+
+
+class Candidate(namedtuple('Candidate', ['block_size', 'latency'])):
+    """Настройка потока: blocksize и latency для sd.Stream"""
+    __slots__ = ()
+
+
+class SoakResult(namedtuple('SoakResult', ['block_size', 'latency', 'callbacks', 'xruns',
+                                           'p99_us', 'max_us', 'error'])):
+    """Итог прогона одного кандидата"""
+    __slots__ = ()
+
+    @property
+    def clean(self):
+        return self.error is None and self.callbacks > 0 and self.xruns == 0
+
+
+def candidates(sample_rate, latency_values=None, block_sizes=BLOCK_SIZES, latencies=LATENCIES):
+    """Кандидаты по возрастанию ожидаемой задержки: блок плюс буфер устройства"""
+    latency_values = latency_values or DEFAULT_LATENCY_VALUES
+
+    def expected(candidate):
+        latency = latency_values.get(candidate.latency, candidate.latency)
+        return candidate.block_size / sample_rate + latency
+
+    options = [Candidate(block_size, latency) for block_size in block_sizes for latency in latencies]
+    return sorted(options, key=expected)
+
+
+class LatencyTuner:
+    """Подбор самой короткой настройки потока, которая работает без сбоев.
+
+    open_stream(block_size, latency, callback) открывает поток (ещё не
+    запущенный), make_callback(block_size) готовит цепочку под размер блока
+    и возвращает колбэк. sleep - ожидание прогона: time.sleep для настоящего
+    потока, SimulatedDevice.sleep для симуляции. latency_values - секунды
+    для 'low'/'high' у выбранных устройств, по ним упорядочиваются кандидаты.
+    """
+
+    def __init__(self, open_stream, make_callback, sample_rate, seconds=2.0, margin=1,
+                 sleep=time.sleep, progress=None, latency_values=None):
+        self.open_stream = open_stream
+        self.make_callback = make_callback
+        self.sample_rate = sample_rate
+        self.latency_values = latency_values
+        self.seconds = seconds
+        self.margin = margin
+        self.sleep = sleep
+        self.progress = progress
+
+    def soak(self, candidate):
+        """Прогнать поток с настройкой candidate и посчитать сбои"""
+        stats = CallbackStats(self.sample_rate)
+        try:
+            callback = stats.instrument(self.make_callback(candidate.block_size))
+            stream = self.open_stream(candidate.block_size, candidate.latency, callback)
+            with stream:
+                self.sleep(self.seconds)
+        except Exception as e:
+            return SoakResult(candidate.block_size, candidate.latency, stats.callbacks, 0,
+                              0, 0, str(e))
+        return SoakResult(candidate.block_size, candidate.latency, stats.callbacks,
+                          int(stats.flag_counts.sum()), stats.percentile_us(99), stats.max_us, None)
+
+    def tune(self, options=None):
+        """Вернуть (выбранный Candidate или None, список SoakResult)"""
+        if options is None:
+            options = candidates(self.sample_rate, self.latency_values)
+        results = []
+        for index, candidate in enumerate(options):
+            result = self.soak(candidate)
+            results.append(result)
+            if self.progress:
+                self.progress(result)
+            if result.clean:
+                return self.with_margin(options, index), results
+        return None, results
+
+    def with_margin(self, options, index):
+        """Кандидат на margin размеров блока длиннее найденного, с той же задержкой"""
+        found = options[index]
+        block_sizes = sorted({candidate.block_size for candidate in options})
+        position = min(block_sizes.index(found.block_size) + self.margin, len(block_sizes) - 1)
+        return Candidate(block_sizes[position], found.latency)
+
+
+def device_tuner(sd, device, channels, sample_rate, dtype, make_callback, seconds=2.0,
+                 progress=None, output_rate=None, quality=DEFAULT_QUALITY):
+    """LatencyTuner для настоящих устройств через sounddevice.
+
+    device - пара (вход, выход) как для sd.Stream или None для устройств по
+    умолчанию. Секунды для 'low'/'high' берутся из описаний устройств.
+    Если частота выхода output_rate другая, поток открывается как
+    resampler.ResampledStream с качеством quality.
+    """
+    input_device, output_device = device if device is not None else (None, None)
+    input_info = sd.query_devices(input_device, 'input')
+    output_info = sd.query_devices(output_device, 'output')
+    latency_values = {
+        'low': max(input_info['default_low_input_latency'], output_info['default_low_output_latency']),
+        'high': max(input_info['default_high_input_latency'], output_info['default_high_output_latency']),
+    }
+
+    def open_candidate(block_size, latency, callback):
+        return open_stream(
+            sd,
+            device,
+            sample_rate,
+            output_rate or sample_rate,
+            quality=quality,
+            channels=channels,
+            dtype=dtype,
+            blocksize=block_size,
+            callback=callback,
+            latency=latency,
+            prime_output_buffers_using_stream_callback=False
+        )
+
+    return LatencyTuner(open_candidate, make_callback, sample_rate, seconds, progress=progress,
+                        latency_values=latency_values)
+
+
+def format_soak(result):
+    """Строка прогона для консоли"""
+    latency = result.latency if isinstance(result.latency, str) else f"{result.latency:g} с"
+    text = f"Блок {result.block_size:>5}, задержка {latency:<6}: "
+    if result.error is not None:
+        return text + f"не открывается ({result.error})"
+    return text + (f"{result.callbacks} блоков, сбоев {result.xruns}, "
+                   f"p99 {result.p99_us} мкс, макс {result.max_us} мкс")
+
+
+class TuningStore:
+    """Результаты калибровки по парам устройств в JSON-файле"""
+
+    def __init__(self, path=DEFAULT_STORE_PATH):
+        self.path = path
+
+    @staticmethod
+    def key(input_name, output_name, sample_rate):
+        return f"{input_name} -> {output_name} @ {sample_rate}"
+
+    def load(self):
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def get(self, input_name, output_name, sample_rate):
+        """Сохранённый Candidate для пары устройств или None"""
+        entry = self.load().get(self.key(input_name, output_name, sample_rate))
+        if not entry:
+            return None
+        return Candidate(entry['block_size'], entry['latency'])
+
+    def put(self, input_name, output_name, sample_rate, candidate, results=()):
+        data = self.load()
+        data[self.key(input_name, output_name, sample_rate)] = {
+            'block_size': candidate.block_size,
+            'latency': candidate.latency,
+            'time': time.time(),
+            'soaks': [result._asdict() for result in results],
+        }
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            temp_path = self.path + '.tmp'
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            print(f"Ошибка записи калибровки: {e}")
+
+
+class SimulatedDevice:
+    """Пара устройств без звуковой карты для проверки подбора.
+
+    Обёртка над audio_backend.SimulatedBackend в ускоренном времени:
+    sleep(seconds) сразу вызывает колбэк столько раз, сколько блоков
+    пришлось бы на seconds. Каждый блок считается по-настоящему, к
+    измеренному времени добавляется случайная задержка пробуждения потока
+    (экспоненциальная со средним wakeup_ms и редкими выбросами до spike_ms).
+    Если сумма не укладывается в длину блока плюс запас буфера устройства
+    ('low'/'high' или число секунд), следующий блок получает флаг output
+    underflow, как от PortAudio; xrun_rate добавляет такие флаги просто
+    случайно.
+    """
+
+    def __init__(self, channels=2, sample_rate=48000, wakeup_ms=0.5, spike_ms=8.0,
+                 spike_rate=0.01, low_latency=0.005, high_latency=0.04, xrun_rate=0.0, seed=0):
+        self.channels = channels
+        self.sample_rate = sample_rate
+        self.latency_values = {'low': low_latency, 'high': high_latency}
+        self.backend = SimulatedBackend(default_devices(channels, sample_rate, low_latency,
+                                                        high_latency),
+                                        source='noise', wakeup_ms=wakeup_ms, spike_ms=spike_ms,
+                                        spike_rate=spike_rate, xrun_rate=xrun_rate, seed=seed)
+
+    def open_stream(self, block_size, latency, callback):
+        return self.backend.Stream(channels=self.channels, samplerate=self.sample_rate,
+                                   dtype='float32', blocksize=block_size, latency=latency,
+                                   callback=callback)
+
+    def sleep(self, seconds):
+        self.backend.run(seconds)
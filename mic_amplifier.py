@@ -1,63 +1,172 @@
-import sounddevice as sd
 import numpy as np
-from threading import Lock
+import argparse
+
+from audio_backend import BACKENDS, load_backend
+from control import DEFAULT_PORT, DEFAULT_SOCKET_PATH, ControlServer
+from dsp_engine import AmpParams, HardClipEngine
+from events import EventPrinter, EventRing
+from instrumentation import CallbackStats, StatsDumper
+from latency_tuner import TuningStore, device_tuner, format_soak
 
 class MicrophoneAmplifier:
-    def __init__(self):
+    def __init__(self, stats_path=None, stats_format='jsonl', stats_interval=10.0,
+                 calibrate=False, backend=None, rumble=False):
+        # Устройства: модуль sounddevice или audio_backend.SimulatedBackend
+        self.backend = backend if backend is not None else load_backend()
         # Параметры аудио
         self.sample_rate = 44100  # Частота дискретизации
         self.channels = 1  # Моно
         self.dtype = np.float32  # Тип данных для аудио
         self.block_size = 1024  # Размер блока для обработки
-        self.gain = 5.0  # Начальное значение усиления
-        self.gain_lock = Lock()  # Для потокобезопасного изменения усиления
+        self.latency = None  # Задержка потока (None - по умолчанию PortAudio)
+        self.calibrate = calibrate  # Подобрать блок и задержку перед запуском
+        self.tuning = TuningStore()  # Результаты калибровки по парам устройств
+        self.params = AmpParams(gain=5.0)  # Снимок параметров, меняется заменой ссылки
+        # Усиление и ограничение (rumble - срез гула 80 Гц до усиления)
+        self.engine = HardClipEngine(self.dtype, sample_rate=self.sample_rate, rumble=rumble)
+        self.events = EventRing()  # События колбэка, печатаются отдельным потоком
+        self.stats_path = stats_path  # Файл диагностики колбэка (необязательно)
+        self.stats_format = stats_format
+        self.stats_interval = stats_interval
+        self.stats = None
+        self.stream = None
+        self.collect_stats = False  # Замер колбэка и без файла (soak.py, --daemon)
         
     def audio_callback(self, indata, outdata, frames, time, status):
         if status:
-            print(status)
+            self.events.push_status(status)
         
-        with self.gain_lock:
-            # Применяем усиление
-            outdata[:] = indata * self.gain
+        # Снимок параметров читаем один раз за блок
+        params = self.params
         
-        # Ограничиваем значения для предотвращения искажений
-        np.clip(outdata, -1, 1, out=outdata)
+        # Применяем усиление и ограничиваем значения
+        self.engine.process(indata, outdata, params.gain)
     
-    def run(self):
+    def apply_tuning(self):
+        """Размер блока и задержка для устройств по умолчанию: калибровка или сохранённые"""
+        names = (self.backend.query_devices(kind='input')['name'],
+                 self.backend.query_devices(kind='output')['name'], self.sample_rate)
+        if self.calibrate:
+            print("Калибровка: подбираем самый короткий буфер без сбоев...")
+            tuner = device_tuner(self.backend, None, self.channels, self.sample_rate, self.dtype,
+                                 self.prepare_callback,
+                                 progress=lambda result: print(format_soak(result)))
+            candidate, results = tuner.tune()
+            self.events.drain()
+            if candidate is None:
+                print("Калибровка: ни одна настройка не прошла без сбоев, оставляем стандартную")
+                return
+            self.tuning.put(*names, candidate, results)
+        else:
+            candidate = self.tuning.get(*names)
+            if candidate is None:
+                return
+        self.block_size, self.latency = candidate
+        print(f"Буфер: {self.block_size} кадров, задержка {self.latency}")
+
+    def prepare_callback(self, block_size):
+        """Цепочка под размер блока для прогона калибровки"""
+        self.engine.prepare(block_size, self.channels)
+        return self.audio_callback
+
+    def open_stream(self):
+        """Подготовить цепочку и открыть поток (не запуская его)"""
+        self.apply_tuning()
+        
+        # Буферы обработки выделяем до запуска потока
+        self.engine.prepare(self.block_size, self.channels)
+        
+        # Колбэк с замером времени, если нужна статистика
+        callback = self.audio_callback
+        if self.stats_path or self.collect_stats:
+            self.stats = CallbackStats(self.sample_rate)
+            callback = self.stats.instrument(callback)
+        
+        # Создаем поток аудио
+        return self.backend.Stream(
+            channels=self.channels,
+            samplerate=self.sample_rate,
+            dtype=self.dtype,
+            blocksize=self.block_size,
+            callback=callback,
+            latency=self.latency
+        )
+
+    def set_gain(self, new_gain):
+        """Опубликовать новое усиление (из консоли или сокета управления)"""
+        if not new_gain > 0:
+            raise ValueError("коэффициент должен быть больше 0")
+        self.params = self.params._replace(gain=new_gain)
+
+    def control_server(self, socket_path=DEFAULT_SOCKET_PATH, port=DEFAULT_PORT):
+        """Сервер команд для --daemon: усиление, диагностика и остановка.
+
+        Устройства здесь всегда по умолчанию, поэтому switch_devices нет:
+        переключение на ходу - в app.py --daemon.
+        """
+        self.collect_stats = True
+        return ControlServer({
+            'get_gain': lambda message: {'gain': self.params.gain},
+            'set_gain': self.handle_set_gain,
+            'stats': self.handle_stats,
+        }, socket_path, port)
+
+    def handle_set_gain(self, message):
+        try:
+            new_gain = float(message['gain'])
+        except (KeyError, TypeError, ValueError):
+            raise ValueError("нужно числовое поле gain")
+        self.set_gain(new_gain)
+        return {'gain': self.params.gain}
+
+    def handle_stats(self, message):
+        stream = self.stream
+        return {'stats': dict(
+            gain=self.params.gain,
+            sample_rate=self.sample_rate,
+            block_size=self.block_size,
+            active=bool(stream is not None and stream.active),
+            callback=self.stats.snapshot(stream) if self.stats else None,
+        )}
+
+    def run(self, server=None):
+        """Поток на устройствах по умолчанию; управление из консоли или через server"""
         try:
-            # Создаем поток аудио
-            stream = sd.Stream(
-                channels=self.channels,
-                samplerate=self.sample_rate,
-                dtype=self.dtype,
-                blocksize=self.block_size,
-                callback=self.audio_callback
-            )
+            if server is not None:
+                # Второй экземпляр не должен открывать устройства и отбирать сокет у первого
+                server.claim()
+            stream = self.open_stream()
             
             print("\n=== Усилитель микрофона ===")
-            print("Микрофон активирован! Управление:")
-            print("- Введите число больше 1 для изменения усиления")
-            print("- Введите 'q' для выхода")
-            print(f"Текущее усиление: {self.gain}x\n")
+            if server is None:
+                print("Микрофон активирован! Управление:")
+                print("- Введите число больше 1 для изменения усиления")
+                print("- Введите 'q' для выхода")
+            else:
+                print(f"Управление: {server.address} (python control.py --help)")
+            print(f"Текущее усиление: {self.params.gain}x\n")
             
-            # Запускаем поток
-            with stream:
-                while True:
-                    user_input = input("Введите коэффициент усиления > ")
-                    
-                    if user_input.lower() == 'q':
-                        break
-                        
-                    try:
-                        new_gain = float(user_input)
-                        if new_gain > 0:
-                            with self.gain_lock:
-                                self.gain = new_gain
-                            print(f"Усиление установлено на: {self.gain}x")
-                        else:
-                            print("Ошибка: коэффициент должен быть больше 0")
-                    except ValueError:
-                        print("Ошибка: введите число или 'q' для выхода")
+            # Запускаем поток и печать событий из колбэка
+            printer = EventPrinter(self.events)
+            printer.start()
+            dumper = None
+            if self.stats:
+                dumper = StatsDumper(self.stats, self.stats_path, self.stats_interval,
+                                     self.stats_format, lambda: stream)
+                dumper.start()
+            try:
+                with stream:
+                    self.stream = stream
+                    if server is None:
+                        self.console_loop()
+                    else:
+                        # Цикл сокета в главном потоке, колбэк видит только новый снимок
+                        server.run()
+            finally:
+                self.stream = None
+                printer.stop()
+                if dumper:
+                    dumper.stop()
 
         except KeyboardInterrupt:
             print("\nПрограмма остановлена")
@@ -66,6 +175,51 @@ class MicrophoneAmplifier:
         finally:
             print("\nУсилитель микрофона выключен")
 
+    def console_loop(self):
+        while True:
+            user_input = input("Введите коэффициент усиления > ")
+            
+            if user_input.lower() == 'q':
+                break
+                
+            try:
+                new_gain = float(user_input)
+            except ValueError:
+                print("Ошибка: введите число или 'q' для выхода")
+                continue
+            try:
+                self.set_gain(new_gain)
+                print(f"Усиление установлено на: {self.params.gain}x")
+            except ValueError as e:
+                print(f"Ошибка: {e}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Усилитель микрофона (простой режим)")
+    parser.add_argument('--stats', metavar='PATH', help="записывать диагностику колбэка в файл")
+    parser.add_argument('--stats-format', choices=['jsonl', 'prometheus'], default='jsonl',
+                        help="формат файла диагностики")
+    parser.add_argument('--stats-interval', type=float, default=10.0,
+                        help="период записи диагностики, с")
+    parser.add_argument('--calibrate', action='store_true',
+                        help="подобрать размер буфера и задержку для устройств по умолчанию")
+    parser.add_argument('--backend', choices=BACKENDS,
+                        help="звуковые устройства: portaudio или simulated (без звуковой карты)")
+    parser.add_argument('--rumble-filter', action='store_true',
+                        help="срезать гул и постоянную составляющую (80 Гц) до усиления")
+    parser.add_argument('--daemon', action='store_true',
+                        help="работать службой: без консоли, управление через сокет (control.py)")
+    parser.add_argument('--socket', default=DEFAULT_SOCKET_PATH,
+                        help="путь к сокету управления для --daemon")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT,
+                        help="порт на 127.0.0.1 для --daemon, где нет Unix-сокетов")
+    args = parser.parse_args()
+    
+    backend = load_backend(args.backend)
+    if backend is None:
+        raise SystemExit("Ошибка: не найдена библиотека PortAudio (sounddevice)")
+    amplifier = MicrophoneAmplifier(args.stats, args.stats_format, args.stats_interval,
+                                    args.calibrate, backend, args.rumble_filter)
+    amplifier.run(amplifier.control_server(args.socket, args.port) if args.daemon else None)
+
 if __name__ == "__main__":
-    amplifier = MicrophoneAmplifier()
-    amplifier.run()
\ No newline at end of file
+    main()
\ No newline at end of file
@@ -33,17 +33,51 @@ MicStrenght - Усилитель микрофона с эффектами
 Версия: 1.0
 """
 
+from startup_timing import StartupProbe
+
+import math
+import multiprocessing
 import sys
+import threading
+import time
 from PySide6.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, 
                            QHBoxLayout, QComboBox, QLabel, QSlider, QPushButton,
-                           QStyleFactory, QFrame, QLineEdit)
-from PySide6.QtCore import Qt, QSize
-from PySide6.QtGui import QPalette, QColor, QFont, QIcon
-import sounddevice as sd
-import numpy as np
-from threading import Lock
+                           QStyleFactory, QFrame, QLineEdit, QCheckBox)
+from PySide6.QtCore import Qt, QSize, QTimer
+from PySide6.QtGui import QPalette, QColor, QFont, QIcon, QPainter
 import os
 
+from device_cache import DeviceCache
+from routing import ROUTE_CABLE, ROUTE_MONITOR, build_graph, resolve_route
+
+startup = StartupProbe()
+startup.mark('qt_import')
+
+# numpy, PortAudio и цепочка обработки загружаются в фоновом потоке уже после
+# первой отрисовки окна (load_backend), до этого здесь None
+np = None
+sd = None
+
+GAIN_HINT = "Введите значение усиления, 1 - Идеально, 10  - очень громко, 100 - просто шум"
+AGC_GAIN_HINT = "Предел автоусиления: громкость подстраивается, но усиление не больше этого"
+
+
+def import_backend(backend=None):
+    """Импорт тяжёлых модулей; выполняется в фоновом потоке.
+
+    backend - готовые устройства (audio_backend.SimulatedBackend), иначе
+    sounddevice или симуляция по MICSTRENGHT_BACKEND.
+    """
+    global np, sd
+    import numpy
+    from audio_backend import load_backend
+    if backend is None:
+        # Импорт sounddevice инициализирует PortAudio; без него - None
+        backend = load_backend()
+    # Модули цепочки тоже тянут numpy, в потоке интерфейса их импорт уже ничего не стоит
+    import dsp_engine, events, instrumentation, latency_tuner, resampler
+    np, sd = numpy, backend
+
 class CustomFrame(QFrame):
     def __init__(self, title, parent=None):
         super().__init__(parent)
@@ -59,8 +93,92 @@ class CustomFrame(QFrame):
         self.content_layout.setContentsMargins(5, 5, 5, 5)
         layout.addLayout(self.content_layout)
 
+class LevelMeterWidget(QWidget):
+    """Индикатор уровня входа и выхода: RMS полосой, пик чертой, лампа перегрузки.
+
+    Значения приходят из dsp_engine.LevelMeter таймером окна (set_levels);
+    аудиопоток сам окно не трогает. Перерисовывается только этот виджет и
+    только если полосы сдвинулись хотя бы на пиксель.
+    """
+    
+    ROWS = ("Вход", "Выход")
+    FLOOR_DB = -60.0
+    LABEL_WIDTH = 50
+    LAMP_WIDTH = 14
+    # Сколько секунд горит лампа после перегрузки
+    CLIP_HOLD = 1.5
+    
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setMinimumHeight(44)
+        self.levels = [(self.FLOOR_DB, self.FLOOR_DB)] * len(self.ROWS)
+        self.clips = [0] * len(self.ROWS)
+        self.clip_times = [0.0] * len(self.ROWS)
+        self.shown = None
+    
+    def to_db(self, value):
+        return max(self.FLOOR_DB, 10 * math.log10(value)) if value > 0 else self.FLOOR_DB
+    
+    def set_levels(self, values):
+        """values - массив LevelMeter.values: (пик, средний квадрат, перегрузок) на сторону"""
+        values = values.tolist()
+        now = time.monotonic()
+        for row, side in enumerate((0, 3)):
+            peak, power, clips = values[side:side + 3]
+            # Пик амплитудный, средний квадрат - мощность
+            self.levels[row] = (self.to_db(power), self.to_db(peak * peak))
+            if clips != self.clips[row]:
+                self.clips[row] = clips
+                self.clip_times[row] = now
+        lamps = tuple(now - moment < self.CLIP_HOLD for moment in self.clip_times)
+        shown = (tuple(self.x_for(rms) for rms, _ in self.levels),
+                 tuple(self.x_for(peak) for _, peak in self.levels), lamps)
+        if shown != self.shown:
+            self.shown = shown
+            self.update()
+    
+    def reset(self):
+        self.levels = [(self.FLOOR_DB, self.FLOOR_DB)] * len(self.ROWS)
+        self.clip_times = [0.0] * len(self.ROWS)
+        self.shown = None
+        self.update()
+    
+    def bar_width(self):
+        return max(1, self.width() - self.LABEL_WIDTH - self.LAMP_WIDTH - 6)
+    
+    def x_for(self, db):
+        return int(self.bar_width() * (db - self.FLOOR_DB) / -self.FLOOR_DB)
+    
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        row_height = self.height() // len(self.ROWS)
+        bar_width = self.bar_width()
+        now = time.monotonic()
+        for row, name in enumerate(self.ROWS):
+            top = row * row_height + 2
+            height = row_height - 4
+            rms, peak = self.levels[row]
+            painter.setPen(QColor(200, 200, 200))
+            painter.drawText(0, top, self.LABEL_WIDTH, height, Qt.AlignVCenter, name)
+            left = self.LABEL_WIDTH
+            painter.fillRect(left, top, bar_width, height, QColor(26, 26, 26))
+            # Зелёный до -12 дБ, жёлтый до -3 дБ, дальше красный
+            filled = self.x_for(rms)
+            for start_db, end_db, color in ((self.FLOOR_DB, -12, QColor(60, 180, 90)),
+                                            (-12, -3, QColor(220, 190, 60)),
+                                            (-3, 0, QColor(220, 60, 60))):
+                start = self.x_for(start_db)
+                end = min(filled, self.x_for(end_db))
+                if end > start:
+                    painter.fillRect(left + start, top, end - start, height, color)
+            painter.fillRect(left + min(self.x_for(peak), bar_width - 2), top, 2, height,
+                             QColor(240, 240, 240))
+            lamp = QColor(230, 40, 40) if now - self.clip_times[row] < self.CLIP_HOLD else QColor(60, 20, 20)
+            painter.fillRect(left + bar_width + 6, top, self.LAMP_WIDTH, height, lamp)
+        painter.end()
+
 class MicAmplifierGUI(QMainWindow):
-    def __init__(self):
+    def __init__(self, backend=None):
         super().__init__()
         self.setWindowTitle("Усилитель микрофона")
         self.setMinimumSize(400, 300)
@@ -72,15 +190,48 @@ class MicAmplifierGUI(QMainWindow):
         else:
             print(f"Иконка не найдена по пути: {icon_path}")
         
-        # Инициализация аудио параметров
+        # Инициализация аудио параметров; при запуске частоты берутся родные
+        # для устройств, цепочка считает на частоте входа
         self.sample_rate = 48000
+        self.output_rate = 48000
+        self.input_channels = 2  # моно-микрофон открывается одним каналом
         self.channels = 2
-        self.dtype = np.float32
+        self.dtype = None  # np.float32 после загрузки numpy
         self.block_size = 4096
-        self.gain = 1.0
-        self.gain_lock = Lock()
-        self.buffer = np.zeros((self.block_size, self.channels), dtype=self.dtype)
+        self.latency = 0.2
+        # Блок и задержка из калибровки (python app.py --calibrate) по парам устройств
+        self.default_tuning = (self.block_size, self.latency)
+        self.tuning = None
+        # Устройства для фоновой загрузки: None - PortAudio или MICSTRENGHT_BACKEND
+        self.backend = backend
+        # Список устройств из кэша на диске, PortAudio опрашивается в фоне
+        self.device_cache = DeviceCache()
+        self.shown_generation = None
+        # Загрузка numpy и PortAudio после первой отрисовки (load_backend)
+        self.loader = None
+        self.painted = False
+        # Параметры обработки публикуются снимком, без блокировок;
+        # снимок, цепочка и кольцо событий появляются в init_backend
+        self.params = None
+        self.engine = None
+        self.graph = None
+        self.denoise = False
+        self.agc = None  # громкость автоусиления, дБ; None - усиление как введено
+        self.rumble = False  # срез гула 80 Гц до усиления
+        self.gate_db = None  # шумовой порог, дБ; None - без порога
+        # События из колбэка: виджеты трогает только таймер в потоке интерфейса
+        self.events = None
+        self.shown_dropped = 0
+        self.gain_pending = False  # усиление ввели до загрузки цепочки
+        # Диагностика колбэка, создаётся при каждом запуске потока
+        self.stats = None
         self.stream = None
+        # Запись выхода в файлы: колбэк копирует блоки в кольцо, пишет поток записи
+        self.recorder = None
+        self.record_ring = None  # кольцо в общей памяти, если пишет процесс обработки
+        self.record_rotate_seconds = 3600  # новый файл каждый час
+        # Поток и цепочка в отдельном процессе (dsp_worker), тогда это и есть self.stream
+        self.worker = None
         
         # Настройка темной темы
         self.setup_dark_theme()
@@ -107,14 +258,53 @@ class MicAmplifierGUI(QMainWindow):
         self.output_combo.setPlaceholderText("Выберите выход")
         devices_layout.addWidget(self.output_combo)
         
+        # Прослушивание обработки на обычном (не виртуальном) выходе
+        self.monitor_check = QCheckBox("Слышать обработку на этом выходе (возможно эхо)")
+        devices_layout.addWidget(self.monitor_check)
+        
+        # Колбэк в своём процессе не ждёт GIL, пока окно перерисовывается
+        self.worker_check = QCheckBox("Обрабатывать звук в отдельном процессе (меньше щелчков)")
+        devices_layout.addWidget(self.worker_check)
+        
+        # Шумовой порог по желанию: очень тихий микрофон он заглушил бы целиком
+        gate_layout = QHBoxLayout()
+        self.gate_check = QCheckBox("Шумовой порог: тише этого уровня выход молчит, дБ")
+        gate_layout.addWidget(self.gate_check)
+        self.gate_input = QLineEdit()
+        self.gate_input.setAlignment(Qt.AlignCenter)
+        self.gate_input.setText("-55")
+        self.gate_input.setMaximumWidth(60)
+        gate_layout.addWidget(self.gate_input)
+        devices_layout.addLayout(gate_layout)
+        
+        # Шумоподавление учится на шуме, пока порог закрыт, поэтому включает и порог;
+        # добавляет задержку в кадр STFT
+        self.denoise_check = QCheckBox("Подавлять шум микрофона (включает порог, задержка около 10 мс)")
+        devices_layout.addWidget(self.denoise_check)
+        
+        # Срез гула и постоянной составляющей до усиления, иначе они идут прямо в искажение
+        self.rumble_check = QCheckBox("Срезать гул ниже 80 Гц")
+        devices_layout.addWidget(self.rumble_check)
+        
+        # Автоусиление держит громкость сама, поле усиления тогда задаёт её предел
+        agc_layout = QHBoxLayout()
+        self.agc_check = QCheckBox("Автоусиление: держать громкость около, дБ")
+        agc_layout.addWidget(self.agc_check)
+        self.agc_input = QLineEdit()
+        self.agc_input.setAlignment(Qt.AlignCenter)
+        self.agc_input.setText("-20")
+        self.agc_input.setMaximumWidth(60)
+        agc_layout.addWidget(self.agc_input)
+        devices_layout.addLayout(agc_layout)
+        
         layout.addLayout(devices_layout)
         
         # Поле ввода усиления
         gain_layout = QVBoxLayout()
         
-        gain_label = QLabel("Введите значение усиления, 1 - Идеально, 10  - очень громко, 100 - просто шум")
-        gain_label.setAlignment(Qt.AlignCenter)
-        gain_layout.addWidget(gain_label)
+        self.gain_label = QLabel(GAIN_HINT)
+        self.gain_label.setAlignment(Qt.AlignCenter)
+        gain_layout.addWidget(self.gain_label)
         
         self.gain_input = QLineEdit()
         self.gain_input.setAlignment(Qt.AlignCenter)
@@ -141,6 +331,7 @@ class MicAmplifierGUI(QMainWindow):
         buttons_layout = QHBoxLayout()
         
         self.start_button = QPushButton("СТАРТ")
+        self.start_button.setEnabled(False)  # до загрузки PortAudio
         self.stop_button = QPushButton("СТОП")
         self.stop_button.setEnabled(False)
         
@@ -154,13 +345,62 @@ class MicAmplifierGUI(QMainWindow):
         self.status_label.setAlignment(Qt.AlignCenter)
         layout.addWidget(self.status_label)
         
+        # Уровни входа и выхода (до усиления и после обработки)
+        self.meter_widget = LevelMeterWidget()
+        layout.addWidget(self.meter_widget)
+        
+        # Запись в архив, можно включать и выключать во время работы
+        self.record_check = QCheckBox("Записывать звук в файлы (папка MicStrenght/recordings)")
+        layout.addWidget(self.record_check)
+        self.record_dry_check = QCheckBox("Записывать и исходный звук микрофона")
+        layout.addWidget(self.record_dry_check)
+        
+        # Панель диагностики (скрыта, пока не нужна)
+        self.diagnostics_check = QCheckBox("Показать диагностику")
+        layout.addWidget(self.diagnostics_check)
+        
+        self.diagnostics_frame = CustomFrame("Диагностика")
+        self.diagnostics_label = QLabel("Поток не запущен")
+        self.diagnostics_frame.content_layout.addWidget(self.diagnostics_label)
+        self.diagnostics_frame.setVisible(False)
+        layout.addWidget(self.diagnostics_frame)
+        
         # Подключение сигналов
+        self.diagnostics_check.toggled.connect(self.diagnostics_frame.setVisible)
         self.gain_input.textChanged.connect(self.update_gain)
+        self.monitor_check.toggled.connect(self.update_route)
+        self.agc_check.toggled.connect(self.update_gain_hint)
+        self.denoise_check.toggled.connect(self.update_gate_options)
+        self.gate_check.toggled.connect(self.update_gate_options)
+        self.record_check.toggled.connect(self.update_recording)
         self.start_button.clicked.connect(self.start_stream)
         self.stop_button.clicked.connect(self.stop_stream)
         
-        # Заполнение списков устройств
+        # Разбор событий аудиопотока
+        self.events_timer = QTimer(self)
+        self.events_timer.setInterval(100)
+        self.events_timer.timeout.connect(self.show_events)
+        self.events_timer.start()
+        
+        # Индикатор уровня: ~30 раз в секунду, только пока идёт поток
+        self.meter_timer = QTimer(self)
+        self.meter_timer.setInterval(33)
+        self.meter_timer.timeout.connect(self.update_meters)
+        
+        # Обновление панели диагностики
+        self.diagnostics_timer = QTimer(self)
+        self.diagnostics_timer.setInterval(1000)
+        self.diagnostics_timer.timeout.connect(self.update_diagnostics)
+        self.diagnostics_timer.start()
+        
+        # Списки устройств обновляются, когда фоновый опрос PortAudio закончит
+        self.devices_timer = QTimer(self)
+        self.devices_timer.setInterval(100)
+        self.devices_timer.timeout.connect(self.check_devices)
+        
+        # Заполнение списков устройств из кэша, без PortAudio
         self.refresh_devices()
+        startup.mark('window')
         
     def setup_dark_theme(self):
         self.setStyle(QStyleFactory.create("Fusion"))
@@ -243,29 +483,149 @@ class MicAmplifierGUI(QMainWindow):
             }
         """)
     
+    def paintEvent(self, event):
+        super().paintEvent(event)
+        if not self.painted:
+            self.painted = True
+            startup.mark('first_paint')
+            # Загрузку запускаем после выхода из отрисовки, чтобы окно успело показаться
+            QTimer.singleShot(0, self.load_backend)
+    
+    def load_backend(self):
+        """Импорт numpy и PortAudio и перечисление устройств в фоновом потоке"""
+        if self.loader is not None:
+            return
+        self.loader = threading.Thread(target=self._load_backend, daemon=True)
+        self.loader.start()
+        self.devices_timer.start()
+    
+    def _load_backend(self):
+        import_backend(self.backend)
+        startup.mark('backend_import')
+        if sd is not None:
+            try:
+                self.device_cache.refresh(sd)
+                # Кнопка СТАРТ ещё не доступна: пробные потоки не мешают настоящему
+                self.device_cache.revalidate(sd)
+            except Exception as e:
+                print(f"Ошибка опроса устройств: {e}")
+        startup.mark('devices')
+    
+    def init_backend(self):
+        """Цепочка обработки после фоновой загрузки, в потоке интерфейса"""
+        from dsp_engine import AmpParams
+        from events import EventRing
+        from latency_tuner import Candidate, TuningStore
+        
+        self.dtype = np.float32
+        self.default_tuning = Candidate(*self.default_tuning)
+        self.tuning = TuningStore()
+        self.params = AmpParams(gain=1.0)
+        self.build_engine(False, None, False)
+        self.events = EventRing()
+        # Усиление могли ввести, пока шла загрузка
+        if self.gain_pending:
+            self.update_gain()
+        
+        if sd is None:
+            self.status_label.setText("Ошибка: не найдена библиотека PortAudio")
+        else:
+            self.start_button.setEnabled(True)
+            if self.status_label.text() == "Поиск устройств...":
+                self.status_label.setText("Готов к работе")
+        startup.mark('ready')
+        startup.dump()
+    
+    def build_engine(self, denoise, agc, rumble):
+        """Цепочка окна (та же, что в dsp_worker); порог, если включён, ставит start_stream"""
+        self.graph = build_graph(self.dtype, self.sample_rate, denoise, agc, rumble)
+        self.engine = self.graph.engine
+        self.denoise = denoise
+        self.agc = agc
+        self.rumble = rumble
+    
     def refresh_devices(self):
-        # Получение списка устройств
-        devices = sd.query_devices()
+        # Сразу показываем список из кэша, перечисление устройств идёт в фоне
+        self.fill_devices(self.device_cache.devices)
+        self.shown_generation = self.device_cache.generation
+        if not self.device_cache.devices:
+            self.status_label.setText("Поиск устройств...")
+    
+    def check_devices(self):
+        if self.device_cache.generation != self.shown_generation:
+            self.shown_generation = self.device_cache.generation
+            self.fill_devices(self.device_cache.devices)
+        if not self.loader.is_alive():
+            self.devices_timer.stop()
+            self.init_backend()
+    
+    def fill_devices(self, devices):
+        # Выбор пользователя сохраняем по имени: номера устройств могли измениться
+        input_name = self.input_combo.currentText()
+        output_name = self.output_combo.currentText()
         
         self.input_combo.clear()
         self.output_combo.clear()
         
         # Заполнение списков устройств
-        for i, device in enumerate(devices):
-            if device['max_input_channels'] > 0:
-                self.input_combo.addItem(f"{device['name']}", i)
-            if device['max_output_channels'] > 0:
-                self.output_combo.addItem(f"{device['name']}", i)
+        for device in devices:
+            if device.max_input_channels > 0:
+                self.input_combo.addItem(device.name, device.index)
+            if device.max_output_channels > 0:
+                self.output_combo.addItem(device.name, device.index)
+        
+        if input_name:
+            self.input_combo.setCurrentText(input_name)
+        if output_name:
+            self.output_combo.setCurrentText(output_name)
+    
+    def update_gate_options(self):
+        # Шумоподавлению без порога не на чем учиться: одно включает другое
+        if self.sender() is self.denoise_check and self.denoise_check.isChecked():
+            self.gate_check.setChecked(True)
+        elif self.sender() is self.gate_check and not self.gate_check.isChecked():
+            self.denoise_check.setChecked(False)
+    
+    def gate_threshold(self):
+        """Шумовой порог из поля, дБ, или None, если он выключен"""
+        if not self.gate_check.isChecked():
+            return None
+        try:
+            value = float(self.gate_input.text().strip())
+        except ValueError:
+            raise ValueError("шумовой порог - число дБ, например -55") from None
+        value = max(-90.0, min(0.0, value))
+        self.gate_input.setText(f"{value:g}")
+        return value
+    
+    def update_gain_hint(self, agc):
+        self.gain_label.setText(AGC_GAIN_HINT if agc else GAIN_HINT)
+    
+    def agc_target(self):
+        """Громкость автоусиления из поля, дБ, или None, если оно выключено"""
+        if not self.agc_check.isChecked():
+            return None
+        try:
+            value = float(self.agc_input.text().strip())
+        except ValueError:
+            raise ValueError("громкость автоусиления - число дБ, например -20") from None
+        # Выше 0 дБ выход только упирается в ограничитель
+        value = max(-60.0, min(0.0, value))
+        self.agc_input.setText(f"{value:g}")
+        return value
     
     def update_gain(self):
+        if self.params is None:
+            # Цепочка ещё загружается, значение применит init_backend
+            self.gain_pending = True
+            return
         try:
             text = self.gain_input.text().strip()
             if text:
                 value = float(text)
                 # Ограничиваем значение от 0 до 10000
                 value = max(0, min(10000, value))
-                with self.gain_lock:
-                    self.gain = value
+                self.publish_params(self.params._replace(gain=value))
                     
                 # Обновляем текст, только если значение изменилось
                 if str(value) != text:
@@ -273,102 +633,283 @@ class MicAmplifierGUI(QMainWindow):
                 
         except ValueError:
             # Если введено некорректное значение, возвращаем предыдущее
-            self.gain_input.setText(str(self.gain))
+            self.gain_input.setText(str(self.params.gain))
     
-    def audio_callback(self, indata, outdata, frames, time, status):
-        if status and not 'priming output' in str(status):
-            self.status_label.setText(f"Ошибка: {status}")
+    def update_route(self):
+        # Роль выхода определяется здесь, в потоке интерфейса, и публикуется снимком
+        route = resolve_route(self.output_combo.currentText(), self.monitor_check.isChecked())
+        if self.params is None:
+            return
+        self.publish_params(self.params._replace(route=route))
+        
+        if self.stream:
+            if route == ROUTE_CABLE:
+                self.status_label.setText("Микрофон активен (звук идёт только на виртуальный кабель)")
+            elif route == ROUTE_MONITOR:
+                self.status_label.setText("Микрофон активен (звук идёт на выбранный выход)")
+            else:
+                self.status_label.setText("Микрофон активен (звук отключен)")
+    
+    def publish_params(self, params):
+        self.params = params
+        # Процесс обработки читает снимок из общей памяти
+        if self.worker is not None:
+            self.worker.set_params(params)
+    
+    def update_recording(self):
+        # Поток ещё не запущен: запись начнёт start_stream
+        if self.stream is None:
+            return
+        if self.record_check.isChecked() and self.recorder is None:
+            self.start_recording()
+        elif not self.record_check.isChecked() and self.recorder is not None:
+            self.stop_recording()
+    
+    def start_recording(self):
+        from recorder import DEFAULT_RECORD_DIR, RING_SECONDS, Recorder
         
+        dry_channels = self.input_channels if self.record_dry_check.isChecked() else 0
+        ring = None
+        if self.worker is not None:
+            # Блоки кладёт колбэк процесса обработки, на диск пишет поток этого процесса
+            from dsp_worker import SharedFrameRing
+            ring = SharedFrameRing(int(RING_SECONDS * self.sample_rate), self.channels, dry_channels)
         try:
-            with self.gain_lock:
-                # Копируем входные данные в промежуточный буфер
-                self.buffer[:frames] = indata
-                
-                # Проверяем, является ли выходное устройство виртуальным кабелем
-                output_device_name = self.output_combo.currentText().lower()
-                is_virtual_cable = any(name in output_device_name for name in ['vb-cable', 'virtual', 'vb audio', 'cable output', 'CABLE Output (VB-Audio Virtual Cable)', 'CABLE input(VB-Audio Virtual Cable)'])
-                
-                if is_virtual_cable:
-                    # Применяем ОЧЕНЬ сильное усиление
-                    amplified = self.buffer[:frames] * self.gain * 50  # Увеличили множитель с 10 до 50
-                    
-                    # Добавляем сильное искажение (эффект "пердения")
-                    distorted = np.clip(amplified * 2.5, -1, 1)  # Увеличили множитель с 1.5 до 2.5
-                    distorted = np.sign(distorted) * np.power(np.abs(distorted), 0.5)  # Изменили степень с 0.7 на 0.5 для более сильного искажения
-                    
-                    # Добавляем меньше оригинального сигнала для более сильного эффекта
-                    processed = 0.9 * distorted + 0.1 * amplified  # Изменили пропорцию с 0.7/0.3 на 0.9/0.1
-                    
-                    # Дополнительное искажение
-                    processed = np.sin(processed * np.pi) # Добавили синусоидальное искажение
-                    
-                    # Нормализация для предотвращения перегрузки
-                    max_val = np.max(np.abs(processed))
-                    if max_val > 0.95:
-                        processed *= 0.95 / max_val
-                    
-                    # Записываем в выходной буфер
-                    outdata[:] = processed
-                else:
-                    # Если это не виртуальный кабель, отправляем тишину
-                    outdata.fill(0)
-                
-        except Exception as e:
-            self.status_label.setText(f"Ошибка в обработке звука: {e}")
-            outdata.fill(0)  # В случае ошибки отправляем тишину
+            recorder = Recorder(os.path.join(DEFAULT_RECORD_DIR, "record.wav"), self.sample_rate,
+                                self.channels, dry_channels,
+                                max_seconds=self.record_rotate_seconds, dtype=self.dtype, ring=ring)
+        except ValueError as e:
+            if ring is not None:
+                ring.close()
+            self.status_label.setText(f"Ошибка записи: {e}")
+            return
+        recorder.start()
+        # Колбэк начнёт копировать блоки со следующего вызова
+        if ring is not None:
+            self.record_ring = ring
+            self.worker.set_ring(ring)
+        self.recorder = recorder
+        self.record_dry_check.setEnabled(False)
+    
+    def stop_recording(self):
+        recorder = self.recorder
+        self.recorder = None
+        if self.worker is not None:
+            self.worker.set_ring(None)
+        # Поток записи дописывает остаток кольца и закрывает файлы
+        recorder.stop()
+        if self.record_ring is not None:
+            self.record_ring.close()
+            self.record_ring = None
+        self.record_dry_check.setEnabled(True)
+        if recorder.path:
+            self.status_label.setText(f"Запись сохранена: {recorder.path}")
+    
+    def show_events(self):
+        # Показываем последнее событие, повторы уже схлопнуты кольцом
+        if self.events is None:
+            return
+        events = self.events.drain()
+        if self.worker is not None:
+            # Заодно проверяем, жив ли процесс обработки, и перезапускаем его
+            events += self.worker.poll()
+            if self.worker.config is None:
+                # Процесс падал слишком часто, перезапуски прекращены
+                self.stop_stream()
+        if events:
+            from events import format_event
+            text = format_event(*events[-1])
+            if self.events.dropped != self.shown_dropped:
+                self.shown_dropped = self.events.dropped
+                text += f" (пропущено событий: {self.shown_dropped})"
+            self.status_label.setText(text)
+    
+    def update_meters(self):
+        # Читаем массив уровней как есть: аудиопоток пишет в него, не дожидаясь окна
+        worker = self.worker
+        self.meter_widget.set_levels(worker.levels if worker is not None else self.engine.meter.values)
+    
+    def update_diagnostics(self):
+        if not self.diagnostics_frame.isVisible():
+            return
+        if self.stats is None:
+            self.diagnostics_label.setText(f"Поток не запущен\nЗапуск: {startup.format()}")
+            return
+        data = self.stats.snapshot(self.stream)
+        if data is None:
+            self.diagnostics_label.setText("Ожидание показаний процесса обработки")
+            return
+        budget_us = self.block_size / self.sample_rate * 1e6
+        cpu_load = f"{data['cpu_load'] * 100:.1f}%" if data['cpu_load'] is not None else "н/д"
+        self.diagnostics_label.setText(
+            f"Вызовов колбэка: {data['callbacks']}\n"
+            f"Обработка блока: p50 < {data['p50_us']} мкс, p99 < {data['p99_us']} мкс, "
+            f"макс {data['max_us']} мкс (бюджет {budget_us:.0f} мкс)\n"
+            f"Недогрузка входа/выхода: {data['input_underflow']}/{data['output_underflow']}, "
+            f"переполнение: {data['input_overflow']}/{data['output_overflow']}\n"
+            f"Загрузка CPU потоком: {cpu_load}\n"
+            f"Задержка вход-выход: {data['io_latency_ms']:.1f} мс, "
+            f"неравномерность вызовов: {data['max_interval_error_ms']:.2f} мс"
+            + (f"\nШумовой порог: {'открыт' if data['gate_open'] else 'закрыт'} "
+               f"(уровень входа {data['gate_level_db']:.0f} дБ, переключений {data['gate_transitions']}), "
+               f"быстрый путь: {data['fast_callbacks']} блоков, "
+               f"в среднем {data['fast_mean_us']:.0f} мкс, макс {data['fast_max_us']} мкс"
+               if 'gate_open' in data else "")
+            + (f"\nЗадержка обработки: {self.engine.latency / self.sample_rate * 1000:.1f} мс"
+               if self.worker is None else "")
+            + (f"\nПроцесс обработки: pid {data['worker_pid']}, "
+               f"перезапусков {data['worker_restarts']}" if 'worker_pid' in data else "")
+            + (f"\nЗапись: {self.recorder.format()}" if self.recorder else "")
+        )
+    
+    def audio_callback(self, indata, outdata, frames, time, status):
+        # Снимок параметров читаем один раз за блок, обработка для роли выхода
+        # собрана заранее в start_stream; запись получает выход до преобразования частоты
+        self.graph.callback(indata, outdata, status, self.params, self.events, self.recorder)
     
     def start_stream(self):
+        from dsp_engine import noise_gate
+        
         try:
+            # Кнопка доступна после фонового опроса, номера устройств уже проверены
             input_device = self.input_combo.currentData()
             output_device = self.output_combo.currentData()
+            input_info = self.device_cache.get(input_device)
+            output_info = self.device_cache.get(output_device)
+            if input_info and output_info:
+                self.sample_rate = input_info.default_samplerate
+                self.output_rate = output_info.default_samplerate
+                self.engine.sample_rate = self.sample_rate
+                # Один канал микрофона цепочка считает один раз и копирует в оба выхода
+                self.input_channels = min(input_info.max_input_channels, 2)
+            candidate = self.tuning.get(self.input_combo.currentText(),
+                                        self.output_combo.currentText(), self.sample_rate)
+            self.block_size, self.latency = candidate or self.default_tuning
+            agc = self.agc_target()
+            self.gate_db = self.gate_threshold()
+            options = (self.denoise_check.isChecked(), agc, self.rumble_check.isChecked())
+            if options != (self.denoise, self.agc, self.rumble):
+                self.build_engine(*options)
+                self.engine.sample_rate = self.sample_rate
+            # Пока микрофон молчит, цепочка не считается и шум не усиливается
+            self.engine.gate = noise_gate(self.gate_db) if self.gate_db is not None else None
+            # Роль выхода публикуется до первого вызова колбэка
+            self.update_route()
+            
+            if self.worker_check.isChecked():
+                self.start_worker(input_device, output_device)
+            else:
+                self.open_local_stream(input_device, output_device)
             
-            self.stream = sd.Stream(
-                device=(input_device, output_device),
-                channels=self.channels,
-                samplerate=self.sample_rate,
-                dtype=self.dtype,
-                blocksize=self.block_size,
-                callback=self.audio_callback,
-                latency=0.2
-            )
+            # Настройки открылись: в следующий раз их можно не проверять
+            if input_info and output_info:
+                self.device_cache.record(input_info, output_info, True,
+                                         channels=(self.input_channels, self.channels),
+                                         samplerate=self.sample_rate,
+                                         output_samplerate=self.output_rate, dtype=self.dtype,
+                                         blocksize=self.block_size, latency=self.latency)
             
-            self.stream.start()
+            self.update_recording()
+            self.meter_timer.start()
             
             self.start_button.setEnabled(False)
             self.stop_button.setEnabled(True)
             self.input_combo.setEnabled(False)
             self.output_combo.setEnabled(False)
+            self.worker_check.setEnabled(False)
+            self.denoise_check.setEnabled(False)
+            self.rumble_check.setEnabled(False)
+            self.agc_check.setEnabled(False)
+            self.agc_input.setEnabled(False)
+            self.gate_check.setEnabled(False)
+            self.gate_input.setEnabled(False)
             
-            # Проверяем тип выходного устройства для статуса
-            output_device_name = self.output_combo.currentText().lower()
-            is_virtual_cable = any(name in output_device_name for name in ['vb-cable', 'virtual', 'vb audio', 'cable output'])
-            
-            if is_virtual_cable:
-                self.status_label.setText("Микрофон активен (звук идёт только на виртуальный кабель)")
-            else:
-                self.status_label.setText("Микрофон активен (звук отключен)")
+            # Статус по роли выходного устройства
+            self.update_route()
             
         except Exception as e:
             self.status_label.setText(f"Ошибка: {str(e)}")
     
+    def open_local_stream(self, input_device, output_device):
+        """Поток и цепочка в процессе окна"""
+        from instrumentation import CallbackStats
+        from resampler import open_stream
+        
+        # Буферы обработки выделяем до запуска потока, а не в колбэке
+        self.graph.prepare(self.block_size, self.channels)
+        
+        # Колбэк с замером времени для панели диагностики
+        self.stats = CallbackStats(self.sample_rate, self.engine.gate)
+        
+        # При разных частотах вход и выход открываются отдельно, между ними ресемплер
+        self.stream = open_stream(
+            sd,
+            (input_device, output_device),
+            self.sample_rate,
+            self.output_rate,
+            callback=self.stats.instrument(self.audio_callback),
+            channels=(self.input_channels, self.channels),
+            dtype=self.dtype,
+            blocksize=self.block_size,
+            latency=self.latency
+        )
+        self.stream.start()
+    
+    def start_worker(self, input_device, output_device):
+        """Поток и цепочка в отдельном процессе, связь через общую память"""
+        from audio_backend import backend_name
+        from dsp_worker import DspWorker
+        
+        worker = DspWorker()
+        worker.set_params(self.params)
+        try:
+            worker.start(dict(device=(input_device, output_device),
+                              sample_rate=self.sample_rate, output_rate=self.output_rate,
+                              channels=(self.input_channels, self.channels),
+                              block_size=self.block_size, latency=self.latency,
+                              backend=backend_name(sd), denoise=self.denoise,
+                              agc=self.agc, rumble=self.rumble, gate_db=self.gate_db))
+        except Exception:
+            worker.close()
+            raise
+        # Показания диагностики процесс присылает сам, по запросу из update_diagnostics
+        self.stats = worker
+        self.stream = worker
+        self.worker = worker
+    
     def stop_stream(self):
         if self.stream:
             self.stream.stop()
             self.stream.close()
             self.stream = None
+            self.worker = None
+            self.meter_timer.stop()
+            self.meter_widget.reset()
             
             self.start_button.setEnabled(True)
             self.stop_button.setEnabled(False)
             self.input_combo.setEnabled(True)
             self.output_combo.setEnabled(True)
+            self.worker_check.setEnabled(True)
+            self.denoise_check.setEnabled(True)
+            self.rumble_check.setEnabled(True)
+            self.agc_check.setEnabled(True)
+            self.agc_input.setEnabled(True)
+            self.gate_check.setEnabled(True)
+            self.gate_input.setEnabled(True)
             
             self.status_label.setText("Готов к работе")
+            # Поток остановлен, в кольце записи больше ничего не появится
+            if self.recorder is not None:
+                self.stop_recording()
     
     def closeEvent(self, event):
         self.stop_stream()
         event.accept()
 
 def main():
+    # Процесс обработки в собранном exe запускается тем же exe
+    multiprocessing.freeze_support()
     app = QApplication(sys.argv)
     window = MicAmplifierGUI()
     window.show()
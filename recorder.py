@@ -0,0 +1,269 @@
+"""
+Запись того, что уходит в виртуальный кабель, в файлы на диске.
+
+Колбэк потока не может писать на диск: запись может ждать диск сколько
+угодно. Поэтому колбэк только копирует обработанный блок (и, если нужно,
+исходный звук микрофона) в кольцо кадров, выделенное заранее, а поток
+записи раз в interval секунд забирает накопленное и пишет в файл большими
+последовательными кусками. Если поток записи не успевает и кольцо полное,
+блок отбрасывается целиком и считается в overruns - колбэк не ждёт.
+Кольцо (FrameRing) может лежать в общей памяти: тогда в него пишет колбэк
+процесса обработки (dsp_worker), а на диск - поток записи окна.
+
+Файлы - WAV (float32) или FLAC (24 бит, нужна библиотека soundfile), формат
+по расширению пути. Новый файл начинается, когда текущий (вместе с
+парным файлом входа) дорос до max_bytes или длится max_seconds. Имена: <путь без расширения>-<дата и
+время начала>-<номер>.wav, исходный звук - в парном файле с суффиксом -dry.
+"""
+
+import os
+import threading
+import time
+
+import numpy as np
+
+from wav_io import WavWriter
+
+try:
+    import soundfile
+except (ImportError, OSError):
+    # Без libsndfile запись только в WAV
+    soundfile = None
+
+DEFAULT_RECORD_DIR = os.path.join(os.path.expanduser('~'), 'MicStrenght', 'recordings')
+# Запас кольца: сколько секунд звука переживёт остановка диска
+RING_SECONDS = 4.0
+# Период потока записи и наибольший кусок одной записи
+WRITE_INTERVAL = 0.25
+CHUNK_SECONDS = 1.0
+
+
+class FlacWriter:
+    """Последовательная запись FLAC через soundfile, интерфейс как у WavWriter"""
+
+    def __init__(self, path, sample_rate, channels):
+        if soundfile is None:
+            raise ValueError("Для записи FLAC нужна библиотека soundfile")
+        self.path = path
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.frames = 0
+        self._file = soundfile.SoundFile(path, 'w', sample_rate, channels, 'PCM_24', format='FLAC')
+
+    def write(self, block):
+        self._file.write(block)
+        self.frames += len(block)
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+WRITERS = {
+    '.wav': WavWriter,
+    '.flac': FlacWriter,
+}
+
+
+class FrameRing:
+    """Кольцо кадров для одного писателя (колбэк) и одного читателя.
+
+    Кадры и счётчики - массивы numpy, поэтому кольцо можно разместить в
+    общей памяти (dsp_worker.SharedFrameRing) и писать в него из другого
+    процесса. counters: записано кадров, прочитано кадров, потеряно блоков,
+    потеряно кадров. Счётчик записанных двигает только писатель, прочитанных -
+    только читатель, поэтому блокировки не нужны. В кольце рядом лежат
+    channels каналов обработанного звука и, если есть, каналы входа.
+    """
+
+    def __init__(self, buffer, channels, counters=None):
+        self.buffer = buffer
+        self.capacity = len(buffer)
+        self.channels = channels
+        self.counters = np.zeros(4, dtype=np.int64) if counters is None else counters
+
+    @property
+    def overruns(self):
+        return int(self.counters[2])
+
+    @property
+    def dropped_frames(self):
+        return int(self.counters[3])
+
+    def push(self, processed, dry=None):
+        """Скопировать блок в кольцо (вызывается из колбэка, не ждёт)"""
+        counters = self.counters
+        frames = len(processed)
+        write = int(counters[0])
+        if self.capacity - (write - int(counters[1])) < frames:
+            counters[2] += 1
+            counters[3] += frames
+            return
+        start = write % self.capacity
+        first = min(frames, self.capacity - start)
+        buffer = self.buffer
+        channels = self.channels
+        buffer[start:start + first, :channels] = processed[:first]
+        buffer[:frames - first, :channels] = processed[first:]
+        if dry is not None and buffer.shape[1] > channels:
+            buffer[start:start + first, channels:] = dry[:first]
+            buffer[:frames - first, channels:] = dry[first:]
+        # Счётчик двигаем последним: читатель видит только скопированные кадры
+        counters[0] = write + frames
+
+    def read_into(self, out):
+        """Забрать в out до len(out) кадров, вернуть их число (только читатель)"""
+        read = int(self.counters[1])
+        count = min(int(self.counters[0]) - read, len(out))
+        start = read % self.capacity
+        first = min(count, self.capacity - start)
+        out[:first] = self.buffer[start:start + first]
+        out[first:count] = self.buffer[:count - first]
+        self.counters[1] = read + count
+        return count
+
+
+class Recorder:
+    """Кольцо кадров от колбэка к потоку записи и ротация файлов.
+
+    push() вызывает только аудиопоток, забирает из кольца только поток
+    записи. ring - готовое кольцо FrameRing (например, в общей памяти с
+    процессом обработки), иначе оно выделяется здесь на ring_seconds.
+    """
+
+    def __init__(self, path, sample_rate, channels, dry_channels=0, max_bytes=None,
+                 max_seconds=None, dtype=np.float32, ring_seconds=RING_SECONDS,
+                 interval=WRITE_INTERVAL, ring=None):
+        self.base, extension = os.path.splitext(path)
+        extension = extension.lower() or '.wav'
+        if extension not in WRITERS:
+            raise ValueError(f"Неизвестный формат записи: {extension} (нужен .wav или .flac)")
+        if extension == '.flac' and soundfile is None:
+            raise ValueError("Для записи FLAC нужна библиотека soundfile")
+        self.extension = extension
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.dry_channels = dry_channels
+        self.max_bytes = max_bytes
+        limits = [int(max_seconds * sample_rate)] if max_seconds else []
+        # Размер WAV известен заранее (заголовок 56 байт, float32), FLAC сжимается -
+        # его размер проверяется после каждого куска
+        if max_bytes and extension == '.wav':
+            limits.append(max(1, (max_bytes - 56) // (4 * (channels + dry_channels))))
+        self.max_frames = min(limits) if limits else None
+        self.check_size = bool(max_bytes) and extension != '.wav'
+        self.interval = interval
+
+        if ring is None:
+            ring = FrameRing(np.zeros((int(ring_seconds * sample_rate), channels + dry_channels),
+                                      dtype=dtype), channels)
+        self.ring = ring
+        self._chunk = np.zeros((int(CHUNK_SECONDS * sample_rate), channels + dry_channels),
+                               dtype=ring.buffer.dtype)
+        # Счётчики потока записи
+        self.written_frames = 0
+        self.files = []
+        self.error = None
+        self._writers = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    @property
+    def path(self):
+        """Файл, который пишется сейчас (последний начатый)"""
+        return self.files[-1] if self.files else None
+
+    @property
+    def overruns(self):
+        return self.ring.overruns
+
+    @property
+    def dropped_frames(self):
+        return self.ring.dropped_frames
+
+    def push(self, processed, dry=None):
+        """Скопировать блок в кольцо (вызывается из колбэка, не ждёт)"""
+        self.ring.push(processed, dry)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        """Дописать всё из кольца и закрыть файлы"""
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def _run(self):
+        try:
+            while not self._stop.wait(self.interval):
+                self._drain()
+            self._drain()
+        except Exception as e:
+            # Диск переполнен и т.п.: колбэк дальше только копит overruns
+            self.error = e
+        finally:
+            self._close()
+
+    def _drain(self):
+        while True:
+            count = self.ring.read_into(self._chunk)
+            if not count:
+                break
+            self._write_chunk(self._chunk[:count])
+        if self._writers:
+            for writer in self._writers:
+                writer.flush()
+
+    def _write_chunk(self, chunk):
+        while len(chunk):
+            if self._writers is None:
+                self._open()
+            wet = self._writers[0]
+            count = len(chunk)
+            if self.max_frames:
+                count = min(count, self.max_frames - wet.frames)
+            part = chunk[:count]
+            wet.write(part[:, :self.channels])
+            if self.dry_channels:
+                self._writers[1].write(part[:, self.channels:])
+            self.written_frames += count
+            chunk = chunk[count:]
+            full = self.max_frames and wet.frames >= self.max_frames
+            if full or self.check_size and self._size() >= self.max_bytes:
+                self._close()
+
+    def _size(self):
+        return sum(os.path.getsize(writer.path) for writer in self._writers)
+
+    def _open(self):
+        directory = os.path.dirname(self.base)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        name = f"{self.base}-{time.strftime('%Y%m%d-%H%M%S')}-{len(self.files) + 1:03d}"
+        writer_class = WRITERS[self.extension]
+        self._writers = [writer_class(name + self.extension, self.sample_rate, self.channels)]
+        if self.dry_channels:
+            self._writers.append(writer_class(name + '-dry' + self.extension, self.sample_rate,
+                                              self.dry_channels))
+        self.files.append(self._writers[0].path)
+
+    def _close(self):
+        if self._writers:
+            for writer in self._writers:
+                writer.close()
+        self._writers = None
+
+    def format(self):
+        """Состояние записи одной строкой для окна и консоли"""
+        text = (f"{self.path or 'файл ещё не создан'}, записано {self.written_frames / self.sample_rate:.1f} с"
+                f", файлов {len(self.files)}")
+        if self.overruns:
+            text += f", потеряно блоков {self.overruns} ({self.dropped_frames / self.sample_rate:.1f} с)"
+        if self.error is not None:
+            text += f", ошибка: {self.error}"
+        return text
@@ -0,0 +1,319 @@
+"""
+Потоковое преобразование частоты дискретизации.
+
+Вход и выход работают каждый на своей родной частоте: цепочка обработки
+считает на частоте микрофона, а PolyphaseResampler переводит блоки в частоту
+выхода. Отношение частот сокращается до up/down (44100 -> 48000: 160/147),
+фильтр - windowed sinc с окном Кайзера, разложенный заранее на up фаз
+(банк фильтров). Для каждого выходного отсчёта фаза и позиция во входе
+повторяются с периодом up, поэтому коэффициенты и смещения на блок - это
+срезы заранее посчитанных таблиц. Окна входа под все выходные отсчёты
+блока собираются одним np.take, свёртка - одним пакетным matmul, циклов
+по отсчётам и отводам нет. Хвост входа (отводы - 1 кадр) переносится между блоками,
+так что результат не зависит от того, как поток поделён на блоки.
+
+Качество - компромисс между точностью и CPU: число отводов на фазу и
+подавление в полосе задерживания (QUALITY). Время на блок растёт
+пропорционально числу отводов (python benchmark.py resampler).
+
+ResampledStream открывает вход и выход отдельными потоками, если их частоты
+различаются, и соединяет их очередью кадров FrameFifo.
+"""
+
+from math import gcd
+
+import numpy as np
+
+from dsp_engine import shift_history
+
+# Отводов на фазу и подавление вне полосы, дБ
+QUALITY = {
+    'low': (16, 60.0),
+    'medium': (32, 80.0),
+    'high': (64, 100.0),
+}
+DEFAULT_QUALITY = 'medium'
+
+
+def kaiser_beta(attenuation):
+    """Параметр окна Кайзера для подавления attenuation дБ"""
+    if attenuation > 50:
+        return 0.1102 * (attenuation - 8.7)
+    if attenuation > 21:
+        return 0.5842 * (attenuation - 21) ** 0.4 + 0.07886 * (attenuation - 21)
+    return 0.0
+
+
+def design_bank(up, down, taps, attenuation):
+    """Банк фильтров (up, taps): bank[p, k] = h[p + k * up].
+
+    Фильтр работает на частоте входа * up, срез - чуть ниже половины
+    меньшей из двух частот, так что переход заканчивается на Найквисте.
+    """
+    length = up * taps
+    # Ширина перехода по формуле Кайзера, в долях меньшей частоты
+    transition = (attenuation - 8) / (14.36 * taps / max(1, down / up))
+    cutoff = (0.5 - transition / 2) / max(up, down)
+    n = np.arange(length) - (length - 1) / 2
+    h = 2 * cutoff * np.sinc(2 * cutoff * n) * np.kaiser(length, kaiser_beta(attenuation)) * up
+    return h.reshape(taps, up).T
+
+
+class PolyphaseResampler:
+    """Перевод блоков из in_rate в out_rate с состоянием между блоками.
+
+    process(indata) возвращает вид на внутренний буфер с выходными кадрами:
+    их число зависит от того, сколько выходных отсчётов уже покрыто входом,
+    и колеблется на единицу от блока к блоку. Выход отстаёт от входа на
+    delay кадров входа (половина фильтра).
+    """
+
+    def __init__(self, in_rate, out_rate, channels=2, quality=DEFAULT_QUALITY, dtype=np.float32):
+        divisor = gcd(int(in_rate), int(out_rate))
+        self.in_rate = in_rate
+        self.out_rate = out_rate
+        self.up = int(out_rate) // divisor
+        self.down = int(in_rate) // divisor
+        self.channels = channels
+        self.quality = quality
+        self.dtype = dtype
+        taps, attenuation = QUALITY[quality]
+        # При понижении частоты фильтр длиннее во столько же раз, иначе срез уезжает вниз
+        self.taps = int(np.ceil(taps * max(1, self.down / self.up)))
+        self.bank = design_bank(self.up, self.down, self.taps, attenuation)
+        self.history = self.taps - 1
+        self.delay = (self.up * self.taps - 1) / (2 * self.up)
+        self.frames = 0
+        self.reset()
+
+    def max_output(self, frames):
+        """Наибольшее число выходных кадров на блок из frames входных"""
+        return -(-frames * self.up // self.down) + 1
+
+    def reset(self):
+        # Номер фазы следующего выходного отсчёта и позиция его базы во входе блока
+        self.phase = 0
+        self.position = 0
+        if self.frames:
+            self.buffer[:self.history] = 0
+
+    def prepare(self, frames):
+        """Таблицы и буферы под наибольший размер входного блока"""
+        self.frames = frames
+        outputs = self.max_output(frames)
+        span = np.arange(self.up + outputs + 1)
+        # База (последний вход) и коэффициенты каждого выходного отсчёта периода
+        # подряд с запасом на блок: на блок берутся срезы, а не индексы по фазам.
+        # Коэффициенты развёрнуты, чтобы окно входа шло по возрастанию времени
+        self.bases = span * self.down // self.up
+        coefs = self.bank[span[:-1] * self.down % self.up, ::-1]
+        self.coefs = np.ascontiguousarray(coefs[:, None, :], dtype=self.dtype)
+        self.offsets = np.arange(self.taps)
+        self.buffer = np.zeros((self.history + frames, self.channels), dtype=self.dtype)
+        self.output = np.zeros((outputs, 1, self.channels), dtype=self.dtype)
+        self.windows = np.zeros((outputs, self.taps, self.channels), dtype=self.dtype)
+        self.index = np.zeros(outputs, dtype=np.intp)
+        self.window_index = np.zeros((outputs, self.taps), dtype=np.intp)
+        self.reset()
+
+    def process(self, indata):
+        frames = len(indata)
+        if frames > self.frames or indata.shape[1] != self.channels:
+            self.channels = indata.shape[1]
+            self.prepare(max(frames, self.frames))
+        history = self.history
+        buffer = self.buffer
+        buffer[history:history + frames] = indata
+
+        phase = self.phase
+        position = self.position
+        bases = self.bases
+        # Сколько выходных отсчётов целиком покрыто уже пришедшим входом
+        count = int(bases.searchsorted(frames - 1 - position + bases[phase], 'right')) - phase
+        count = max(count, 0)
+        out = self.output[:count]
+        if count:
+            # Окно выходного отсчёта - taps кадров буфера, кончая его базой
+            index = self.index[:count]
+            np.subtract(bases[phase:phase + count], bases[phase] - position, out=index)
+            window_index = self.window_index[:count]
+            np.add(index[:, None], self.offsets, out=window_index)
+            windows = self.windows[:count]
+            np.take(buffer, window_index, axis=0, out=windows)
+            np.matmul(self.coefs[phase:phase + count], windows, out=out)
+
+        self.position = position + int(bases[phase + count] - bases[phase]) - frames
+        self.phase = (phase + count) % self.up
+        shift_history(buffer, history, frames)
+        return out[:, 0]
+
+
+class FrameFifo:
+    """Очередь кадров между потоками входа и выхода без блокировок.
+
+    Один пишущий поток и один читающий: счётчики записанного и прочитанного
+    только растут, каждый поток меняет свой счётчик после копирования данных.
+    """
+
+    def __init__(self, capacity, channels, dtype=np.float32):
+        self.capacity = capacity
+        self.buffer = np.zeros((capacity, channels), dtype=dtype)
+        self.written = 0
+        self.read = 0
+
+    @property
+    def available(self):
+        return self.written - self.read
+
+    def write(self, frames):
+        """Записать сколько поместится, вернуть число записанных кадров"""
+        count = min(len(frames), self.capacity - self.available)
+        start = self.written % self.capacity
+        first = min(count, self.capacity - start)
+        self.buffer[start:start + first] = frames[:first]
+        self.buffer[:count - first] = frames[first:count]
+        self.written += count
+        return count
+
+    def read_into(self, outdata):
+        """Прочитать до len(outdata) кадров, вернуть число прочитанных"""
+        count = min(len(outdata), self.available)
+        start = self.read % self.capacity
+        first = min(count, self.capacity - start)
+        outdata[:first] = self.buffer[start:start + first]
+        outdata[first:count] = self.buffer[:count - first]
+        self.read += count
+        return count
+
+
+def split_channels(channels):
+    """(каналов входа, каналов выхода) из channels для sd.Stream: число или пара"""
+    if isinstance(channels, (tuple, list)):
+        return tuple(channels)
+    return channels, channels
+
+
+def output_blocksize(blocksize, in_rate, out_rate):
+    """Размер блока выхода той же длительности, что блок входа"""
+    return max(1, int(round(blocksize * out_rate / in_rate)))
+
+
+class StreamTime:
+    """Время блока для колбэка ResampledStream, поля как у time_info sd.Stream"""
+
+    __slots__ = ('inputBufferAdcTime', 'outputBufferDacTime', 'currentTime')
+
+    def __init__(self):
+        self.inputBufferAdcTime = 0.0
+        self.outputBufferDacTime = 0.0
+        self.currentTime = 0.0
+
+
+class ResampledStream:
+    """Вход и выход на разных частотах как один поток с колбэком sd.Stream.
+
+    callback(indata, outdata, frames, time, status) считает на частоте входа
+    в потоке входа, результат переводится в частоту выхода и через
+    FrameFifo уходит в поток выхода. Выход молчит, пока в очереди не
+    накопится блок входа и блок выхода; если очередь опустела, счётчик
+    underruns растёт и накопление начинается заново, если переполнилась
+    (часы устройств расходятся) - лишнее отбрасывается, счётчик overruns.
+
+    У потока входа нет времени выхода (outputBufferDacTime = 0), поэтому
+    колбэк получает StreamTime: время входа - от потока входа, время выхода -
+    конец последнего буфера потока выхода плюс кадры, что уже стоят в
+    очереди перед этим блоком. Пока поток выхода не вызывался, оно 0.
+    """
+
+    def __init__(self, sd, device, in_rate, out_rate, channels, dtype, blocksize, callback,
+                 latency=None, quality=DEFAULT_QUALITY, **kwargs):
+        input_device, output_device = device if device is not None else (None, None)
+        input_channels, output_channels = split_channels(channels)
+        self.callback = callback
+        # Колбэк пишет столько каналов, сколько у выхода, их и переводим
+        self.resampler = PolyphaseResampler(in_rate, out_rate, output_channels, quality, dtype)
+        self.resampler.prepare(blocksize)
+        self.processed = np.zeros((blocksize, output_channels), dtype=dtype)
+        out_block = output_blocksize(blocksize, in_rate, out_rate)
+        self.prefill = self.resampler.max_output(blocksize) + out_block
+        self.fifo = FrameFifo(4 * self.prefill, output_channels, dtype)
+        self.primed = False
+        self.underruns = 0
+        self.overruns = 0
+        self.out_rate = out_rate
+        self.time = StreamTime()
+        # Когда зазвучит следующий кадр очереди, по часам потока выхода
+        self._next_dac_time = 0.0
+        self.input = sd.InputStream(device=input_device, samplerate=in_rate, channels=input_channels,
+                                    dtype=dtype, blocksize=blocksize, latency=latency,
+                                    callback=self._input_callback)
+        self.output = sd.OutputStream(device=output_device, samplerate=out_rate,
+                                      channels=output_channels, dtype=dtype, blocksize=out_block,
+                                      latency=latency, callback=self._output_callback, **kwargs)
+
+    def _input_callback(self, indata, frames, time, status):
+        if frames > len(self.processed):
+            self.processed = np.zeros((frames, self.processed.shape[1]), dtype=indata.dtype)
+        processed = self.processed[:frames]
+        stream_time = self.time
+        stream_time.inputBufferAdcTime = time.inputBufferAdcTime
+        stream_time.currentTime = time.currentTime
+        if self._next_dac_time:
+            stream_time.outputBufferDacTime = (self._next_dac_time
+                                               + self.fifo.available / self.out_rate)
+        self.callback(indata, processed, frames, stream_time, status)
+        resampled = self.resampler.process(processed)
+        if self.fifo.write(resampled) < len(resampled):
+            self.overruns += 1
+
+    def _output_callback(self, outdata, frames, time, status):
+        self._next_dac_time = time.outputBufferDacTime + frames / self.out_rate
+        if not self.primed:
+            if self.fifo.available < self.prefill:
+                outdata.fill(0)
+                return
+            self.primed = True
+        count = self.fifo.read_into(outdata)
+        if count < frames:
+            outdata[count:] = 0
+            self.underruns += 1
+            self.primed = False
+
+    @property
+    def active(self):
+        return self.input.active and self.output.active
+
+    @property
+    def cpu_load(self):
+        return self.input.cpu_load + self.output.cpu_load
+
+    def start(self):
+        self.output.start()
+        self.input.start()
+
+    def stop(self):
+        self.input.stop()
+        self.output.stop()
+
+    def close(self):
+        self.input.close()
+        self.output.close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+        self.close()
+
+
+def open_stream(sd, device, in_rate, out_rate, callback, quality=DEFAULT_QUALITY, **settings):
+    """sd.Stream, если частоты совпадают, иначе ResampledStream.
+
+    settings - channels, dtype, blocksize, latency и прочее для sd.Stream.
+    """
+    if in_rate == out_rate:
+        return sd.Stream(device=device, samplerate=in_rate, callback=callback, **settings)
+    return ResampledStream(sd, device, in_rate, out_rate, callback=callback, quality=quality,
+                           **settings)
@@ -0,0 +1,92 @@
+"""
+Роли выходного устройства и заранее собранная обработка для каждой роли.
+
+Роль определяется один раз при запуске потока по имени устройства, а колбэк
+только берёт готовую функцию обработки по роли из снимка параметров. Так в
+аудиопотоке нет ни обращений к виджетам, ни работы со строками.
+"""
+
+# Виртуальный кабель: полная цепочка обработки
+ROUTE_CABLE = 'cable'
+# Обычный выход, на котором пользователь сам хочет слышать обработку
+ROUTE_MONITOR = 'monitor'
+# Обычный выход без прослушивания: тишина, чтобы не было эха
+ROUTE_MUTED = 'muted'
+
+# Части имён виртуальных кабелей (в нижнем регистре)
+VIRTUAL_CABLE_NAMES = ('vb-cable', 'virtual', 'vb audio', 'cable output', 'cable input')
+
+
+def is_virtual_cable(device_name):
+    name = device_name.lower()
+    return any(part in name for part in VIRTUAL_CABLE_NAMES)
+
+
+def resolve_route(device_name, monitor=False):
+    """Роль выходного устройства по его имени"""
+    if is_virtual_cable(device_name):
+        return ROUTE_CABLE
+    return ROUTE_MONITOR if monitor else ROUTE_MUTED
+
+
+class ProcessingGraph:
+    """Обработка, собранная под все роли выхода до запуска потока.
+
+    run() вызывается из колбэка: роль берётся из снимка параметров, поэтому
+    переключение роли на ходу - это просто публикация нового снимка.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self._routes = {
+            ROUTE_CABLE: self._processed,
+            ROUTE_MONITOR: self._processed,
+            ROUTE_MUTED: self._muted,
+        }
+
+    def prepare(self, frames, channels):
+        self.engine.prepare(frames, channels)
+
+    def run(self, indata, outdata, params):
+        self._routes[params.route](indata, outdata, params)
+
+    def callback(self, indata, outdata, status, params, events, tap=None):
+        """Тело колбэка потока в окне и в dsp_worker.
+
+        Флаги и исключения уходят в кольцо событий, при ошибке на выход идёт
+        тишина; tap (запись) получает то же, что ушло на выход.
+        """
+        if status:
+            # Флаги уходят в кольцо событий, 'priming output' там отбрасывается
+            events.push_status(status)
+
+        try:
+            self.run(indata, outdata, params)
+        except Exception as e:
+            events.push_error(e)
+            outdata.fill(0)  # В случае ошибки отправляем тишину
+
+        if tap is not None:
+            tap.push(outdata, indata)
+
+    def _processed(self, indata, outdata, params):
+        # Усиление и искажение считаются в заранее выделенных буферах
+        self.engine.process(indata, outdata, params.gain)
+
+    def _muted(self, indata, outdata, params):
+        outdata.fill(0)
+
+
+def build_graph(dtype, sample_rate=48000, denoise=False, agc=None, rumble=False):
+    """Цепочка окна и dsp_worker с индикатором уровня, собранная под все роли выхода.
+
+    Шумоподавление, автоусиление и срез гула решаются до запуска потока;
+    порог ставит тот, кто открывает поток.
+    """
+    from dsp_engine import DistortionEngine, LevelMeter
+
+    engine = DistortionEngine(dtype, sample_rate=sample_rate, denoise=denoise, agc=agc,
+                              rumble=rumble)
+    # Уровни считает колбэк в массив, окно читает его таймером
+    engine.meter = LevelMeter()
+    return ProcessingGraph(engine)
@@ -0,0 +1,200 @@
+"""
+Долгие прогоны программы на симулированных устройствах быстрее реального времени.
+
+Окно (без экрана, Qt offscreen), app.py и mic_amplifier.py запускают поток
+своим обычным путём, только устройства - audio_backend.SimulatedBackend, а
+время идёт, пока прогон крутит backend.run(): час работы проходит за
+секунды. По дороге можно добавить задержки пробуждения колбэка, случайные
+сбои буферов, отключение устройства и петлю выход -> вход. В конце
+печатаются (и по --json сохраняются) диагностика колбэка самой программы
+(CallbackStats) и счётчики симуляции по каждому потоку: вызовы, сбои по
+типам, опоздания.
+
+Кэш устройств, калибровка и записи прогона пишутся во временную папку, а
+не в настоящую домашнюю.
+
+Пример:
+    python soak.py app --hours 1
+    python soak.py gui --hours 1 --wakeup-ms 0.5 --spike-ms 20 --spike-rate 0.01
+    python soak.py cli --minutes 30 --xrun-rate 0.001 --disconnect-at 600 --json soak.json
+"""
+
+import os
+import shutil
+import tempfile
+
+# До импорта модулей программы: пути к их файлам считаются при импорте
+SOAK_HOME = tempfile.mkdtemp(prefix='micstrenght-soak-')
+os.environ['HOME'] = os.environ['USERPROFILE'] = SOAK_HOME
+
+import argparse
+import json
+import time
+
+from audio_backend import SOURCES, SimulatedBackend
+from instrumentation import FLAG_KEYS
+
+FRONT_ENDS = ('gui', 'app', 'cli')
+# Шаг прогона, виртуальные секунды: между шагами окно обрабатывает свои таймеры
+STEP_SECONDS = 1.0
+# Как часто печатать ход прогона, виртуальные секунды
+PROGRESS_SECONDS = 600.0
+# Сколько ждать, пока окно найдёт устройства, с
+GUI_READY_TIMEOUT = 30.0
+
+
+def drive(backend, seconds, between=None):
+    """Прогнать seconds виртуального времени шагами, печатая ход прогона"""
+    done = 0.0
+    reported = 0.0
+    while done < seconds:
+        step = min(STEP_SECONDS, seconds - done)
+        backend.run(step)
+        done += step
+        if between is not None:
+            between()
+        if done - reported >= PROGRESS_SECONDS:
+            reported = done
+            print(f"  {done / 60:.0f} мин из {seconds / 60:.0f}, "
+                  f"{backend.wall_time:.1f} с настоящего времени")
+
+
+def soak_app(backend, seconds):
+    """app.py: устройства по имени, как в режиме службы"""
+    import app
+
+    amplifier = app.MicrophoneAmplifier(backend=backend)
+    amplifier.collect_stats = True
+    ok, error = amplifier.configure_devices(amplifier.find_device('Microphone', 'input'),
+                                            amplifier.find_device('CABLE', 'output'))
+    if not ok:
+        raise RuntimeError(error)
+    amplifier.start_audio()
+    try:
+        drive(backend, seconds)
+        return amplifier.stats.snapshot(amplifier.stream)
+    finally:
+        amplifier.stop_audio()
+
+
+def soak_cli(backend, seconds):
+    """mic_amplifier.py: устройства по умолчанию"""
+    import mic_amplifier
+
+    amplifier = mic_amplifier.MicrophoneAmplifier(backend=backend)
+    amplifier.collect_stats = True
+    stream = amplifier.open_stream()
+    with stream:
+        drive(backend, seconds)
+    return amplifier.stats.snapshot(stream)
+
+
+def soak_gui(backend, seconds):
+    """Окно без экрана: выбор устройств и кнопки, как у пользователя"""
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    from PySide6.QtWidgets import QApplication
+    import mic_amplifier_gui
+
+    application = QApplication.instance() or QApplication([])
+    window = mic_amplifier_gui.MicAmplifierGUI(backend=backend)
+    window.show()
+    deadline = time.monotonic() + GUI_READY_TIMEOUT
+    while not (window.start_button.isEnabled() and window.input_combo.count()):
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"Окно не нашло устройства: {window.status_label.text()}")
+        application.processEvents()
+        time.sleep(0.01)
+    window.input_combo.setCurrentText(backend.query_devices('Microphone', 'input')['name'])
+    window.output_combo.setCurrentText(backend.query_devices('CABLE', 'output')['name'])
+    window.start_button.click()
+    if window.stream is None:
+        raise RuntimeError(window.status_label.text())
+    try:
+        drive(backend, seconds, application.processEvents)
+        return window.stats.snapshot(window.stream)
+    finally:
+        window.stop_button.click()
+        window.close()
+        application.processEvents()
+
+
+SOAKS = {'gui': soak_gui, 'app': soak_app, 'cli': soak_cli}
+
+
+def print_report(result):
+    simulation = result['simulation']
+    print(f"\nПрогон {result['front_end']}: {simulation['virtual_seconds'] / 60:.1f} мин "
+          f"виртуального времени за {simulation['wall_seconds']:.1f} с "
+          f"({simulation['speedup'] or 0:.0f}x)")
+    for stream in simulation['streams']:
+        # Пробные открытия при выборе устройств колбэк не вызывали
+        if not stream['callbacks']:
+            continue
+        flags = ', '.join(f"{key} {stream[key]}" for _, key in FLAG_KEYS if stream[key])
+        print(f"Поток {stream['kind']} ({', '.join(stream['devices'])}), блок {stream['blocksize']}: "
+              f"{stream['callbacks']} вызовов, сбоев {sum(stream[key] for _, key in FLAG_KEYS)}"
+              f"{f' ({flags})' if flags else ''}")
+        print(f"    опоздание p50 {stream['lateness_p50_ms']:.2f} мс, "
+              f"p99 {stream['lateness_p99_ms']:.2f} мс, макс {stream['lateness_max_ms']:.2f} мс, "
+              f"нагрузка {stream['cpu_load']:.1%}"
+              f"{', устройство пропало' if stream['lost'] else ''}")
+    callback = result['callback']
+    if callback is not None:
+        print(f"Колбэк программы: {callback['callbacks']} вызовов, p50 {callback['p50_us']} мкс, "
+              f"p99 {callback['p99_us']} мкс, макс {callback['max_us']} мкс")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Долгий прогон на симулированных устройствах")
+    parser.add_argument('front_end', choices=FRONT_ENDS, help="что гонять: окно, app.py или "
+                                                              "mic_amplifier.py")
+    parser.add_argument('--hours', type=float, default=0.0)
+    parser.add_argument('--minutes', type=float, default=0.0)
+    parser.add_argument('--source', choices=SOURCES, default='speech', help="сигнал микрофона")
+    parser.add_argument('--wakeup-ms', type=float, default=0.0,
+                        help="средняя задержка пробуждения колбэка, мс")
+    parser.add_argument('--spike-ms', type=float, default=0.0, help="выбросы задержки до, мс")
+    parser.add_argument('--spike-rate', type=float, default=0.0, help="доля блоков с выбросом")
+    parser.add_argument('--xrun-rate', type=float, default=0.0,
+                        help="доля блоков со случайным флагом сбоя буфера")
+    parser.add_argument('--loopback', type=float, default=0.0,
+                        help="доля выхода, возвращаемая на вход")
+    parser.add_argument('--loopback-delay', type=float, default=0.01, help="задержка петли, с")
+    parser.add_argument('--disconnect', default='Microphone',
+                        help="какое устройство отключать (часть имени)")
+    parser.add_argument('--disconnect-at', type=float, metavar='SECONDS',
+                        help="отключить устройство на этой секунде прогона")
+    parser.add_argument('--reconnect-at', type=float, metavar='SECONDS',
+                        help="вернуть устройство на этой секунде прогона")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', metavar='PATH', help="сохранить показания в файл")
+    args = parser.parse_args()
+
+    seconds = args.hours * 3600 + args.minutes * 60 or 3600.0
+    backend = SimulatedBackend(source=args.source, loopback=args.loopback,
+                               loopback_delay=args.loopback_delay, wakeup_ms=args.wakeup_ms,
+                               spike_ms=args.spike_ms, spike_rate=args.spike_rate,
+                               xrun_rate=args.xrun_rate, seed=args.seed)
+    if args.disconnect_at is not None:
+        backend.disconnect(args.disconnect, at=args.disconnect_at)
+    if args.reconnect_at is not None:
+        backend.reconnect(args.disconnect, at=args.reconnect_at)
+
+    try:
+        callback = SOAKS[args.front_end](backend, seconds)
+    finally:
+        shutil.rmtree(SOAK_HOME, ignore_errors=True)
+    result = {
+        'front_end': args.front_end,
+        'options': {key: value for key, value in vars(args).items() if key != 'json'},
+        'simulation': backend.report(),
+        'callback': callback,
+    }
+    print_report(result)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+Замер времени запуска окна программы.
+
+Модуль импортируется первым, время отсчитывается от его импорта. Окно
+отмечает этапы (импорт Qt, создание окна, первая отрисовка, загрузка numpy
+и PortAudio, список устройств), итог показывается в панели диагностики и,
+если задана переменная окружения MICSTRENGHT_STARTUP_TIMING, дописывается
+строкой JSON в файл по этому пути ('-' - печать в консоль).
+
+Время до запуска интерпретатора (распаковка однофайловой сборки
+PyInstaller) сюда не входит.
+"""
+
+import json
+import os
+import time
+
+START = time.perf_counter()
+
+TIMING_ENV = 'MICSTRENGHT_STARTUP_TIMING'
+
+# Названия этапов для панели диагностики
+MILESTONE_NAMES = {
+    'qt_import': "импорт Qt",
+    'window': "окно создано",
+    'first_paint': "первая отрисовка",
+    'backend_import': "numpy и PortAudio",
+    'devices': "список устройств",
+    'ready': "готово к запуску",
+}
+
+
+class StartupProbe:
+    """Отметки этапов запуска в миллисекундах от импорта модуля.
+
+    mark() вызывается и из потока интерфейса, и из фонового потока загрузки:
+    добавление в список атомарно, блокировка не нужна.
+    """
+
+    def __init__(self, start=START):
+        self.start = start
+        self.marks = []
+
+    def mark(self, name):
+        if not any(mark == name for mark, _ in self.marks):
+            self.marks.append((name, (time.perf_counter() - self.start) * 1000))
+
+    def report(self):
+        return {name: round(ms, 1) for name, ms in self.marks}
+
+    def format(self):
+        return ", ".join(f"{MILESTONE_NAMES.get(name, name)} {ms:.0f} мс" for name, ms in self.marks)
+
+    def dump(self, path=None):
+        """Записать отметки, если задан файл (или MICSTRENGHT_STARTUP_TIMING)"""
+        path = path or os.environ.get(TIMING_ENV)
+        if not path:
+            return
+        line = json.dumps({'time': time.time(), 'milestones_ms': self.report()})
+        if path == '-':
+            print(line)
+            return
+        try:
+            with open(path, 'a', encoding='utf-8') as f:
+                f.write(line + '\n')
+        except OSError as e:
+            print(f"Ошибка записи времени запуска: {e}")
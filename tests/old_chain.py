@@ -0,0 +1,60 @@
+"""
+Исходная обработка окна (mic_amplifier_gui.py до цепочки этапов) для сравнения.
+
+original_distortion - выражение из старого колбэка, original_stages - та же
+обработка этапами dsp_engine с прежней нормализацией блока вместо
+ограничителя пиков. Обе нужны только тестам и benchmark.py limiter.
+"""
+
+import numpy as np
+
+from dsp_engine import Clipper, Gain, Mix, Scale, Stage, Tap, Waveshaper
+
+
+class PeakNormalizer(Stage):
+    """Нормализация блока: если пик выше ceiling, весь блок уменьшается"""
+
+    # Нужен пик всего блока, поэтому кусками не обрабатывается
+    elementwise = False
+
+    def __init__(self, ceiling=0.95):
+        self.ceiling = ceiling
+
+    def prepare(self, frames, channels, dtype, sample_rate):
+        self._scratch = np.zeros((frames, channels), dtype=dtype)
+
+    def process(self, src, dst, lo, hi):
+        if dst is not src:
+            np.copyto(dst, src)
+        scratch = self._scratch[lo:hi]
+        np.abs(dst, out=scratch)
+        max_val = scratch.max()
+        if max_val > self.ceiling:
+            np.multiply(dst, self.ceiling / max_val, out=dst)
+
+
+def original_distortion(block, gain):
+    """Обработка колбэка окна до цепочки этапов"""
+    amplified = block * gain * 50
+    distorted = np.clip(amplified * 2.5, -1, 1)
+    distorted = np.sign(distorted) * np.power(np.abs(distorted), 0.5)
+    processed = 0.9 * distorted + 0.1 * amplified
+    processed = np.sin(processed * np.pi)
+    max_val = np.max(np.abs(processed))
+    if max_val > 0.95:
+        processed *= 0.95 / max_val
+    return processed
+
+
+def original_stages():
+    return [
+        Gain(),
+        Scale(50),
+        Tap('amplified'),
+        Scale(2.5),
+        Clipper(1),
+        Waveshaper('sqrt'),
+        Mix('amplified', wet=0.9, dry=0.1),
+        Waveshaper('sin'),
+        PeakNormalizer(0.95),
+    ]
@@ -0,0 +1,150 @@
+"""
+audio_backend.SimulatedBackend: сбои и отключения доходят до колбэка, петля
+возвращает записанное; soak.py прогоняет каждый интерфейс без экрана.
+
+Запуск: python -m pytest tests
+"""
+
+import json
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+import pytest
+
+from audio_backend import PortAudioError, SimulatedBackend
+from events import INPUT_OVERFLOW, OUTPUT_UNDERFLOW, EventRing, status_flags
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BLOCK = 480
+RATE = 48000
+
+
+def duplex(backend, callback, **settings):
+    return backend.Stream(device=('Microphone', 'CABLE'), channels=2, samplerate=RATE,
+                          blocksize=BLOCK, callback=callback, **settings)
+
+
+def test_injected_xruns_reach_callback():
+    backend = SimulatedBackend(source='noise', xrun_rate=1.0)
+    events = EventRing()
+    flags = []
+
+    def callback(indata, outdata, frames, time, status):
+        flags.append(status_flags(status))
+        events.push_status(status)
+        outdata[:] = indata
+
+    with duplex(backend, callback) as stream:
+        backend.run(1.0)
+    # Каждый блок со случайным флагом; у дуплекса - любой из четырёх
+    assert len(flags) == RATE // BLOCK and all(flags)
+    assert sum(stream.report()[key] for key in ('input_underflow', 'input_overflow',
+                                                'output_underflow', 'output_overflow')) == len(flags)
+    assert events.flag_counts.sum() == len(flags)
+
+
+def test_slow_callback_underflows_next_block():
+    backend = SimulatedBackend(source='silence')
+    flags = []
+
+    def callback(indata, outdata, frames, time_info, status):
+        flags.append(status_flags(status))
+        if len(flags) == 3:
+            # Дольше блока (10 мс) и буфера устройства (5 мс)
+            time.sleep(0.03)
+
+    with duplex(backend, callback, latency='low'):
+        backend.run(0.1)
+    assert flags[3] == OUTPUT_UNDERFLOW
+    assert not any(flags[:3]) and not any(flags[4:])
+
+
+def test_input_only_stream_overflows():
+    backend = SimulatedBackend(source='silence')
+    flags = []
+
+    def callback(indata, frames, time_info, status):
+        flags.append(status_flags(status))
+        if len(flags) == 1:
+            time.sleep(0.05)
+
+    with backend.InputStream(device='Microphone', channels=2, samplerate=RATE, blocksize=BLOCK,
+                             latency='low', callback=callback):
+        backend.run(0.05)
+    assert flags[1] == INPUT_OVERFLOW
+
+
+def test_disconnect_stops_stream():
+    backend = SimulatedBackend(source='noise')
+    calls = []
+    finished = []
+    stream = backend.Stream(device=('Microphone', 'CABLE'), channels=2, samplerate=RATE,
+                            blocksize=BLOCK, callback=lambda *args: calls.append(args[-1]),
+                            finished_callback=lambda: finished.append(True))
+    backend.disconnect('Microphone', at=0.5)
+    stream.start()
+    backend.run(1.0)
+    # Колбэк больше не вызывается, поток неактивен, как у PortAudio при пропаже устройства
+    assert len(calls) == RATE // BLOCK // 2
+    assert stream.lost and not stream.active and finished == [True]
+    assert stream.report()['lost']
+    with pytest.raises(PortAudioError):
+        duplex(backend, lambda *args: None)
+    assert all('Microphone' not in info['name'] for info in backend.query_devices())
+
+    # После возвращения устройства работает новый поток
+    backend.reconnect('Microphone')
+    stream.close()
+    with pytest.raises(PortAudioError):
+        stream.start()
+    lost_at = len(calls)
+    with duplex(backend, lambda *args: calls.append(args[-1])):
+        backend.run(0.1)
+    assert len(calls) > lost_at
+
+
+def test_loopback_returns_written_output():
+    # Вход - только петля: тишина плюс выход loopback_delay назад, без ослабления
+    backend = SimulatedBackend(source='silence', loopback=1.0, loopback_delay=0.01)
+    rng = np.random.default_rng(0)
+    written = []
+    received = []
+
+    def callback(indata, outdata, frames, time_info, status):
+        received.append(indata.copy())
+        outdata[:] = rng.uniform(-1, 1, (frames, 1)).astype(np.float32)
+        written.append(outdata[:, 0].copy())
+
+    latency = 0.01
+    with duplex(backend, callback, latency=latency):
+        backend.run(1.0)
+    written = np.concatenate(written)
+    received = np.concatenate(received)
+    # Выход звучит через latency после своего блока, вход относится к блоку до колбэка:
+    # кадр входа n - это кадр выхода n - (блок + latency + задержка петли)
+    shift = BLOCK + int(round((latency + 0.01) * RATE))
+    assert not received[:shift].any()
+    assert np.array_equal(received[shift:, 0], written[:-shift])
+    assert np.array_equal(received[:, 1], received[:, 0])
+
+
+@pytest.mark.parametrize('front_end', ['app', 'cli', 'gui'])
+def test_soak_front_end(front_end, tmp_path):
+    if front_end == 'gui':
+        pytest.importorskip('PySide6')
+    report = tmp_path / 'soak.json'
+    environment = dict(os.environ, QT_QPA_PLATFORM='offscreen')
+    subprocess.run([sys.executable, os.path.join(ROOT, 'soak.py'), front_end, '--minutes', '0.2',
+                    '--xrun-rate', '0.05', '--json', str(report)],
+                   cwd=ROOT, env=environment, check=True, capture_output=True, timeout=120)
+    result = json.loads(report.read_text(encoding='utf-8'))
+    streams = [stream for stream in result['simulation']['streams'] if stream['callbacks']]
+    assert result['simulation']['virtual_seconds'] >= 12.0
+    assert streams and not any(stream['lost'] for stream in streams)
+    # Колбэк программы вызывался столько же раз, сколько его звала симуляция
+    assert result['callback']['callbacks'] == sum(stream['callbacks'] for stream in streams)
+    assert sum(stream['output_underflow'] + stream['input_overflow'] + stream['input_underflow']
+               + stream['output_overflow'] for stream in streams) > 0
@@ -0,0 +1,169 @@
+"""
+control: протокол JSON через Unix-сокет с усилителями app.py и mic_amplifier.py
+на SimulatedBackend.
+
+Запуск: python -m pytest tests
+"""
+
+import json
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import control
+import mic_amplifier
+from app import MicrophoneAmplifier
+from audio_backend import SimulatedBackend
+from device_cache import DeviceCache
+
+pytestmark = pytest.mark.skipif(not control.UNIX_SOCKETS, reason="нужны Unix-сокеты")
+
+
+@pytest.fixture
+def daemon(tmp_path):
+    """Усилитель службой в отдельном потоке; отдаёт (усилитель, путь к сокету)"""
+    path = str(tmp_path / 'control.sock')
+    backend = SimulatedBackend()
+    amplifier = MicrophoneAmplifier(backend=backend)
+    amplifier.device_cache = DeviceCache(str(tmp_path / 'devices.json'))
+    result = []
+    thread = threading.Thread(target=lambda: result.append(
+        amplifier.run_daemon('Simulated Microphone', 'CABLE Input', path)), daemon=True)
+    thread.start()
+    wait_for_socket(amplifier, path, thread)
+    yield amplifier, path
+    # После команды stop сокета уже может не быть, а поток ещё дописывает
+    if thread.is_alive() and connectable(path):
+        control.send({'cmd': 'stop'}, path)
+    thread.join(10.0)
+    assert result == [True]
+
+
+def wait_for_socket(amplifier, path, thread):
+    deadline = time.monotonic() + 10.0
+    while not (amplifier.stream is not None and connectable(path)):
+        assert thread.is_alive() and time.monotonic() < deadline, "служба не запустилась"
+        time.sleep(0.01)
+
+
+def connectable(path):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+        try:
+            probe.connect(path)
+        except OSError:
+            return False
+    return True
+
+
+def exchange(path, *lines):
+    """Отправить строки одним соединением и прочитать ответ на каждую"""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(10.0)
+        sock.connect(path)
+        with sock.makefile('rb') as f:
+            responses = []
+            for line in lines:
+                sock.sendall(line + b'\n')
+                responses.append(json.loads(f.readline()))
+            return responses
+
+
+def test_get_and_set_gain(daemon):
+    amplifier, path = daemon
+    assert control.send({'cmd': 'get_gain'}, path) == {'ok': True, 'gain': 5.0}
+    assert control.send({'cmd': 'set_gain', 'gain': 10}, path) == {'ok': True, 'gain': 10.0}
+    # Колбэк видит новый снимок параметров
+    assert amplifier.params.gain == 10.0
+    response = control.send({'cmd': 'set_gain', 'gain': -1}, path)
+    assert not response['ok'] and 'больше 0' in response['error']
+    response = control.send({'cmd': 'set_gain', 'gain': 'громко'}, path)
+    assert not response['ok'] and 'gain' in response['error']
+    assert control.send({'cmd': 'get_gain'}, path)['gain'] == 10.0
+
+
+def test_stats(daemon):
+    amplifier, path = daemon
+    # Виртуальное время: полсекунды колбэков прямо здесь
+    amplifier.backend.run(0.5)
+    stats = control.send({'cmd': 'stats'}, path)['stats']
+    assert stats['input'] == 'Simulated Microphone'
+    assert stats['output'].startswith('CABLE Input')
+    assert stats['active'] is True
+    assert stats['gain'] == 5.0
+    assert stats['callback']['callbacks'] > 0
+
+
+def test_malformed_messages(daemon):
+    _, path = daemon
+    responses = exchange(path, b'{"cmd": ', b'[1, 2]', b'{"cmd": "launch"}', b'{"cmd": "get_gain"}')
+    assert [response['ok'] for response in responses] == [False, False, False, True]
+    assert 'JSON' in responses[0]['error']
+    assert 'cmd' in responses[1]['error']
+    assert 'launch' in responses[2]['error']
+
+
+def test_concurrent_clients(daemon):
+    amplifier, path = daemon
+
+    def client(number):
+        gain = float(number + 1)
+        responses = exchange(path, *[json.dumps({'cmd': command, 'gain': gain}).encode()
+                                     for command in ('set_gain', 'get_gain', 'stats')])
+        return number, responses
+
+    with ThreadPoolExecutor(8) as pool:
+        results = list(pool.map(client, range(16)))
+    for number, (set_response, get_response, stats_response) in results:
+        assert set_response == {'ok': True, 'gain': float(number + 1)}
+        assert get_response['ok'] and stats_response['ok']
+    # Команды выполняются по одной: последнее усиление - одно из отправленных
+    assert amplifier.params.gain in {float(number + 1) for number in range(16)}
+
+
+def test_stop(daemon):
+    amplifier, path = daemon
+    assert control.send({'cmd': 'stop'}, path) == {'ok': True}
+    deadline = time.monotonic() + 10.0
+    while amplifier.stream is not None:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    # Сервер убрал за собой сокет
+    assert not connectable(path)
+
+
+def test_simple_mode_daemon(tmp_path):
+    path = str(tmp_path / 'simple.sock')
+    backend = SimulatedBackend()
+    amplifier = mic_amplifier.MicrophoneAmplifier(backend=backend)
+    thread = threading.Thread(target=amplifier.run, args=(amplifier.control_server(path),),
+                              daemon=True)
+    thread.start()
+    wait_for_socket(amplifier, path, thread)
+    assert control.send({'cmd': 'set_gain', 'gain': 2.5}, path) == {'ok': True, 'gain': 2.5}
+    backend.run(0.5)
+    stats = control.send({'cmd': 'stats'}, path)['stats']
+    assert stats['gain'] == 2.5 and stats['active'] and stats['callback']['callbacks'] > 0
+    # Устройства простого режима - по умолчанию, переключать их нечем
+    response = control.send({'cmd': 'switch_devices', 'input': 0, 'output': 1}, path)
+    assert not response['ok']
+    assert control.send({'cmd': 'stop'}, path) == {'ok': True}
+    thread.join(10.0)
+    assert not thread.is_alive() and amplifier.stream is None
+
+
+def test_claim_keeps_running_daemon(daemon, tmp_path):
+    _, path = daemon
+    # Второй экземпляр не отбирает сокет у запущенного
+    with pytest.raises(RuntimeError):
+        control.ControlServer({}, path).claim()
+    assert control.send({'cmd': 'get_gain'}, path)['ok']
+    # Сокет упавшего процесса (никто не слушает) убирается
+    stale = str(tmp_path / 'stale.sock')
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.bind(stale)
+    control.ControlServer({}, stale).claim()
+    assert not os.path.exists(stale)
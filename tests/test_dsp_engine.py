@@ -0,0 +1,134 @@
+"""
+Цепочки dsp_engine: память в колбэке, совпадение с исходной цепочкой окна и
+стыки блоков.
+
+Запуск: python -m pytest tests
+"""
+
+import tracemalloc
+
+import numpy as np
+import pytest
+
+from dsp_engine import (ENGINES, RUMBLE_FILTER, BiquadCascade, Chain, DistortionEngine, LevelMeter,
+                        MicLayout, MultiMicEngine, NoiseGate)
+from old_chain import original_distortion, original_stages
+
+FRAMES = 4096
+# Больше этого за вызов - уже буфер порядка блока (моно-блок float32 - 16 КБ).
+# Мелочь постоянного размера остаётся: скаляры, редукции, планы FFT numpy
+ALLOCATION_LIMIT = 8192
+
+
+def noise(frames, channels, level=0.1, seed=0):
+    rng = np.random.default_rng(seed)
+    return (level * rng.standard_normal((frames, channels))).astype(np.float32)
+
+
+def mono_stereo(frames, level=0.1):
+    """Одинаковые каналы: цепочка считает один и раскладывает по выходу"""
+    return np.repeat(noise(frames, 1, level), 2, axis=1)
+
+
+def peak_allocation(engine, indata, channels, gain, blocks=8):
+    """Наибольший пик памяти за вызов process после разогрева, байт"""
+    outdata = np.zeros((len(indata), channels), dtype=np.float32)
+    for _ in range(3):
+        engine.process(indata, outdata, gain)
+    tracemalloc.start()
+    try:
+        worst = 0
+        for _ in range(blocks):
+            base = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            engine.process(indata, outdata, gain)
+            worst = max(worst, tracemalloc.get_traced_memory()[1] - base)
+    finally:
+        tracemalloc.stop()
+    return worst
+
+
+def with_monitoring(engine, gate=None):
+    engine.gate = gate
+    engine.meter = LevelMeter()
+    return engine
+
+
+def table_engine():
+    engine = DistortionEngine()
+    engine.build_table_now(5.0)
+    assert engine.table is not None
+    return engine
+
+
+def multi_mic(layout, kind, agc=None):
+    return with_monitoring(MultiMicEngine(layout, kind, agc=agc))
+
+
+GAINS = np.array([1.0, 3.0, 5.0], dtype=np.float32)
+
+# Имя: (цепочка, вход, каналов выхода, усиление)
+CASES = {}
+for kind, engine_class in ENGINES.items():
+    CASES[f'{kind}-mono-stereo'] = lambda c=engine_class: (c(), mono_stereo(FRAMES), 2, 5.0)
+    CASES[f'{kind}-stereo'] = lambda c=engine_class: (c(), noise(FRAMES, 2), 2, 5.0)
+    CASES[f'{kind}-mono'] = lambda c=engine_class: (c(), noise(FRAMES, 1), 1, 5.0)
+    CASES[f'{kind}-rumble'] = lambda c=engine_class: (c(rumble=True), noise(FRAMES, 2), 2, 5.0)
+    CASES[f'{kind}-denoise-agc'] = lambda c=engine_class: (
+        with_monitoring(c(denoise=True, agc=-20.0), NoiseGate(-90.0, -95.0)),
+        noise(FRAMES, 2), 2, 5.0)
+    CASES[f'{kind}-gate-closed'] = lambda c=engine_class: (
+        with_monitoring(c(denoise=True), NoiseGate()), mono_stereo(FRAMES, 1e-5), 2, 5.0)
+    CASES[f'{kind}-mics'] = lambda k=kind: (
+        multi_mic(MicLayout((0, 1, 2)), k), noise(FRAMES, 3), 3, GAINS)
+    CASES[f'{kind}-mics-routed'] = lambda k=kind: (
+        multi_mic(MicLayout((2, 0, 1), (1, 0, 3)), k), noise(FRAMES, 3), 4, GAINS)
+    CASES[f'{kind}-mics-shared-agc'] = lambda k=kind: (
+        multi_mic(MicLayout((0, 1, 2), (0, 1, 1)), k, agc=-20.0), noise(FRAMES, 3), 2, GAINS)
+CASES['distortion-table'] = lambda: (table_engine(), noise(FRAMES, 2), 2, 5.0)
+
+
+@pytest.mark.parametrize('case', sorted(CASES))
+def test_callback_does_not_allocate_blocks(case):
+    engine, indata, channels, gain = CASES[case]()
+    engine.prepare(FRAMES, channels)
+    assert peak_allocation(engine, indata, channels, gain) < ALLOCATION_LIMIT
+
+
+@pytest.mark.parametrize('gain', [0.01, 0.3, 1.0, 7.5])
+@pytest.mark.parametrize('signal', ['mono-stereo', 'stereo'])
+def test_stages_match_original_chain(gain, signal):
+    chain = Chain(original_stages())
+    rng = np.random.default_rng(1)
+    for frames in (64, 1000, 4096, 5000):
+        level = rng.uniform(0.001, 0.5)
+        indata = mono_stereo(frames, level) if signal == 'mono-stereo' else noise(frames, 2, level)
+        outdata = np.zeros_like(indata)
+        chain.process(indata, outdata, gain)
+        assert np.array_equal(outdata, original_distortion(indata, gain))
+
+
+def run_blocks(stage, indata, sizes):
+    """Пропустить indata через этап кусками sizes, как из колбэка"""
+    chain = Chain([stage])
+    chain.prepare(max(sizes), indata.shape[1])
+    outdata = np.zeros_like(indata)
+    start = 0
+    for size in sizes:
+        chain.process(indata[start:start + size], outdata[start:start + size], 1.0)
+        start += size
+    return outdata
+
+
+def test_biquad_cascade_block_split():
+    # Шум с постоянной составляющей: фильтр должен и срезать её, и нести состояние между блоками
+    indata = noise(48000, 2) + np.float32(0.05)
+    whole = run_blocks(BiquadCascade(RUMBLE_FILTER), indata, [len(indata)])
+    rng = np.random.default_rng(1)
+    sizes = []
+    while sum(sizes) < len(indata):
+        sizes.append(int(min(rng.integers(1, 3000), len(indata) - sum(sizes))))
+    split = run_blocks(BiquadCascade(RUMBLE_FILTER), indata, sizes)
+    # Куски считаются другими матрицами, поэтому совпадение до округления float32
+    np.testing.assert_allclose(split, whole, rtol=0, atol=1e-6)
+    assert abs(whole[len(whole) // 2:].mean()) < 1e-3
@@ -0,0 +1,53 @@
+"""
+dsp_worker: надзор за процессом обработки.
+
+Запуск: python -m pytest tests
+"""
+
+import time
+
+from dsp_engine import AmpParams
+from dsp_worker import DspWorker
+from events import EVENT_RESTART
+from routing import ROUTE_CABLE
+
+# Отметка жизни проверяется строже, чем открывается устройство
+HEARTBEAT_TIMEOUT = 0.3
+OPEN_DELAY = 1.0
+
+
+def slow_config():
+    return dict(backend='simulated', simulation={'open_delay': OPEN_DELAY}, device=None,
+                sample_rate=48000, output_rate=48000, channels=(2, 2), block_size=256,
+                latency='low')
+
+
+def poll_restarts(worker, seconds):
+    """Сколько перезапусков процесса сообщил poll() за seconds (флаги колбэка не считаем)"""
+    restarts = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        restarts += sum(1 for event in worker.poll() if event[0] == EVENT_RESTART)
+        time.sleep(0.02)
+    return restarts
+
+
+def test_slow_open_is_not_a_hang():
+    worker = DspWorker(heartbeat_timeout=HEARTBEAT_TIMEOUT)
+    try:
+        worker.set_params(AmpParams(gain=1.0, route=ROUTE_CABLE))
+        worker.start(slow_config())
+        # Сразу после запуска отметка свежая
+        assert poll_restarts(worker, 2 * HEARTBEAT_TIMEOUT) == 0
+        assert worker.restarts == 0
+
+        # Упавший процесс перезапускается, и новый открывает устройство дольше
+        # heartbeat_timeout: пока он не ответил на запуск, это не зависание
+        worker.process.kill()
+        assert poll_restarts(worker, OPEN_DELAY + 3.0) == 1
+        assert worker.restarts == 1
+        assert worker.opening_until == 0.0
+        assert worker.process.is_alive()
+    finally:
+        worker.close()
+
@@ -0,0 +1,104 @@
+"""
+latency_tuner: выбор настройки потока на SimulatedDevice и хранение результата.
+
+Запуск: python -m pytest tests
+"""
+
+import json
+
+from latency_tuner import Candidate, LatencyTuner, SimulatedDevice, TuningStore, candidates
+
+SAMPLE_RATE = 48000
+BLOCK_SIZES = (64, 128, 256, 512, 1024, 2048)
+
+
+def make_callback(block_size):
+    # Обработка почти ничего не стоит: сбои дают только задержки пробуждения
+    def callback(indata, outdata, frames, time, status):
+        outdata[:] = indata
+    return callback
+
+
+def tune(device, margin=1, block_sizes=BLOCK_SIZES, open_stream=None):
+    tuner = LatencyTuner(open_stream or device.open_stream, make_callback, SAMPLE_RATE,
+                         seconds=2.0, margin=margin, sleep=device.sleep)
+    options = candidates(SAMPLE_RATE, device.latency_values, block_sizes)
+    return tuner.tune(options)
+
+
+def spiky_device(**settings):
+    # Выбросы пробуждения до 30 мс: 'low' (5 мс) до блока 2048 их не выдерживает,
+    # 'high' (40 мс) выдерживает с любым блоком
+    return SimulatedDevice(2, SAMPLE_RATE, wakeup_ms=0.0, spike_ms=30.0,
+                           spike_rate=0.2, **settings)
+
+
+def test_spikes_choose_first_clean_candidate_plus_margin():
+    chosen, results = tune(spiky_device())
+    # По возрастанию задержки: 'low' с блоками до 1024, затем 64 с 'high' - первый без сбоев
+    assert [(result.block_size, result.latency) for result in results] == [
+        (64, 'low'), (128, 'low'), (256, 'low'), (512, 'low'), (1024, 'low'), (64, 'high')]
+    assert all(result.xruns > 0 for result in results[:-1])
+    assert results[-1].clean
+    # Запас в один размер блока с той же задержкой
+    assert chosen == Candidate(128, 'high')
+
+
+def test_margin_is_capped_by_largest_block():
+    chosen, _ = tune(spiky_device(), margin=2)
+    assert chosen == Candidate(256, 'high')
+    chosen, _ = tune(spiky_device(), margin=10)
+    assert chosen == Candidate(2048, 'high')
+
+
+def test_quiet_device_takes_smallest_block():
+    chosen, results = tune(SimulatedDevice(2, SAMPLE_RATE, wakeup_ms=0.0, spike_rate=0.0),
+                           margin=0)
+    assert chosen == Candidate(64, 'low')
+    assert len(results) == 1 and results[0].callbacks == 2 * SAMPLE_RATE // 64
+
+
+def test_injected_xruns_reject_every_candidate():
+    chosen, results = tune(SimulatedDevice(2, SAMPLE_RATE, wakeup_ms=0.0, spike_rate=0.0,
+                                           xrun_rate=0.05))
+    assert chosen is None
+    assert len(results) == 2 * len(BLOCK_SIZES)
+    assert all(result.xruns > 0 and result.error is None for result in results)
+
+
+def test_candidate_that_does_not_open_is_skipped():
+    device = SimulatedDevice(2, SAMPLE_RATE, wakeup_ms=0.0, spike_rate=0.0)
+
+    def open_stream(block_size, latency, callback):
+        if block_size < 256:
+            raise RuntimeError("blocksize не поддерживается")
+        return device.open_stream(block_size, latency, callback)
+
+    chosen, results = tune(device, margin=0, open_stream=open_stream)
+    assert [result.error is not None for result in results] == [True, True, False]
+    assert chosen == Candidate(256, 'low')
+
+
+def test_store_round_trip(tmp_path):
+    path = str(tmp_path / 'tuning' / 'latency.json')
+    store = TuningStore(path)
+    assert store.get('Микрофон', 'CABLE Input', 48000) is None
+
+    chosen, results = tune(spiky_device())
+    store.put('Микрофон', 'CABLE Input', 48000, chosen, results)
+    store.put('Микрофон', 'Динамики', 44100, Candidate(512, 0.02))
+
+    reopened = TuningStore(path)
+    assert reopened.get('Микрофон', 'CABLE Input', 48000) == chosen
+    assert reopened.get('Микрофон', 'Динамики', 44100) == Candidate(512, 0.02)
+    # Другая частота - другая запись
+    assert reopened.get('Микрофон', 'CABLE Input', 44100) is None
+    entry = reopened.load()[TuningStore.key('Микрофон', 'CABLE Input', 48000)]
+    assert [soak['block_size'] for soak in entry['soaks']] == [r.block_size for r in results]
+    assert json.loads(open(path, encoding='utf-8').read()) == reopened.load()
+
+
+def test_store_ignores_damaged_file(tmp_path):
+    path = tmp_path / 'latency.json'
+    path.write_text('{не json', encoding='utf-8')
+    assert TuningStore(str(path)).get('Микрофон', 'CABLE Input', 48000) is None
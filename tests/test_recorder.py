@@ -0,0 +1,179 @@
+"""
+recorder: кольцо кадров, потери при переполнении, ротация и закрытие файлов.
+
+Запуск: python -m pytest tests
+"""
+
+import os
+
+import numpy as np
+import pytest
+
+import recorder
+from recorder import FrameRing, Recorder
+from wav_io import open_wav
+
+SAMPLE_RATE = 1000
+
+
+class FakeWriter:
+    """Писатель в память с интерфейсом WavWriter; все созданные - в FakeWriter.opened"""
+
+    opened = []
+
+    def __init__(self, path, sample_rate, channels):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.frames = 0
+        self.blocks = []
+        self.flushes = 0
+        self.closed = False
+        FakeWriter.opened.append(self)
+
+    def write(self, block):
+        assert not self.closed
+        self.blocks.append(np.array(block))
+        self.frames += len(block)
+
+    def flush(self):
+        self.flushes += 1
+
+    def close(self):
+        self.closed = True
+
+    @property
+    def data(self):
+        return np.concatenate(self.blocks)
+
+
+@pytest.fixture
+def fake_writer(monkeypatch):
+    FakeWriter.opened = []
+    monkeypatch.setitem(recorder.WRITERS, '.wav', FakeWriter)
+    return FakeWriter
+
+
+def ramp(start, frames, channels):
+    """Кадры с номерами: по ним видно, что ничего не переставилось и не потерялось"""
+    values = np.arange(start, start + frames, dtype=np.float32)
+    return np.repeat(values[:, None], channels, axis=1)
+
+
+def ring(capacity, channels, dry_channels=0):
+    return FrameRing(np.zeros((capacity, channels + dry_channels), dtype=np.float32), channels)
+
+
+def test_ring_wraparound():
+    frame_ring = ring(10, 2, 1)
+    out = np.zeros((10, 3), dtype=np.float32)
+    received = []
+    written = 0
+    # Блоки по 3 кадра через кольцо на 10: начало блока обходит всё кольцо
+    for _ in range(20):
+        frame_ring.push(ramp(written, 3, 2), -ramp(written, 3, 1))
+        written += 3
+        count = frame_ring.read_into(out[:4 if written % 2 else 3])
+        received.append(out[:count].copy())
+    while True:
+        count = frame_ring.read_into(out)
+        if not count:
+            break
+        received.append(out[:count].copy())
+    received = np.concatenate(received)
+    assert np.array_equal(received[:, :2], ramp(0, written, 2))
+    assert np.array_equal(received[:, 2:], -ramp(0, written, 1))
+    assert frame_ring.overruns == 0
+
+
+def test_ring_overrun_drops_whole_blocks():
+    frame_ring = ring(8, 1)
+    frame_ring.push(ramp(0, 5, 1))
+    # Не помещается целиком: блок отброшен и посчитан, кольцо не тронуто
+    frame_ring.push(ramp(5, 5, 1))
+    frame_ring.push(ramp(10, 3, 1))
+    frame_ring.push(ramp(13, 1, 1))
+    assert frame_ring.overruns == 2
+    assert frame_ring.dropped_frames == 6
+    out = np.zeros((8, 1), dtype=np.float32)
+    assert frame_ring.read_into(out) == 8
+    assert np.array_equal(out[:, 0], [0, 1, 2, 3, 4, 10, 11, 12])
+
+
+def test_recorder_counts_overruns(tmp_path, fake_writer):
+    # Поток записи не запущен: кольцо на 50 кадров переполняется
+    rec = Recorder(str(tmp_path / 'out.wav'), SAMPLE_RATE, 2, ring_seconds=0.05)
+    for block in range(10):
+        rec.push(ramp(block * 10, 10, 2))
+    assert (rec.overruns, rec.dropped_frames) == (5, 50)
+    assert 'потеряно блоков 5' in rec.format()
+    rec.start()
+    rec.stop()
+    assert np.array_equal(fake_writer.opened[0].data, ramp(0, 50, 2))
+
+
+def test_rotation_by_duration(tmp_path, fake_writer):
+    rec = Recorder(str(tmp_path / 'session.wav'), SAMPLE_RATE, 2, dry_channels=1,
+                   max_seconds=0.3, interval=0.01)
+    rec.start()
+    for block in range(10):
+        rec.push(ramp(block * 70, 70, 2), ramp(block * 70, 70, 1))
+    rec.stop()
+    # 700 кадров по 300 на файл: три пары файлов (обработанный и -dry)
+    wet = [writer for writer in fake_writer.opened if not writer.path.endswith('-dry.wav')]
+    dry = [writer for writer in fake_writer.opened if writer.path.endswith('-dry.wav')]
+    assert [writer.frames for writer in wet] == [300, 300, 100]
+    assert [writer.frames for writer in dry] == [300, 300, 100]
+    assert rec.files == [writer.path for writer in wet]
+    assert [os.path.basename(path)[-8:] for path in rec.files] == ['-001.wav', '-002.wav',
+                                                                  '-003.wav']
+    assert np.array_equal(np.concatenate([writer.data for writer in wet]), ramp(0, 700, 2))
+    assert np.array_equal(np.concatenate([writer.data for writer in dry]), ramp(0, 700, 1))
+    assert rec.written_frames == 700
+
+
+def test_rotation_by_size_of_wav(tmp_path):
+    # 56 байт заголовка и 100 кадров по 2 канала float32
+    rec = Recorder(str(tmp_path / 'rec' / 'take.wav'), SAMPLE_RATE, 2,
+                   max_bytes=56 + 100 * 8, interval=0.01)
+    assert rec.max_frames == 100
+    rec.start()
+    rec.push(ramp(0, 250, 2))
+    rec.stop()
+    assert len(rec.files) == 3
+    assert [os.path.getsize(path) for path in rec.files] == [856, 856, 456]
+    data = np.concatenate([open_wav(path).data for path in rec.files])
+    assert np.array_equal(data, ramp(0, 250, 2))
+
+
+def test_stop_drains_and_closes(tmp_path, fake_writer):
+    rec = Recorder(str(tmp_path / 'out.wav'), SAMPLE_RATE, 1, interval=60.0)
+    rec.start()
+    rec.push(ramp(0, 123, 1))
+    # Период записи минута: всё дописывает stop()
+    rec.stop()
+    writer, = fake_writer.opened
+    assert writer.frames == 123 and writer.closed and writer.flushes >= 1
+    assert rec.error is None
+    # Повторная остановка ничего не делает
+    rec.stop()
+    assert len(fake_writer.opened) == 1
+
+
+def test_write_error_closes_file(tmp_path, fake_writer, monkeypatch):
+    def broken(self, block):
+        raise OSError("No space left on device")
+
+    monkeypatch.setattr(FakeWriter, 'write', broken)
+    rec = Recorder(str(tmp_path / 'out.wav'), SAMPLE_RATE, 1, interval=0.01)
+    rec.start()
+    rec.push(ramp(0, 10, 1))
+    rec.stop()
+    assert isinstance(rec.error, OSError)
+    assert fake_writer.opened[0].closed
+    assert 'ошибка' in rec.format()
+
+
+def test_unknown_format(tmp_path):
+    with pytest.raises(ValueError):
+        Recorder(str(tmp_path / 'out.mp3'), SAMPLE_RATE, 2)
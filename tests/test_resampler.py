@@ -0,0 +1,94 @@
+"""
+resampler: стыки блоков, точность на синусе, задержка и очередь кадров.
+
+Запуск: python -m pytest tests
+"""
+
+import numpy as np
+import pytest
+
+from resampler import FrameFifo, PolyphaseResampler
+
+RATES = [(44100, 48000), (48000, 44100), (48000, 16000), (16000, 48000)]
+
+
+def resample(resampler, indata, sizes):
+    """Пропустить indata кусками sizes, как из колбэка входа"""
+    resampler.prepare(max(sizes))
+    output = []
+    start = 0
+    for size in sizes:
+        output.append(resampler.process(indata[start:start + size]).copy())
+        start += size
+    return np.concatenate(output)
+
+
+def random_sizes(total, largest, seed=1):
+    rng = np.random.default_rng(seed)
+    sizes = []
+    while sum(sizes) < total:
+        sizes.append(int(min(rng.integers(1, largest), total - sum(sizes))))
+    return sizes
+
+
+@pytest.mark.parametrize('in_rate, out_rate', RATES)
+def test_block_split_invariance(in_rate, out_rate):
+    indata = (0.3 * np.random.default_rng(0).standard_normal((20000, 2))).astype(np.float32)
+    whole = resample(PolyphaseResampler(in_rate, out_rate), indata, [len(indata)])
+    split = resample(PolyphaseResampler(in_rate, out_rate), indata, random_sizes(len(indata), 700))
+    # Каждый выходной отсчёт считается из тех же окна и коэффициентов
+    assert np.array_equal(split, whole)
+    # Выходных кадров столько, сколько покрыто входом за вычетом хвоста фильтра
+    expected = len(indata) * out_rate / in_rate
+    assert abs(len(whole) - expected) <= out_rate / in_rate + 1
+
+
+@pytest.mark.parametrize('in_rate, out_rate', RATES)
+@pytest.mark.parametrize('quality, error', [('low', 3e-3), ('medium', 3e-4), ('high', 3e-5)])
+def test_sine_accuracy_and_delay(in_rate, out_rate, quality, error):
+    frequency = 1000.0
+    resampler = PolyphaseResampler(in_rate, out_rate, channels=1, quality=quality)
+    indata = np.sin(2 * np.pi * frequency * np.arange(in_rate) / in_rate)
+    output = resample(resampler, indata.astype(np.float32)[:, None], [1024] * (in_rate // 1024 + 1))
+    # Выход отстаёт на delay кадров входа: отсчёт j - это момент j / out_rate - delay / in_rate
+    moments = np.arange(len(output)) / out_rate - resampler.delay / in_rate
+    expected = np.sin(2 * np.pi * frequency * moments)
+    settled = slice(len(output) // 4, None)
+    assert np.abs(output[settled, 0] - expected[settled]).max() < error
+
+
+def test_fifo_underrun_reads_what_is_there():
+    fifo = FrameFifo(8, 2)
+    assert fifo.write(np.ones((3, 2), dtype=np.float32)) == 3
+    outdata = np.full((5, 2), -1.0, dtype=np.float32)
+    # Недобор: прочитано три кадра, остальное вызывающий дополняет сам
+    assert fifo.read_into(outdata) == 3
+    assert np.array_equal(outdata[:3], np.ones((3, 2)))
+    assert np.array_equal(outdata[3:], np.full((2, 2), -1.0))
+    assert fifo.available == 0
+    assert fifo.read_into(outdata) == 0
+
+
+def test_fifo_overrun_drops_the_rest():
+    fifo = FrameFifo(8, 1)
+    frames = np.arange(12, dtype=np.float32)[:, None]
+    # Переполнение: записано сколько поместилось, лишние кадры не затирают непрочитанные
+    assert fifo.write(frames) == 8
+    assert fifo.write(frames) == 0
+    outdata = np.zeros((8, 1), dtype=np.float32)
+    assert fifo.read_into(outdata) == 8
+    assert np.array_equal(outdata, frames[:8])
+
+
+def test_fifo_wraparound_keeps_order():
+    fifo = FrameFifo(7, 2)
+    rng = np.random.default_rng(0)
+    stream = rng.standard_normal((500, 2)).astype(np.float32)
+    written = read = 0
+    received = np.zeros_like(stream)
+    while read < len(stream):
+        size = int(rng.integers(1, 6))
+        written += fifo.write(stream[written:written + size])
+        count = fifo.read_into(received[read:read + int(rng.integers(1, 6))])
+        read += count
+    assert np.array_equal(received, stream)
@@ -0,0 +1,169 @@
+import struct
+
+import numpy as np
+
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+# Форматы, которые можно отобразить в память напрямую: (формат, бит) -> (dtype, масштаб)
+_SAMPLE_TYPES = {
+    (WAVE_FORMAT_PCM, 16): ('<i2', 1.0 / 32768),
+    # 24 бита numpy отобразить не может: байты отсчёта читаются в старшие байты int32
+    (WAVE_FORMAT_PCM, 24): ('u1', 1.0 / 2147483648),
+    (WAVE_FORMAT_PCM, 32): ('<i4', 1.0 / 2147483648),
+    (WAVE_FORMAT_IEEE_FLOAT, 32): ('<f4', None),
+}
+
+
+class AudioFile:
+    """Аудиофайл, отображённый в память: данные читаются с диска по мере обращения"""
+
+    def __init__(self, data, sample_rate, scale=None):
+        self.data = data
+        self.sample_rate = sample_rate
+        self.scale = scale
+        self.frames, self.channels = data.shape[:2]
+        # Для 24-битных отсчётов: (кадр, канал, 4 байта), младший байт всегда 0
+        self._widened = None
+
+    def read_into(self, start, out):
+        """Скопировать кадры начиная с start в out (float32), вернуть число кадров"""
+        chunk = self.data[start:start + len(out)]
+        frames = len(chunk)
+        if chunk.ndim == 3:
+            if self._widened is None or len(self._widened) < frames:
+                self._widened = np.zeros((len(out), self.channels, 4), dtype=np.uint8)
+            widened = self._widened[:frames]
+            widened[:, :, 1:] = chunk
+            chunk = widened.view('<i4')[:, :, 0]
+        if self.scale is None:
+            out[:frames] = chunk
+        else:
+            # Целые отсчёты переводим в float32 так же, как это делает PortAudio
+            np.multiply(chunk, np.float32(self.scale), out=out[:frames])
+        return frames
+
+
+def open_wav(path):
+    """Открыть WAV-файл без загрузки в память"""
+    with open(path, 'rb') as f:
+        riff, _, wave = struct.unpack('<4sI4s', f.read(12))
+        if riff != b'RIFF' or wave != b'WAVE':
+            raise ValueError(f"{path}: это не WAV-файл")
+
+        fmt = None
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                raise ValueError(f"{path}: не найден блок данных")
+            chunk_id, chunk_size = struct.unpack('<4sI', header)
+            if chunk_id == b'fmt ':
+                body = f.read(chunk_size)
+                tag, channels, sample_rate, _, _, bits = struct.unpack('<HHIIHH', body[:16])
+                if tag == WAVE_FORMAT_EXTENSIBLE:
+                    # Настоящий формат лежит в первых байтах GUID подформата
+                    tag = struct.unpack('<H', body[24:26])[0]
+                fmt = (tag, channels, sample_rate, bits)
+            elif chunk_id == b'data':
+                offset = f.tell()
+                break
+            else:
+                f.seek(chunk_size, 1)
+            if chunk_size % 2:
+                f.seek(1, 1)
+
+    if fmt is None:
+        raise ValueError(f"{path}: не найден блок формата")
+    tag, channels, sample_rate, bits = fmt
+    if (tag, bits) not in _SAMPLE_TYPES:
+        kind = 'float' if tag == WAVE_FORMAT_IEEE_FLOAT else 'PCM' if tag == WAVE_FORMAT_PCM else tag
+        raise ValueError(f"{path}: неподдерживаемый формат ({kind}, {bits} бит); читаются PCM "
+                         f"16, 24 и 32 бита и float 32 бита")
+
+    dtype, scale = _SAMPLE_TYPES[(tag, bits)]
+    frames = chunk_size // (channels * bits // 8)
+    shape = (frames, channels, 3) if bits == 24 else (frames, channels)
+    data = np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=shape)
+    return AudioFile(data, sample_rate, scale)
+
+
+def open_raw(path, sample_rate, channels):
+    """Открыть файл сырых отсчётов float32 без заголовка"""
+    data = np.memmap(path, dtype='<f4', mode='r')
+    frames = len(data) // channels
+    return AudioFile(data[:frames * channels].reshape(frames, channels), sample_rate)
+
+
+class WavWriter:
+    """Последовательная запись float32 WAV; размеры в заголовке дописываются при закрытии"""
+
+    def __init__(self, path, sample_rate, channels):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.frames = 0
+        self._file = open(path, 'wb')
+        self._write_header()
+
+    def _write_header(self):
+        data_size = self.frames * self.channels * 4
+        self._file.write(struct.pack(
+            '<4sI4s4sIHHIIHH4sII4sI',
+            b'RIFF', 48 + data_size, b'WAVE',
+            b'fmt ', 16, WAVE_FORMAT_IEEE_FLOAT, self.channels, self.sample_rate,
+            self.sample_rate * self.channels * 4, self.channels * 4, 32,
+            b'fact', 4, self.frames,
+            b'data', data_size,
+        ))
+
+    def write(self, block):
+        block = np.ascontiguousarray(block, dtype='<f4')
+        self._file.write(block.data)
+        self.frames += len(block)
+
+    def flush(self):
+        """Дописать размеры в заголовок, не закрывая файл: запись читается и после сбоя"""
+        position = self._file.tell()
+        self._file.seek(0)
+        self._write_header()
+        self._file.seek(position)
+        self._file.flush()
+
+    def close(self):
+        if self._file.closed:
+            return
+        self._file.seek(0)
+        self._write_header()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class RawWriter:
+    """Последовательная запись сырых отсчётов float32"""
+
+    def __init__(self, path, sample_rate, channels):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.frames = 0
+        self._file = open(path, 'wb')
+
+    def write(self, block):
+        block = np.ascontiguousarray(block, dtype='<f4')
+        self._file.write(block.data)
+        self.frames += len(block)
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()